@@ -1,8 +1,16 @@
 import logging
-from logging.handlers import RotatingFileHandler
 from flask import Flask, jsonify, request
 from config import config
 from extensions import db, migrate, jwt, bcrypt, mail, cache, limiter
+from services.view_counter import view_counter
+from services.email_outbox import email_outbox
+from services.notification_stream import notification_stream
+from services.thumbnails import thumbnailer
+from services.similarity import similarity_index
+from services.structured_logging import structured_logging
+from services.metrics import metrics
+from services.query_diagnostics import query_diagnostics
+from services.response_cache import check_cache_backend
 import os
 
 def create_app(config_name=None):
@@ -10,14 +18,25 @@ def create_app(config_name=None):
     config_name = config_name or os.getenv('FLASK_ENV', 'default')
     app.config.from_object(config[config_name])
 
+    # Journalisation d'abord : les hooks de requête suivants sont chronométrés
+    structured_logging.init_app(app)
+
     # Initialisation des extensions
     db.init_app(app)
+    metrics.init_app(app)
+    query_diagnostics.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
     bcrypt.init_app(app)
     mail.init_app(app)
     cache.init_app(app)
+    check_cache_backend(app)
     limiter.init_app(app)
+    view_counter.init_app(app)
+    email_outbox.init_app(app)
+    notification_stream.init_app(app)
+    thumbnailer.init_app(app)
+    similarity_index.init_app(app)
     
     # Configure CORS
     from flask_cors import CORS
@@ -39,16 +58,19 @@ def create_app(config_name=None):
     app.register_blueprint(admin_bp, url_prefix='/api/admin')
     app.register_blueprint(notifications_bp, url_prefix='/api/notifications')
 
-    # --- LOGGING SETUP ---
-    log_level = logging.INFO if os.getenv('FLASK_ENV') == 'production' else logging.DEBUG
-    formatter = logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
-    handler = RotatingFileHandler('app.log', maxBytes=1_000_000, backupCount=3)
-    handler.setFormatter(formatter)
-    handler.setLevel(log_level)
-    logging.getLogger().setLevel(log_level)
-    if not logging.getLogger().handlers:
-        logging.getLogger().addHandler(handler)
-    # --- END LOGGING SETUP ---
+    # Commandes CLI (flask search rebuild, ...)
+    from services.search import search_cli
+    app.cli.add_command(search_cli)
+    from services.counters import counters_cli
+    app.cli.add_command(counters_cli)
+    from services.analytics import analytics_cli
+    app.cli.add_command(analytics_cli)
+    from services.email_outbox import outbox_cli
+    app.cli.add_command(outbox_cli)
+    from services.unread_counters import notifications_cli
+    app.cli.add_command(notifications_cli)
+    from services.attachment_store import attachments_cli
+    app.cli.add_command(attachments_cli)
 
     # Gestion centralisée des erreurs
     @app.errorhandler(404)
@@ -70,10 +92,7 @@ def create_app(config_name=None):
     def index():
         return jsonify({"message": "Welcome to the Student Feedback API"})
 
-    print('--- ROUTES ACTIVES ---')
-    for rule in app.url_map.iter_rules():
-        print(rule)
-    print('----------------------')
+    app.logger.debug("Active routes", extra={'routes': sorted(str(rule) for rule in app.url_map.iter_rules())})
     return app
 
 # Pour le développement local
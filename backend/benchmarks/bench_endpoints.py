@@ -0,0 +1,93 @@
+"""
+Benchmarks en processus des endpoints chauds (pytest-benchmark).
+
+Hors de la suite de tests par défaut (fichier ``bench_*``), à lancer
+explicitement depuis ``backend/`` :
+
+    pytest benchmarks/bench_endpoints.py --benchmark-json=bench.json
+
+Comparer à une référence : ``--benchmark-save=<nom>`` sur la branche de base,
+puis ``--benchmark-compare=<nom>`` (ou ``pytest-benchmark compare a.json b.json``).
+"""
+
+import pytest
+
+PROBLEMS_URL = '/api/problems/'
+
+
+def get_ok(client, url, headers):
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response
+
+
+@pytest.mark.parametrize('query', [
+    '',
+    'category=Informatique',
+    'urgency=3',
+    'status=Soumis',
+    'room=B1',
+    'search=panne+connexion',
+    'sort_by=priority',
+    'sort_by=urgency',
+    'sort_by=likes',
+    'sort_by=created_at&sort_order=asc',
+    'page=50',
+    'include_total=true&category=Chauffage&sort_by=likes',
+])
+def test_problem_list_admin(benchmark, bench_client, admin_headers, query):
+    benchmark(get_ok, bench_client, f'{PROBLEMS_URL}?{query}', admin_headers)
+
+
+@pytest.mark.parametrize('sort_by', ['created_at', 'priority', 'likes'])
+def test_problem_list_cursor(benchmark, bench_client, admin_headers, sort_by):
+    # Ten pages deep: the cost of a cursor page must not grow with the depth
+    cursor = ''
+    for _ in range(10):
+        url = f'{PROBLEMS_URL}?sort_by={sort_by}&cursor={cursor}'
+        cursor = get_ok(bench_client, url, admin_headers).get_json()['pagination']['next_cursor']
+    benchmark(get_ok, bench_client, f'{PROBLEMS_URL}?sort_by={sort_by}&cursor={cursor}', admin_headers)
+
+
+@pytest.mark.parametrize('query', ['', 'status=Soumis', 'sort_by=priority'])
+def test_problem_list_student(benchmark, bench_client, student_headers, query):
+    benchmark(get_ok, bench_client, f'{PROBLEMS_URL}?{query}', student_headers)
+
+
+def test_problem_detail(benchmark, bench_client, admin_headers, dataset):
+    benchmark(get_ok, bench_client, f"{PROBLEMS_URL}{dataset['problems'] // 2}", admin_headers)
+
+
+def test_like_toggle(benchmark, bench_client, student_headers, dataset):
+    url = f"{PROBLEMS_URL}{dataset['problems'] // 3}/like"
+
+    def toggle():
+        # Like then unlike: every round leaves the data as it found it
+        for _ in range(2):
+            assert bench_client.post(url, headers=student_headers).status_code == 200
+
+    benchmark(toggle)
+
+
+@pytest.mark.parametrize('role', ['admin', 'student'])
+def test_problem_stats(benchmark, bench_client, admin_headers, student_headers, role):
+    headers = admin_headers if role == 'admin' else student_headers
+    benchmark(get_ok, bench_client, f'{PROBLEMS_URL}stats', headers)
+
+
+def test_admin_dashboard(benchmark, bench_client, admin_headers):
+    benchmark(get_ok, bench_client, '/api/admin/dashboard', admin_headers)
+
+
+@pytest.mark.parametrize('days', [30, 365])
+def test_admin_analytics(benchmark, bench_client, admin_headers, days):
+    benchmark(get_ok, bench_client, f'/api/admin/analytics?days={days}', admin_headers)
+
+
+@pytest.mark.parametrize('query', ['', 'unread_only=true', 'type=comment'])
+def test_notifications(benchmark, bench_client, student_headers, query):
+    benchmark(get_ok, bench_client, f'/api/notifications/?{query}', student_headers)
+
+
+def test_unread_count(benchmark, bench_client, student_headers):
+    benchmark(get_ok, bench_client, '/api/notifications/unread-count', student_headers)
@@ -0,0 +1,76 @@
+"""
+Fixtures des benchmarks : une application create_app('testing') et un jeu de
+données synthétique partagés par toute la session.
+
+La taille se règle par variables d'environnement : ``BENCHMARK_USERS``
+(1000 par défaut), ``BENCHMARK_PROBLEMS`` (20000) et ``BENCHMARK_SEED`` (0).
+Le cache de réponses est coupé : chaque mesure passe par la base.
+"""
+
+import os
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app import create_app
+from benchmarks.dataset import ADMIN_EMAIL, generate_dataset
+from extensions import db as _db
+from models import Problem, User
+from services.view_counter import view_counter
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+@pytest.fixture(scope='session')
+def bench_app():
+    app = create_app('testing')
+    app.config['RESPONSE_CACHE_ENABLED'] = False
+    with app.app_context():
+        _db.create_all()
+        yield app
+        view_counter.stop()
+        _db.session.remove()
+        _db.drop_all()
+
+
+@pytest.fixture(scope='session')
+def dataset(bench_app):
+    """Row counts of the generated tables"""
+    return generate_dataset(
+        users=_env_int('BENCHMARK_USERS', 1000),
+        problems=_env_int('BENCHMARK_PROBLEMS', 20000),
+        seed=_env_int('BENCHMARK_SEED', 0)
+    )
+
+
+@pytest.fixture(scope='session')
+def bench_client(bench_app, dataset):
+    return bench_app.test_client()
+
+
+def _headers(user):
+    token = create_access_token(
+        identity=str(user.id),
+        additional_claims={'role': user.role, 'email': user.email}
+    )
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture(scope='session')
+def admin_headers(dataset):
+    return _headers(_db.session.query(User).filter_by(email=ADMIN_EMAIL).one())
+
+
+@pytest.fixture(scope='session')
+def student(dataset):
+    """The student with the most problems (the heaviest "my problems" listing)"""
+    user_id = _db.session.query(Problem.user_id).group_by(Problem.user_id)\
+        .order_by(_db.func.count().desc(), Problem.user_id).limit(1).scalar()
+    return _db.session.get(User, user_id)
+
+
+@pytest.fixture(scope='session')
+def student_headers(student):
+    return _headers(student)
@@ -0,0 +1,261 @@
+"""
+Jeu de données synthétique pour les benchmarks.
+
+``generate_dataset`` remplit la base SQLite de l'application courante avec des
+utilisateurs, problèmes, likes, commentaires et notifications. Les lignes sont
+produites par SQLite lui-même (``INSERT ... SELECT`` sur une CTE récursive) :
+aucune ligne ne passe par Python, des millions de lignes se chargent en
+quelques secondes. Les valeurs « aléatoires » sont un hachage entier du numéro
+de ligne et de ``seed`` : deux exécutions avec les mêmes paramètres donnent
+exactement les mêmes données, ce qui rend les benchmarks comparables.
+
+Les index secondaires et l'index plein texte sont reconstruits une fois à la
+fin plutôt que ligne par ligne, et les colonnes dénormalisées (compteurs de problèmes, compteurs de non-lues,
+agrégats analytics) sont recalculées par les services qui les maintiennent,
+comme après une restauration.
+
+Utilisable seul pour peupler une base de développement vide :
+``python -m benchmarks.dataset --users 5000 --problems 100000``
+"""
+
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import User, ProblemStatus
+
+ADMIN_EMAIL = 'admin@bench.local'
+# Distinct descriptions and comments drawn from WORDS (full-text search material)
+SENTENCE_COUNT = 1000
+# Modulus of the row hash (a prime below 2**31: products stay in 64-bit integers)
+_PRIME = 2147483647
+
+PROMOTIONS = ('B1', 'B2', 'B3', 'M1', 'M2', 'SN1', 'SN2')
+CATEGORIES = {
+    'Informatique': ('Projecteur', 'Ordinateur', 'Wifi', 'Imprimante'),
+    'Chauffage': ('Radiateur', 'Climatisation', 'Ventilation'),
+    'Mobilier': ('Chaise', 'Table', 'Tableau'),
+    'Sanitaires': ('Fuite', 'Robinet', 'Toilettes'),
+    'Électricité': ('Prise', 'Éclairage', 'Disjoncteur'),
+}
+WORDS = (
+    'le', 'la', 'ne', 'fonctionne', 'plus', 'depuis', 'hier', 'matin', 'écran', 'câble',
+    'bruit', 'panne', 'cassé', 'froid', 'chaud', 'lent', 'connexion', 'salle', 'cours',
+    'prise', 'lumière', 'clignote', 'bloqué', 'mouillé', 'odeur', 'porte', 'fenêtre',
+)
+NOTIFICATION_TYPES = ('problem_update', 'comment', 'system')
+STATES = tuple(status.value for status in ProblemStatus)
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class _RowHash(object):
+    """SQL expressions of deterministic pseudo-random integers in [0, 2**31)"""
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.salts = 0
+
+    def __call__(self, row):
+        # Each call gets its own constants: the columns of a row are independent
+        self.salts += 1
+        rng = random.Random(f'{self.seed}:{self.salts}')
+        multiplier, offset, mix = (rng.randrange(1, _PRIME) for _ in range(3))
+        first = f"((({row}) * {multiplier % 1000003 + 1} + {offset}) % {_PRIME})"
+        return f"(({first} * {first} % {_PRIME}) * 48271 + {mix}) % {_PRIME}"
+
+    def pick(self, row, values):
+        """SQL expression choosing one of ``values`` (literals)"""
+        choice = f"({self(row)}) % {len(values)}"
+        return f"CASE {choice} " + ' '.join(
+            f"WHEN {index} THEN {_quote(value)}" for index, value in enumerate(values)
+        ) + " END"
+
+
+def _sequence(name, count):
+    return (f"{name}(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM {name} WHERE n < {int(count)})")
+
+
+def _drop_indexes(connection, tables):
+    """Drop the secondary indexes of ``tables``, returning their ``CREATE INDEX`` statements"""
+    rows = connection.exec_driver_sql(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN (%s)"
+        % ', '.join(_quote(table) for table in tables)
+    ).fetchall()
+    for name, _ in rows:
+        connection.exec_driver_sql(f'DROP INDEX "{name}"')
+    return [sql for _, sql in rows]
+
+
+def generate_dataset(users=1000, problems=10000, likes_per_problem=3, comments_per_problem=2,
+                     notifications_per_user=20, broadcasts=10, days=365, seed=0):
+    """Bulk-load a synthetic dataset into the current app's (empty, SQLite) database.
+
+    User 1 is an admin (``ADMIN_EMAIL``), user 2 a moderator, the others are
+    students. Per-problem and per-user amounts are averages (uniform from 0 to
+    twice the value). Returns the row count of each table.
+    """
+    connection = db.session.connection()
+    rand = _RowHash(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    span = days * 86400
+    params = {'start': str(now - timedelta(days=days)), 'now': str(now)}
+
+    def stamp(offset):
+        # SQLAlchemy's SQLite DATETIME text, so SQL comparisons with bound values hold
+        return f"(datetime(:start, '+' || ({offset}) || ' seconds') || '.000000')"
+
+    def after(column, offset):
+        return f"min(datetime({column}, '+' || ({offset}) || ' seconds') || '.000000', :now || '.000000')"
+
+    def run(statement):
+        return connection.exec_driver_sql(statement, params).rowcount
+
+    sentences = random.Random(seed)
+    connection.exec_driver_sql("CREATE TEMP TABLE IF NOT EXISTS bench_sentences (id INTEGER PRIMARY KEY, text TEXT)")
+    connection.exec_driver_sql("DELETE FROM temp.bench_sentences")
+    connection.exec_driver_sql("INSERT INTO temp.bench_sentences (id, text) VALUES (?, ?)", [
+        (index, ' '.join(sentences.choices(WORDS, k=sentences.randrange(6, 30))))
+        for index in range(SENTENCE_COUNT)
+    ])
+
+    def sentence(row):
+        return f"(SELECT text FROM temp.bench_sentences WHERE id = ({rand(row)}) % {SENTENCE_COUNT})"
+
+    # One index build per table after the load beats maintaining them row by row
+    indexes = _drop_indexes(connection, ('users', 'problems', 'problem_likes', 'comments', 'notifications'))
+    counts = {}
+    counts['users'] = run(f"""
+        INSERT INTO users (id, email, password_hash, name, surname, role, is_active, email_verified,
+                           last_login, unread_notifications, broadcasts_seen, created_at, updated_at)
+        WITH RECURSIVE {_sequence('seq', users)}
+        SELECT n,
+               CASE n WHEN 1 THEN {_quote(ADMIN_EMAIL)} ELSE 'user' || n || '@bench.local' END,
+               'x', 'Prénom' || n, 'Nom' || n,
+               CASE n WHEN 1 THEN 'admin' WHEN 2 THEN 'moderator' ELSE 'student' END,
+               1, 1, {stamp(f'created + ({rand("n")}) % ({span} - created)')}, 0, 0,
+               {stamp('created')}, {stamp('created')}
+        FROM (SELECT n, ({rand('n')}) % {span} AS created FROM seq)
+    """)
+
+    students = max(users - 2, 1)
+    first_student = 3 if users > 2 else 1
+    pairs = [(category, kind) for category, kinds in CATEGORIES.items() for kind in kinds]
+    resolved = _quote(ProblemStatus.RESOLVED.value)
+
+    # The full-text index is built once from the table instead of row by row
+    connection.exec_driver_sql("DROP TRIGGER IF EXISTS problems_fts_ai")
+    counts['problems'] = run(f"""
+        INSERT INTO problems (id, user_id, promotion, room, category, type_of_problem, description, remark,
+                              urgency, state, likes_count, views_count, priority_score, resolved_at,
+                              created_at, updated_at)
+        WITH RECURSIVE {_sequence('seq', problems)}
+        SELECT n, {first_student} + ({rand('n')}) % {students}, {rand.pick('n', PROMOTIONS)},
+               char(65 + ({rand('n')}) % 5) || (100 + ({rand('n')}) % 300),
+               CASE pair {' '.join(f'WHEN {i} THEN {_quote(c)}' for i, (c, _) in enumerate(pairs))} END,
+               CASE pair {' '.join(f'WHEN {i} THEN {_quote(k)}' for i, (_, k) in enumerate(pairs))} END,
+               {sentence('n')}, 'RAS', 1 + ({rand('n')}) % 3, state,
+               min(({rand('n')}) % {2 * int(likes_per_problem) + 1}, {users}), 0, ({rand('n')}) % 100,
+               CASE WHEN state = {resolved} THEN resolved_at END,
+               {stamp('created')}, CASE WHEN state = {resolved} THEN resolved_at ELSE {stamp('created')} END
+        FROM (
+            SELECT n, ({rand('n')}) % {len(pairs)} AS pair, {rand.pick('n', STATES)} AS state,
+                   created, {stamp(f'created + ({rand("n")}) % ({span} - created)')} AS resolved_at
+            FROM (SELECT n, ({rand('n')}) % {span} AS created FROM seq)
+        )
+    """)
+
+    # Distinct likers per problem: consecutive users from a per-problem start
+    max_likes = min(2 * int(likes_per_problem), users)
+    counts['problem_likes'] = run(f"""
+        INSERT INTO problem_likes (user_id, problem_id, created_at, updated_at)
+        WITH RECURSIVE {_sequence('seq', max_likes)}
+        SELECT user_id, problem_id, liked_at, liked_at FROM (
+            SELECT 1 + (({rand('p.id')}) + seq.n) % {users} AS user_id, p.id AS problem_id,
+                   {after('p.created_at', f"({rand('p.id * 64 + seq.n')}) % 604800")} AS liked_at
+            FROM problems p JOIN seq ON seq.n <= p.likes_count
+        )
+    """) if max_likes else 0
+
+    counts['comments'] = run(f"""
+        INSERT INTO comments (user_id, problem_id, content, is_internal, created_at, updated_at)
+        WITH RECURSIVE {_sequence('seq', 2 * int(comments_per_problem))}
+        SELECT user_id, problem_id, content, is_internal, commented_at, commented_at FROM (
+            SELECT 1 + ({rand('p.id * 64 + seq.n')}) % {users} AS user_id, p.id AS problem_id,
+                   {sentence('p.id * 64 + seq.n')} AS content,
+                   ({rand('p.id * 64 + seq.n')}) % 10 = 0 AS is_internal,
+                   {after('p.created_at', f"({rand('p.id * 64 + seq.n')}) % 1209600")} AS commented_at
+            FROM problems p JOIN seq ON seq.n <= ({rand('p.id')}) % {2 * int(comments_per_problem) + 1}
+        )
+    """) if comments_per_problem else 0
+
+    counts['notifications'] = run(f"""
+        INSERT INTO notifications (user_id, audience, title, message, type, is_read, created_at, updated_at)
+        WITH RECURSIVE {_sequence('seq', 2 * notifications_per_user)}
+        SELECT user_id, NULL, 'Mise à jour', message, type, is_read, created_at, created_at FROM (
+            SELECT u.id AS user_id, {sentence('u.id * 128 + seq.n')} AS message,
+                   {rand.pick('u.id * 128 + seq.n', NOTIFICATION_TYPES)} AS type,
+                   ({rand('u.id * 128 + seq.n')}) % 10 < 7 AS is_read,
+                   {stamp(f"({rand('u.id * 128 + seq.n')}) % {span}")} AS created_at
+            FROM users u JOIN seq ON seq.n <= ({rand('u.id')}) % {2 * notifications_per_user + 1}
+        )
+    """) if notifications_per_user else 0
+    counts['notifications'] += run(f"""
+        INSERT INTO notifications (user_id, audience, title, message, type, is_read, created_at, updated_at)
+        WITH RECURSIVE {_sequence('seq', broadcasts)}
+        SELECT NULL, audience, 'Annonce', message, 'system', 0, created_at, created_at FROM (
+            SELECT {rand.pick('n', ('all', 'student'))} AS audience, {sentence('n')} AS message,
+                   {stamp(f"({rand('n')}) % {span}")} AS created_at
+            FROM seq
+        )
+    """) if broadcasts else 0
+    connection.exec_driver_sql("DROP TABLE temp.bench_sentences")
+    for statement in indexes:
+        connection.exec_driver_sql(statement)
+    db.session.commit()
+
+    # Derived data, recomputed the way the maintenance commands do it
+    from services.analytics import rollup_pending
+    from services.counters import rebuild_counters
+    from services.search import rebuild_index
+    from services.unread_counters import repair_unread_counters
+
+    rebuild_index()
+    rebuild_counters()
+    repair_unread_counters()
+    rollup_pending()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill an empty SQLite database with synthetic data.")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--problems', type=int, default=10000)
+    parser.add_argument('--likes-per-problem', type=int, default=3)
+    parser.add_argument('--comments-per-problem', type=int, default=2)
+    parser.add_argument('--notifications-per-user', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        if db.session.query(User.id).first() is not None:
+            sys.exit("The database already has users: use an empty database")
+        counts = generate_dataset(
+            users=args.users, problems=args.problems, likes_per_problem=args.likes_per_problem,
+            comments_per_problem=args.comments_per_problem,
+            notifications_per_user=args.notifications_per_user, seed=args.seed
+        )
+    for table, count in counts.items():
+        print(f"{table}: {count}")
+
+
+if __name__ == '__main__':
+    main()
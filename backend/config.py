@@ -40,10 +40,37 @@ class Config:
     # Redis Configuration
     REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
     
+    # Cache shared by the gunicorn workers of the host (FileSystemCache) so that
+    # invalidations reach every worker; RedisCache for several hosts. A per-process
+    # backend (SimpleCache, NullCache) turns the response cache off outside tests
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'FileSystemCache')
+    CACHE_DEFAULT_TIMEOUT = 300
+    CACHE_REDIS_URL = REDIS_URL
+    CACHE_DIR = os.environ.get('CACHE_DIR', 'instance/cache')
+    CACHE_THRESHOLD = int(os.environ.get('CACHE_THRESHOLD', 10000))  # FileSystemCache entries
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'True').lower() == 'true'
+    
     # File Upload
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16777216))  # 16MB
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
     ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'pdf', 'doc', 'docx'}
+    # Sniffed content types accepted for attachments (the client's Content-Type is ignored)
+    ALLOWED_MIME_TYPES = {
+        'image/jpeg', 'image/png', 'image/gif', 'application/pdf', 'application/msword',
+        'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+    }
+    # `flask attachments gc` keeps unreferenced files younger than this (seconds)
+    ATTACHMENT_GC_GRACE = int(os.environ.get('ATTACHMENT_GC_GRACE', 3600))
+    # Downloads: 'sendfile' (served by the WSGI server), or handed to the proxy
+    # with 'x-sendfile' (Apache, lighttpd) / 'x-accel-redirect' (nginx internal location)
+    ATTACHMENT_SEND_MODE = os.environ.get('ATTACHMENT_SEND_MODE', 'sendfile')
+    ATTACHMENT_ACCEL_PREFIX = os.environ.get('ATTACHMENT_ACCEL_PREFIX', '/protected-uploads/')
+    ATTACHMENT_CACHE_MAX_AGE = 365 * 24 * 3600  # content-addressed files never change
+    # Image thumbnails: generated on first request in a process pool (0 = inline),
+    # cached next to the originals, least recently served evicted over the cap
+    THUMBNAIL_SIZES = {'small': 160, 'medium': 640}
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+    THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 256 * 1024 * 1024))
     
     # CORS
     # Toujours autoriser le frontend local en développement
@@ -54,8 +81,67 @@ class Config:
     else:
         CORS_ORIGINS = ['http://localhost:3000']
     
-    # Rate Limiting
-    RATELIMIT_STORAGE_URL = os.environ.get('RATELIMIT_STORAGE_URL', 'redis://localhost:6379/0')
+    # Rate Limiting: counters shared by the workers of the host in a SQLite file
+    # (services/rate_limits.py); any `limits` storage URI works too (redis://...)
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI', 'sqlite:///instance/ratelimits.sqlite3')
+    RATELIMIT_STRATEGY = 'sliding-window-counter'
+    RATELIMIT_HEADERS_ENABLED = True
+    # Default quotas per JWT role; requests without a valid token are 'anonymous' (per IP)
+    RATELIMIT_ROLE_LIMITS = {
+        'anonymous': '200 per day;50 per hour',
+        'student': '2000 per day;300 per hour',
+        'moderator': '5000 per day;600 per hour',
+        'admin': '10000 per day;1000 per hour',
+    }
+    
+    # Problem views are buffered and written in bulk every N seconds (0 = manual flush)
+    VIEW_COUNT_FLUSH_INTERVAL = int(os.environ.get('VIEW_COUNT_FLUSH_INTERVAL', 10))
+    
+    # Email outbox: background sender threads per process (0 = `flask outbox drain` only)
+    EMAIL_OUTBOX_WORKERS = int(os.environ.get('EMAIL_OUTBOX_WORKERS', 1))
+    EMAIL_OUTBOX_POLL_INTERVAL = int(os.environ.get('EMAIL_OUTBOX_POLL_INTERVAL', 5))
+    EMAIL_OUTBOX_BATCH_SIZE = 50
+    EMAIL_OUTBOX_MAX_ATTEMPTS = 6
+    EMAIL_OUTBOX_RETRY_DELAY = 30  # seconds, doubled after each failure
+    
+    # Notification stream (SSE): one Unix socket per worker in this directory
+    # relays events between gunicorn workers (empty = single process)
+    NOTIFICATION_STREAM_DIR = os.environ.get('NOTIFICATION_STREAM_DIR', 'instance/notification-stream')
+    NOTIFICATION_STREAM_HEARTBEAT = 15  # seconds
+    NOTIFICATION_PREFERENCES_CACHE_TIMEOUT = 300  # seconds; invalidated on change in every worker
+    NOTIFICATION_PREFERENCES_LOCAL_CACHE_TIMEOUT = 5  # per-process CACHE_TYPE: staleness bound in other workers
+    
+    # Near-duplicate detection (Jaccard similarity of the words of open problems, same room)
+    SIMILARITY_THRESHOLD = 0.5
+    # Opt-in: link a new problem to an open one at least this similar (e.g. 0.8);
+    # None keeps submissions free of the lookup
+    SIMILARITY_AUTO_LINK_THRESHOLD = (
+        float(os.environ['SIMILARITY_AUTO_LINK_THRESHOLD']) if os.environ.get('SIMILARITY_AUTO_LINK_THRESHOLD') else None
+    )
+    SIMILARITY_SYNC_INTERVAL = 5  # seconds between catch-ups with other workers' writes
+    
+    # Logging: JSON records written by a background thread (services/structured_logging.py)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FILE = os.environ.get('LOG_FILE', 'app.log')  # empty: stderr
+    LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.01))  # kept share of high-volume debug lines
+    
+    # Prometheus metrics on /metrics (services/metrics.py); scrapers send
+    # "Authorization: Bearer <METRICS_TOKEN>" when a token is set
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+    # Without a token, /metrics is only registered if this is False (scrapes from
+    # an internal network only: the proxy must not forward /metrics)
+    METRICS_REQUIRE_TOKEN = os.environ.get('METRICS_REQUIRE_TOKEN', 'False').lower() == 'true'
+    
+    # SQL diagnostics (services/query_diagnostics.py): slow statements with their
+    # plan, and requests repeating one statement shape (N+1), on /api/admin/system/queries
+    QUERY_DIAGNOSTICS_ENABLED = os.environ.get('QUERY_DIAGNOSTICS_ENABLED', 'False').lower() == 'true'
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))  # same shape, one request
+    QUERY_DIAGNOSTICS_MAX_REPORTS = 200
+    
+    # Default resolution time histogram edges for admin analytics (hours)
+    ANALYTICS_RESOLUTION_BINS = [1, 4, 12, 24, 48, 72, 168, 336, 720]
     
     # API Configuration
     API_VERSION = os.environ.get('API_VERSION', 'v1')
@@ -68,11 +154,14 @@ class DevelopmentConfig(Config):
     DEBUG = True
     TESTING = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///gestion_problemes_db.sqlite3'
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
+    QUERY_DIAGNOSTICS_ENABLED = os.environ.get('QUERY_DIAGNOSTICS_ENABLED', 'True').lower() == 'true'
 
 class ProductionConfig(Config):
     """Production configuration (SQLite)"""
     DEBUG = False
     TESTING = False
+    METRICS_REQUIRE_TOKEN = os.environ.get('METRICS_REQUIRE_TOKEN', 'True').lower() == 'true'
     SQLALCHEMY_DATABASE_URI = 'sqlite:///gestion_problemes_db.sqlite3'
     SQLALCHEMY_ENGINE_OPTIONS = {
         'pool_size': 10,
@@ -85,6 +174,17 @@ class TestingConfig(Config):
     TESTING = True
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = {}  # StaticPool (in-memory) rejects pool_size
+    MAIL_SUPPRESS_SEND = True
+    CACHE_TYPE = 'SimpleCache'
+    RATELIMIT_ENABLED = False
+    RATELIMIT_STORAGE_URI = 'memory://'
+    LOG_FILE = None
+    VIEW_COUNT_FLUSH_INTERVAL = 0
+    EMAIL_OUTBOX_WORKERS = 0
+    NOTIFICATION_STREAM_DIR = None
+    THUMBNAIL_WORKERS = 0
+    SIMILARITY_BUILD_IN_BACKGROUND = False
 
 config = {
     'development': DevelopmentConfig,
@@ -0,0 +1,104 @@
+"""
+Fixtures pytest partagées pour les tests en processus (create_app('testing'))
+"""
+
+from contextlib import contextmanager
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from app import create_app
+from extensions import db as _db
+from models import User, Problem
+from services.view_counter import view_counter
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        _db.create_all()
+        yield app
+        view_counter.stop()
+        _db.session.remove()
+        _db.drop_all()
+
+
+@pytest.fixture
+def db(app):
+    return _db
+
+
+@pytest.fixture
+def make_user(db):
+    counter = {'n': 0}
+
+    def _make_user(role='student', **fields):
+        counter['n'] += 1
+        user = User(
+            email=fields.pop('email', f"{role}{counter['n']}@example.com"),
+            password_hash='x',
+            name=fields.pop('name', f"{role.title()}{counter['n']}"),
+            surname=fields.pop('surname', 'Test'),
+            role=role,
+            **fields
+        )
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    return _make_user
+
+
+@pytest.fixture
+def make_problem(db):
+    def _make_problem(user, commit=True, **fields):
+        values = {
+            'promotion': 'B3',
+            'room': 'A101',
+            'category': 'Informatique',
+            'type_of_problem': 'Projecteur',
+            'description': 'Le projecteur ne s\'allume plus',
+            'urgency': 2,
+            'remark': 'RAS',
+        }
+        values.update(fields)
+        problem = Problem(user_id=user.id, **values)
+        db.session.add(problem)
+        if commit:
+            db.session.commit()
+        return problem
+
+    return _make_problem
+
+
+@pytest.fixture
+def auth_headers(app):
+    def _auth_headers(user):
+        token = create_access_token(
+            identity=str(user.id),
+            additional_claims={'role': user.role, 'email': user.email}
+        )
+        return {'Authorization': f'Bearer {token}'}
+
+    return _auth_headers
+
+
+@pytest.fixture
+def count_queries(db):
+    """Context manager collecting every SQL statement sent to the engine"""
+    @contextmanager
+    def _count_queries():
+        statements = []
+
+        def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', _before_cursor_execute)
+
+    return _count_queries
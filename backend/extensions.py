@@ -3,9 +3,9 @@ from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from flask_bcrypt import Bcrypt
 from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from flask_mail import Mail
 from flask_caching import Cache
+from services.rate_limits import rate_limit_key, role_limits
 
 # Initialisation des extensions
 db = SQLAlchemy()
@@ -15,5 +15,5 @@ bcrypt = Bcrypt()
 mail = Mail()
 cache = Cache()
 
-# Limiteur de requêtes (anti-bruteforce)
-limiter = Limiter(key_func=get_remote_address, default_limits=["200 per day", "50 per hour"]) 
\ No newline at end of file
+# Limiteur de requêtes (anti-bruteforce), par utilisateur puis par IP, quotas par rôle
+limiter = Limiter(key_func=rate_limit_key, default_limits=[role_limits])
\ No newline at end of file
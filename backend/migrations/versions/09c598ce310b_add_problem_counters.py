@@ -0,0 +1,60 @@
+"""Add live problem counters table
+
+Revision ID: 09c598ce310b
+Revises: 4d4808bca210
+Create Date: 2026-10-18 11:02:44.120871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '09c598ce310b'
+down_revision = '4d4808bca210'
+branch_labels = None
+depends_on = None
+
+# (dimension, value, aggregate, filter) for the buckets of services/counters.py
+RESOLVED = "state = 'Problème traité' AND resolved_at IS NOT NULL"
+BUCKETS = [
+    ("'total'", "''", "COUNT(*)", None),
+    ("'state'", "state", "COUNT(*)", None),
+    ("'urgency'", "CAST(urgency AS TEXT)", "COUNT(*)", None),
+    ("'category'", "category", "COUNT(*)", None),
+    ("'created_month'", "strftime('%Y-%m', created_at)", "COUNT(*)", None),
+    ("'resolution'", "'count'", "COUNT(*)", RESOLVED),
+    ("'resolution'", "'seconds'",
+     "SUM(ROUND((julianday(resolved_at) - julianday(created_at)) * 86400))", RESOLVED),
+]
+
+
+def upgrade():
+    op.create_table('problem_counters',
+    sa.Column('dimension', sa.String(length=32), nullable=False),
+    sa.Column('value', sa.String(length=100), nullable=False),
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('dimension', 'value', 'user_id')
+    )
+
+    # Other backends: run `flask counters rebuild` after upgrading
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for dimension, value, aggregate, condition in BUCKETS:
+        where = f"WHERE {condition}" if condition else ""
+        # Global row (user_id 0), then one row per author
+        op.execute(
+            f"INSERT INTO problem_counters (dimension, value, user_id, count) "
+            f"SELECT {dimension}, {value}, 0, {aggregate} FROM problems {where} "
+            f"GROUP BY {value} HAVING COUNT(*) > 0"
+        )
+        op.execute(
+            f"INSERT INTO problem_counters (dimension, value, user_id, count) "
+            f"SELECT {dimension}, {value}, user_id, {aggregate} FROM problems {where} "
+            f"GROUP BY {value}, user_id"
+        )
+
+
+def downgrade():
+    op.drop_table('problem_counters')
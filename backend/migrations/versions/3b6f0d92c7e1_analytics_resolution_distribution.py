@@ -0,0 +1,32 @@
+"""Keep each day's resolution time distribution in its analytics rollup, index today's live pass
+
+Revision ID: 3b6f0d92c7e1
+Revises: a4e31e694d02
+Create Date: 2026-10-18 14:02:37.118290
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b6f0d92c7e1'
+down_revision = 'a4e31e694d02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows stay NULL: they are computed live until `flask analytics backfill`
+    with op.batch_alter_table('analytics', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('resolution_distribution', sa.Text(), nullable=True))
+    # Problems resolved since a date, without walking every resolved problem
+    with op.batch_alter_table('problems', schema=None) as batch_op:
+        batch_op.create_index('ix_problems_state_resolved_at', ['state', 'resolved_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('problems', schema=None) as batch_op:
+        batch_op.drop_index('ix_problems_state_resolved_at')
+    with op.batch_alter_table('analytics', schema=None) as batch_op:
+        batch_op.drop_column('resolution_distribution')
@@ -0,0 +1,63 @@
+"""Add FTS5 full-text index on problems
+
+Revision ID: 4d4808bca210
+Revises: ee8f0f84afb1
+Create Date: 2026-10-18 10:21:07.913554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d4808bca210'
+down_revision = 'ee8f0f84afb1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite only: other backends keep the ILIKE search path
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS problems_fts USING fts5(
+            description, type_of_problem, room,
+            content='problems', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS problems_fts_ai AFTER INSERT ON problems BEGIN
+            INSERT INTO problems_fts(rowid, description, type_of_problem, room)
+            VALUES (new.id, new.description, new.type_of_problem, new.room);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS problems_fts_ad AFTER DELETE ON problems BEGIN
+            INSERT INTO problems_fts(problems_fts, rowid, description, type_of_problem, room)
+            VALUES ('delete', old.id, old.description, old.type_of_problem, old.room);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS problems_fts_au
+            AFTER UPDATE OF description, type_of_problem, room ON problems BEGIN
+            INSERT INTO problems_fts(problems_fts, rowid, description, type_of_problem, room)
+            VALUES ('delete', old.id, old.description, old.type_of_problem, old.room);
+            INSERT INTO problems_fts(rowid, description, type_of_problem, room)
+            VALUES (new.id, new.description, new.type_of_problem, new.room);
+        END
+    """)
+    # Index the existing rows
+    op.execute("INSERT INTO problems_fts(problems_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("DROP TRIGGER IF EXISTS problems_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS problems_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS problems_fts_ai")
+    op.execute("DROP TABLE IF EXISTS problems_fts")
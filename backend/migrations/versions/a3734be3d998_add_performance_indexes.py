@@ -0,0 +1,78 @@
+"""Add performance indexes for hot filters and orderings
+
+Revision ID: a3734be3d998
+Revises: da5d1493e502
+Create Date: 2026-10-18 09:40:12.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3734be3d998'
+down_revision = 'da5d1493e502'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Remove duplicate likes left by concurrent toggles before enforcing uniqueness
+    op.execute(
+        "DELETE FROM problem_likes WHERE id NOT IN ("
+        "SELECT MIN(id) FROM problem_likes GROUP BY user_id, problem_id)"
+    )
+
+    with op.batch_alter_table('problems', schema=None) as batch_op:
+        batch_op.create_index('ix_problems_user_id_created_at', ['user_id', 'created_at'], unique=False)
+        batch_op.create_index('ix_problems_state_created_at', ['state', 'created_at'], unique=False)
+        batch_op.create_index('ix_problems_category_created_at', ['category', 'created_at'], unique=False)
+        batch_op.create_index('ix_problems_urgency_created_at', ['urgency', 'created_at'], unique=False)
+        batch_op.create_index('ix_problems_created_at', ['created_at'], unique=False)
+        batch_op.create_index('ix_problems_priority_score', ['priority_score'], unique=False)
+        batch_op.create_index('ix_problems_likes_count', ['likes_count'], unique=False)
+
+    with op.batch_alter_table('problem_likes', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_problem_likes_user_id_problem_id', ['user_id', 'problem_id'])
+        batch_op.create_index('ix_problem_likes_problem_id', ['problem_id'], unique=False)
+
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.create_index('ix_comments_problem_id_created_at', ['problem_id', 'created_at'], unique=False)
+
+    with op.batch_alter_table('attachments', schema=None) as batch_op:
+        batch_op.create_index('ix_attachments_problem_id', ['problem_id'], unique=False)
+
+    with op.batch_alter_table('problem_history', schema=None) as batch_op:
+        batch_op.create_index('ix_problem_history_problem_id_created_at', ['problem_id', 'created_at'], unique=False)
+
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.create_index('ix_notifications_user_id_created_at', ['user_id', 'created_at'], unique=False)
+        batch_op.create_index('ix_notifications_user_id_is_read_created_at', ['user_id', 'is_read', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_index('ix_notifications_user_id_is_read_created_at')
+        batch_op.drop_index('ix_notifications_user_id_created_at')
+
+    with op.batch_alter_table('problem_history', schema=None) as batch_op:
+        batch_op.drop_index('ix_problem_history_problem_id_created_at')
+
+    with op.batch_alter_table('attachments', schema=None) as batch_op:
+        batch_op.drop_index('ix_attachments_problem_id')
+
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.drop_index('ix_comments_problem_id_created_at')
+
+    with op.batch_alter_table('problem_likes', schema=None) as batch_op:
+        batch_op.drop_index('ix_problem_likes_problem_id')
+        batch_op.drop_constraint('uq_problem_likes_user_id_problem_id', type_='unique')
+
+    with op.batch_alter_table('problems', schema=None) as batch_op:
+        batch_op.drop_index('ix_problems_likes_count')
+        batch_op.drop_index('ix_problems_priority_score')
+        batch_op.drop_index('ix_problems_created_at')
+        batch_op.drop_index('ix_problems_urgency_created_at')
+        batch_op.drop_index('ix_problems_category_created_at')
+        batch_op.drop_index('ix_problems_state_created_at')
+        batch_op.drop_index('ix_problems_user_id_created_at')
@@ -0,0 +1,30 @@
+"""Stored notification preferences
+
+Revision ID: a4e31e694d02
+Revises: a8d86a61913c
+Create Date: 2026-10-18 10:45:44.502935
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e31e694d02'
+down_revision = 'a8d86a61913c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('notification_preferences',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('disabled', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('notification_preferences')
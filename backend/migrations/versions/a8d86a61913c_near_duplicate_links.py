@@ -0,0 +1,68 @@
+"""Near-duplicate problem links
+
+Revision ID: a8d86a61913c
+Revises: fb871f242c48
+Create Date: 2026-10-18 10:35:49.832762
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8d86a61913c'
+down_revision = 'fb871f242c48'
+branch_labels = None
+depends_on = None
+
+
+FTS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS problems_fts_ai AFTER INSERT ON problems BEGIN
+        INSERT INTO problems_fts(rowid, description, type_of_problem, room)
+        VALUES (new.id, new.description, new.type_of_problem, new.room);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS problems_fts_ad AFTER DELETE ON problems BEGIN
+        INSERT INTO problems_fts(problems_fts, rowid, description, type_of_problem, room)
+        VALUES ('delete', old.id, old.description, old.type_of_problem, old.room);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS problems_fts_au
+        AFTER UPDATE OF description, type_of_problem, room ON problems BEGIN
+        INSERT INTO problems_fts(problems_fts, rowid, description, type_of_problem, room)
+        VALUES ('delete', old.id, old.description, old.type_of_problem, old.room);
+        INSERT INTO problems_fts(rowid, description, type_of_problem, room)
+        VALUES (new.id, new.description, new.type_of_problem, new.room);
+    END
+    """,
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        # ADD COLUMN with an inline REFERENCES: no table rebuild, so the FTS triggers stay
+        op.execute(
+            "ALTER TABLE problems ADD COLUMN duplicate_of_id INTEGER "
+            "CONSTRAINT fk_problems_duplicate_of_id REFERENCES problems (id)"
+        )
+    else:
+        op.add_column('problems', sa.Column('duplicate_of_id', sa.Integer(), nullable=True))
+        op.create_foreign_key('fk_problems_duplicate_of_id', 'problems', 'problems',
+                              ['duplicate_of_id'], ['id'])
+    op.create_index('ix_problems_updated_at', 'problems', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_problems_updated_at', table_name='problems')
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    with op.batch_alter_table('problems', schema=None) as batch_op:
+        if not sqlite:
+            batch_op.drop_constraint('fk_problems_duplicate_of_id', type_='foreignkey')
+        batch_op.drop_column('duplicate_of_id')
+    if sqlite:
+        # The table was rebuilt: its triggers went with the old one
+        for statement in FTS_TRIGGERS:
+            op.execute(statement)
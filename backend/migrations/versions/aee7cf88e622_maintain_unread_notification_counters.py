@@ -0,0 +1,54 @@
+"""Maintain unread notification counters
+
+Revision ID: aee7cf88e622
+Revises: df3280a43532
+Create Date: 2026-10-18 10:26:12.958050
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'aee7cf88e622'
+down_revision = 'df3280a43532'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('broadcast_totals',
+    sa.Column('audience', sa.String(length=20), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('audience')
+    )
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unread_notifications', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('broadcasts_seen', sa.Integer(), nullable=False, server_default='0'))
+
+    # Same formulas as services/unread_counters.compute_unread
+    op.execute(
+        "INSERT INTO broadcast_totals (audience, count) "
+        "SELECT audience, COUNT(*) FROM notifications WHERE user_id IS NULL GROUP BY audience"
+    )
+    op.execute(
+        "UPDATE users SET unread_notifications = ("
+        "SELECT COUNT(*) FROM notifications n WHERE n.user_id = users.id AND NOT n.is_read)"
+    )
+    op.execute(
+        "UPDATE users SET broadcasts_seen = ("
+        "SELECT COALESCE(SUM(t.count), 0) FROM broadcast_totals t WHERE t.audience IN ('all', users.role)"
+        ") - ("
+        "SELECT COUNT(*) FROM notifications n WHERE n.user_id IS NULL "
+        "AND n.audience IN ('all', users.role) AND n.created_at >= users.created_at "
+        "AND NOT EXISTS (SELECT 1 FROM notification_receipts r "
+        "WHERE r.notification_id = n.id AND r.user_id = users.id))"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('broadcasts_seen')
+        batch_op.drop_column('unread_notifications')
+
+    op.drop_table('broadcast_totals')
@@ -0,0 +1,43 @@
+"""Make analytics one row per day, keep the resolution time sum and index the live columns
+
+Revision ID: d8295cfe1192
+Revises: 09c598ce310b
+Create Date: 2026-10-18 11:48:19.604117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8295cfe1192'
+down_revision = '09c598ce310b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Nothing ever wrote to analytics: drop any stray rows so the day can be unique.
+    # Run `flask analytics backfill` afterwards to populate the history.
+    op.execute("DELETE FROM analytics")
+    with op.batch_alter_table('analytics', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('resolution_seconds', sa.BigInteger(), nullable=False, server_default='0'))
+        batch_op.drop_index('ix_analytics_date')
+        batch_op.create_index('ix_analytics_date', ['date'], unique=True)
+
+    # Today's live part of /api/admin/analytics filters on these
+    with op.batch_alter_table('problems', schema=None) as batch_op:
+        batch_op.create_index('ix_problems_resolved_at', ['resolved_at'], unique=False)
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index('ix_users_last_login', ['last_login'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_last_login')
+    with op.batch_alter_table('problems', schema=None) as batch_op:
+        batch_op.drop_index('ix_problems_resolved_at')
+    with op.batch_alter_table('analytics', schema=None) as batch_op:
+        batch_op.drop_index('ix_analytics_date')
+        batch_op.create_index('ix_analytics_date', ['date'], unique=False)
+        batch_op.drop_column('resolution_seconds')
@@ -0,0 +1,45 @@
+"""Fan-out-on-read broadcast notifications
+
+Revision ID: df3280a43532
+Revises: 582015488d1d
+Create Date: 2026-10-18 10:18:27.177831
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'df3280a43532'
+down_revision = '582015488d1d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('notification_receipts',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('notification_id', sa.Integer(), nullable=False),
+    sa.Column('read_at', sa.DateTime(), nullable=True),
+    sa.Column('dismissed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['notification_id'], ['notifications.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'notification_id')
+    )
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('audience', sa.String(length=20), nullable=True))
+        batch_op.alter_column('user_id',
+               existing_type=sa.INTEGER(),
+               nullable=True)
+
+
+def downgrade():
+    # Broadcasts have no owner in the old schema
+    op.execute("DELETE FROM notifications WHERE user_id IS NULL")
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.alter_column('user_id',
+               existing_type=sa.INTEGER(),
+               nullable=False)
+        batch_op.drop_column('audience')
+
+    op.drop_table('notification_receipts')
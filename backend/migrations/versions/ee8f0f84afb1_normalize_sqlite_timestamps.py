@@ -0,0 +1,47 @@
+"""Normalize SQLite timestamps written by CURRENT_TIMESTAMP
+
+Revision ID: ee8f0f84afb1
+Revises: a3734be3d998
+Create Date: 2026-10-18 10:05:41.502317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ee8f0f84afb1'
+down_revision = 'a3734be3d998'
+branch_labels = None
+depends_on = None
+
+# Columns previously defaulted server-side with func.now()
+TIMESTAMP_COLUMNS = {
+    'users': ['created_at', 'updated_at'],
+    'problems': ['created_at', 'updated_at'],
+    'problem_likes': ['created_at', 'updated_at'],
+    'comments': ['created_at', 'updated_at'],
+    'notifications': ['created_at', 'updated_at'],
+    'attachments': ['uploaded_at'],
+    'problem_history': ['created_at'],
+    'analytics': ['created_at'],
+}
+
+
+def upgrade():
+    # CURRENT_TIMESTAMP stores 'YYYY-MM-DD HH:MM:SS' whereas SQLAlchemy binds
+    # 'YYYY-MM-DD HH:MM:SS.ffffff': align legacy rows so text comparisons
+    # (keyset pagination, equality on timestamps) order them correctly
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table, columns in TIMESTAMP_COLUMNS.items():
+        for column in columns:
+            op.execute(
+                f"UPDATE {table} SET {column} = {column} || '.000000' "
+                f"WHERE length({column}) = 19"
+            )
+
+
+def downgrade():
+    # Both formats are read back identically: nothing to undo
+    pass
@@ -0,0 +1,28 @@
+"""Content-addressed attachment storage
+
+Revision ID: fb871f242c48
+Revises: aee7cf88e622
+Create Date: 2026-10-18 10:29:37.746117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fb871f242c48'
+down_revision = 'aee7cf88e622'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('attachments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sha256', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_attachments_sha256', ['sha256'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('attachments', schema=None) as batch_op:
+        batch_op.drop_index('ix_attachments_sha256')
+        batch_op.drop_column('sha256')
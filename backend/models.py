@@ -7,9 +7,12 @@ import json
 from extensions import db
 
 # Mixin DRY pour les timestamps
+# Defaults are computed in Python so SQLite stores every timestamp in the same
+# text format as bound parameters (CURRENT_TIMESTAMP drops the microseconds,
+# which breaks equality/keyset comparisons on these columns)
 class TimestampMixin(object):
-    created_at = db.Column(db.DateTime, default=func.now(), nullable=False)
-    updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
 class UserRole(enum.Enum):
     STUDENT = "student"
@@ -30,6 +33,9 @@ class UrgencyLevel(enum.Enum):
 
 class User(db.Model, TimestampMixin):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_last_login', 'last_login'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     email = db.Column(db.String(255), unique=True, nullable=False, index=True)
@@ -40,6 +46,9 @@ class User(db.Model, TimestampMixin):
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     email_verified = db.Column(db.Boolean, default=False, nullable=False)
     last_login = db.Column(db.DateTime)
+    # Maintained by services/unread_counters.py
+    unread_notifications = db.Column(db.Integer, default=0, nullable=False)  # personal only
+    broadcasts_seen = db.Column(db.Integer, default=0, nullable=False)
     
     # Relationships
     problems = db.relationship("Problem", back_populates="user", cascade="all, delete-orphan", foreign_keys="Problem.user_id")
@@ -47,12 +56,25 @@ class User(db.Model, TimestampMixin):
     likes = db.relationship("ProblemLike", back_populates="user", cascade="all, delete-orphan")
     comments = db.relationship("Comment", back_populates="user", cascade="all, delete-orphan")
     notifications = db.relationship("Notification", back_populates="user", cascade="all, delete-orphan")
+    notification_preference = db.relationship("NotificationPreference", uselist=False, cascade="all, delete-orphan")
     
     def __repr__(self):
         return f"<User(id={self.id}, email='{self.email}', role='{self.role}')>"
 
 class Problem(db.Model, TimestampMixin):
     __tablename__ = 'problems'
+    __table_args__ = (
+        db.Index('ix_problems_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_problems_state_created_at', 'state', 'created_at'),
+        db.Index('ix_problems_category_created_at', 'category', 'created_at'),
+        db.Index('ix_problems_urgency_created_at', 'urgency', 'created_at'),
+        db.Index('ix_problems_created_at', 'created_at'),
+        db.Index('ix_problems_priority_score', 'priority_score'),
+        db.Index('ix_problems_likes_count', 'likes_count'),
+        db.Index('ix_problems_resolved_at', 'resolved_at'),
+        db.Index('ix_problems_state_resolved_at', 'state', 'resolved_at'),
+        db.Index('ix_problems_updated_at', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -74,6 +96,9 @@ class Problem(db.Model, TimestampMixin):
     tags = db.Column(db.Text)
     location_coordinates = db.Column(db.Text)
     resolved_at = db.Column(db.DateTime)
+    # Open problem this one was found to repeat when submitted (services/similarity.py),
+    # cleared by bulk_delete when that problem is deleted
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('problems.id'))
     
     # Relationships
     user = db.relationship("User", back_populates="problems", foreign_keys=[user_id])
@@ -88,6 +113,10 @@ class Problem(db.Model, TimestampMixin):
 
 class ProblemLike(db.Model, TimestampMixin):
     __tablename__ = 'problem_likes'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'problem_id', name='uq_problem_likes_user_id_problem_id'),
+        db.Index('ix_problem_likes_problem_id', 'problem_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -102,6 +131,9 @@ class ProblemLike(db.Model, TimestampMixin):
 
 class Comment(db.Model, TimestampMixin):
     __tablename__ = 'comments'
+    __table_args__ = (
+        db.Index('ix_comments_problem_id_created_at', 'problem_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -118,6 +150,10 @@ class Comment(db.Model, TimestampMixin):
 
 class Attachment(db.Model):
     __tablename__ = 'attachments'
+    __table_args__ = (
+        db.Index('ix_attachments_problem_id', 'problem_id'),
+        db.Index('ix_attachments_sha256', 'sha256'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     problem_id = db.Column(db.Integer, db.ForeignKey('problems.id'), nullable=False)
@@ -125,8 +161,9 @@ class Attachment(db.Model):
     original_filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
-    mime_type = db.Column(db.String(100), nullable=False)
-    uploaded_at = db.Column(db.DateTime, default=func.now(), nullable=False)
+    mime_type = db.Column(db.String(100), nullable=False)  # Sniffed from the content
+    sha256 = db.Column(db.String(64), nullable=True)  # Stored blob; NULL for files saved before dedup
+    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
     # Relationships
     problem = db.relationship("Problem", back_populates="attachments")
@@ -136,6 +173,9 @@ class Attachment(db.Model):
 
 class ProblemHistory(db.Model):
     __tablename__ = 'problem_history'
+    __table_args__ = (
+        db.Index('ix_problem_history_problem_id_created_at', 'problem_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     problem_id = db.Column(db.Integer, db.ForeignKey('problems.id'), nullable=False)
@@ -143,7 +183,7 @@ class ProblemHistory(db.Model):
     action = db.Column(db.String(100), nullable=False)  # status_change, comment_added, etc.
     old_value = db.Column(db.Text)
     new_value = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=func.now(), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
     # Relationships
     problem = db.relationship("Problem", back_populates="history")
@@ -153,10 +193,17 @@ class ProblemHistory(db.Model):
         return f"<ProblemHistory(id={self.id}, action='{self.action}')>"
 
 class Notification(db.Model, TimestampMixin):
+    """Personal notification (``user_id``) or broadcast stored once for an
+    ``audience``, read through per-user receipts (services/notifications.py)"""
     __tablename__ = 'notifications'
+    __table_args__ = (
+        db.Index('ix_notifications_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_notifications_user_id_is_read_created_at', 'user_id', 'is_read', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))  # NULL for broadcasts
+    audience = db.Column(db.String(20))  # broadcasts only: 'all' or a user role
     title = db.Column(db.String(255), nullable=False)
     message = db.Column(db.Text, nullable=False)
     type = db.Column(db.String(50), nullable=False)  # problem_update, comment, system
@@ -169,18 +216,99 @@ class Notification(db.Model, TimestampMixin):
     def __repr__(self):
         return f"<Notification(id={self.id}, type='{self.type}')>"
 
+class NotificationReceipt(db.Model):
+    """Read/dismiss state of a broadcast notification for one user"""
+    __tablename__ = 'notification_receipts'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    notification_id = db.Column(db.Integer, db.ForeignKey('notifications.id', ondelete='CASCADE'), primary_key=True)
+    read_at = db.Column(db.DateTime)
+    dismissed_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f"<NotificationReceipt(user_id={self.user_id}, notification_id={self.notification_id})>"
+
+class NotificationPreference(db.Model):
+    """Notification settings a user turned off, see services/notification_preferences.py
+
+    No row means every notification is enabled.
+    """
+    __tablename__ = 'notification_preferences'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    disabled = db.Column(db.Integer, default=0, nullable=False)  # bitmask of disabled settings
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f"<NotificationPreference(user_id={self.user_id}, disabled={self.disabled})>"
+
+class BroadcastTotal(db.Model):
+    """Number of broadcasts sent to an audience, see services/unread_counters.py"""
+    __tablename__ = 'broadcast_totals'
+    
+    audience = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f"<BroadcastTotal(audience='{self.audience}', count={self.count})>"
+
 class Analytics(db.Model):
+    """Daily rollup (UTC day starting at ``date``), see services/analytics.py"""
     __tablename__ = 'analytics'
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    date = db.Column(db.DateTime, nullable=False, index=True)
-    total_problems = db.Column(db.Integer, default=0)
-    resolved_problems = db.Column(db.Integer, default=0)
+    date = db.Column(db.DateTime, nullable=False, index=True, unique=True)
+    total_problems = db.Column(db.Integer, default=0)  # created that day
+    resolved_problems = db.Column(db.Integer, default=0)  # resolved that day
     avg_resolution_time = db.Column(db.Integer)  # in hours
+    resolution_seconds = db.Column(db.BigInteger, default=0, nullable=False)  # sum, for exact averages over windows
     problems_by_category = db.Column(db.Text)
     problems_by_urgency = db.Column(db.Text)
     active_users = db.Column(db.Integer, default=0)
-    created_at = db.Column(db.DateTime, default=func.now(), nullable=False)
+    # Resolution times of the problems resolved that day, per (category, urgency)
+    resolution_distribution = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f"<Analytics(date='{self.date}', total_problems={self.total_problems})>" 
+
+class ProblemCounter(db.Model):
+    """Live problem counts per bucket, maintained in the writing transaction
+
+    ``user_id`` 0 holds the global counts; other rows are a student's own
+    problems. See services/counters.py.
+    """
+    __tablename__ = 'problem_counters'
+    
+    dimension = db.Column(db.String(32), primary_key=True)  # total, state, urgency, category, ...
+    value = db.Column(db.String(100), primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False, default=0)
+    count = db.Column(db.BigInteger, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f"<ProblemCounter({self.dimension}={self.value!r}, user_id={self.user_id}, count={self.count})>"
+
+
+class EmailOutbox(db.Model):
+    """Email queued in the writing transaction, delivered by services/email_outbox.py"""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+        db.Index('ix_email_outbox_claim_token', 'claim_token'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    html_body = db.Column(db.Text)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # lease end while sending
+    claim_token = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime)
     
     def __repr__(self):
-        return f"<Analytics(date='{self.date}', total_problems={self.total_problems})>" 
\ No newline at end of file
+        return f"<EmailOutbox(id={self.id}, recipient='{self.recipient}', status='{self.status}')>"
@@ -1,7 +1,8 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from marshmallow import Schema, fields, validate, ValidationError
-from sqlalchemy import and_, or_, desc, func, text
+from sqlalchemy import and_, or_, asc, desc, func, text
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
 import json
 from extensions import db, cache, mail
@@ -10,6 +11,18 @@ from models import (
     UserRole, ProblemStatus, UrgencyLevel
 )
 from flask_mail import Message
+from services.response_cache import invalidate_tags
+from services.pagination import keyset_paginate, InvalidCursor
+from services.counters import problem_counts
+from services.stats import user_aggregates
+from services.email_outbox import queue_stats
+from services.bulk_problems import bulk_delete, bulk_set_state, remove_files_async
+from services.notifications import audience_size, broadcast, unread_count
+from services.notification_preferences import recipients
+from services.query_diagnostics import query_diagnostics
+from services.analytics import (
+    merge_summaries, parse_bins, resolution_distribution, resolution_times_page, window_summaries
+)
 import logging
 
 admin_bp = Blueprint('admin', __name__)
@@ -20,6 +33,14 @@ class UserUpdateSchema(Schema):
     role = fields.Str(validate=validate.OneOf(['student', 'admin', 'moderator']))
     email_verified = fields.Bool()
 
+# sort_by option -> (column, descending)
+USER_SORT_COLUMNS = {
+    'name': (User.name, False),
+    'email': (User.email, False),
+    'last_login': (User.last_login, True),
+    'created_at': (User.created_at, True)
+}
+
 class BulkUpdateSchema(Schema):
     problem_ids = fields.List(fields.Int(), required=True)
     action = fields.Str(required=True, validate=validate.OneOf(['activate', 'deactivate', 'delete', 'change_status']))
@@ -41,70 +62,34 @@ def check_admin_permissions():
 
 def get_user_stats():
     """Get user statistics"""
-    total_users = db.session.query(User).count()
-    active_users = db.session.query(User).filter_by(is_active=True).count()
-    students = db.session.query(User).filter_by(role=UserRole.STUDENT).count()
-    admins = db.session.query(User).filter_by(role=UserRole.ADMIN).count()
-    moderators = db.session.query(User).filter_by(role=UserRole.MODERATOR).count()
-    
-    # Users registered this month
-    this_month = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    new_users_this_month = db.session.query(User).filter(User.created_at >= this_month).count()
+    stats = user_aggregates()
     
     return {
-        "total_users": total_users,
-        "active_users": active_users,
-        "students": students,
-        "admins": admins,
-        "moderators": moderators,
-        "new_users_this_month": new_users_this_month
+        "total_users": stats['total'],
+        "active_users": stats['active'],
+        "students": stats['students'],
+        "admins": stats['admins'],
+        "moderators": stats['moderators'],
+        "new_users_this_month": stats['this_month']
     }
 
 def get_problem_stats():
     """Get problem statistics"""
-    total_problems = db.session.query(Problem).count()
-    resolved_problems = db.session.query(Problem).filter_by(state=ProblemStatus.RESOLVED).count()
-    in_progress = db.session.query(Problem).filter_by(state=ProblemStatus.IN_PROGRESS).count()
-    pending = db.session.query(Problem).filter_by(state=ProblemStatus.SUBMITTED).count()
-    
-    # Problems by urgency
-    high_urgency = db.session.query(Problem).filter_by(urgency=UrgencyLevel.HIGH).count()
-    medium_urgency = db.session.query(Problem).filter_by(urgency=UrgencyLevel.MEDIUM).count()
-    low_urgency = db.session.query(Problem).filter_by(urgency=UrgencyLevel.LOW).count()
-    
-    # Problems this month
-    this_month = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    problems_this_month = db.session.query(Problem).filter(Problem.created_at >= this_month).count()
-    
-    # Average resolution time
-    resolved_with_time = db.session.query(Problem).filter(
-        and_(
-            Problem.state == ProblemStatus.RESOLVED,
-            Problem.resolved_at.isnot(None)
-        )
-    ).all()
-    
-    total_time = 0
-    count = 0
-    for problem in resolved_with_time:
-        if problem.resolved_at and problem.created_at:
-            resolution_time = (problem.resolved_at - problem.created_at).total_seconds() / 3600
-            total_time += resolution_time
-            count += 1
-    
-    avg_resolution_time = total_time / count if count > 0 else 0
+    stats = problem_counts()
+    total_problems = stats['total']
+    resolved_problems = stats['resolved']
     
     return {
         "total_problems": total_problems,
         "resolved_problems": resolved_problems,
-        "in_progress": in_progress,
-        "pending": pending,
-        "high_urgency": high_urgency,
-        "medium_urgency": medium_urgency,
-        "low_urgency": low_urgency,
-        "problems_this_month": problems_this_month,
+        "in_progress": stats['in_progress'],
+        "pending": stats['pending'],
+        "high_urgency": stats['urgency'][UrgencyLevel.HIGH.value],
+        "medium_urgency": stats['urgency'][UrgencyLevel.MEDIUM.value],
+        "low_urgency": stats['urgency'][UrgencyLevel.LOW.value],
+        "problems_this_month": stats['this_month'],
         "resolution_rate": (resolved_problems / total_problems * 100) if total_problems > 0 else 0,
-        "avg_resolution_time_hours": round(avg_resolution_time, 2)
+        "avg_resolution_time_hours": round(stats['avg_resolution_hours'], 2)
     }
 
 # Routes
@@ -126,6 +111,7 @@ def admin_dashboard():
         
         # Get recent problems
         recent_problems = db.session.query(Problem)\
+            .options(joinedload(Problem.user))\
             .order_by(desc(Problem.created_at))\
             .limit(10)\
             .all()
@@ -134,8 +120,8 @@ def admin_dashboard():
             "id": problem.id,
             "room": problem.room,
             "category": problem.category,
-            "urgency": problem.urgency.value,
-            "state": problem.state.value,
+            "urgency": problem.urgency,
+            "state": problem.state,
             "user": {
                 "name": problem.user.name,
                 "surname": problem.user.surname
@@ -154,16 +140,14 @@ def admin_dashboard():
             "name": user.name,
             "surname": user.surname,
             "email": user.email,
-            "role": user.role.value,
+            "role": user.role,
             "is_active": user.is_active,
             "created_at": user.created_at.isoformat()
         } for user in recent_users]
         
         # Get unread notifications count
         current_user_id = get_jwt_identity()
-        unread_notifications = db.session.query(Notification).filter_by(
-            user_id=current_user_id, is_read=False
-        ).count()
+        unread_notifications = unread_count(int(current_user_id))
         
         return jsonify({
             "user_stats": user_stats,
@@ -196,6 +180,8 @@ def get_users():
         is_active = request.args.get('is_active', type=lambda v: v.lower() == 'true' if v else None)
         sort_by = request.args.get('sort_by', 'created_at')
         sort_order = request.args.get('sort_order', 'desc')
+        cursor = request.args.get('cursor')  # Opt-in keyset pagination
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
         
         # Build query
         query = db.session.query(User)
@@ -210,51 +196,58 @@ def get_users():
             query = query.filter(search_filter)
         
         if role:
-            query = query.filter(User.role == UserRole(role))
+            query = query.filter(User.role == UserRole(role).value)
         
         if is_active is not None:
             query = query.filter(User.is_active == is_active)
         
         # Apply sorting
-        if sort_by == 'name':
-            query = query.order_by(User.name)
-        elif sort_by == 'email':
-            query = query.order_by(User.email)
-        elif sort_by == 'last_login':
-            query = query.order_by(desc(User.last_login))
-        else:
-            query = query.order_by(desc(User.created_at))
+        if sort_by not in USER_SORT_COLUMNS:
+            sort_by = 'created_at'
+        sort_column, descending = USER_SORT_COLUMNS[sort_by]
         
         # Paginate
-        pagination = query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        if cursor is not None:
+            items, pagination_data = keyset_paginate(
+                query, sort_column, sort_by, cursor, per_page,
+                descending=descending, with_total=include_total
+            )
+        else:
+            direction = desc if descending else asc
+            query = query.order_by(direction(sort_column), direction(User.id))
+            pagination = query.paginate(
+                page=page, per_page=per_page, error_out=False
+            )
+            items = pagination.items
+            pagination_data = {
+                "page": page,
+                "per_page": per_page,
+                "total": pagination.total,
+                "pages": pagination.pages,
+                "has_next": pagination.has_next,
+                "has_prev": pagination.has_prev
+            }
         
         users_data = [{
             "id": user.id,
             "name": user.name,
             "surname": user.surname,
             "email": user.email,
-            "role": user.role.value,
+            "role": user.role,
             "is_active": user.is_active,
             "email_verified": user.email_verified,
             "created_at": user.created_at.isoformat(),
             "last_login": user.last_login.isoformat() if user.last_login else None,
             "problems_count": len(user.problems)
-        } for user in pagination.items]
+        } for user in items]
         
         return jsonify({
             "users": users_data,
-            "pagination": {
-                "page": page,
-                "per_page": per_page,
-                "total": pagination.total,
-                "pages": pagination.pages,
-                "has_next": pagination.has_next,
-                "has_prev": pagination.has_prev
-            }
+            "pagination": pagination_data
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({"error": "Invalid cursor", "details": str(e)}), 400
     except Exception as e:
         return jsonify({"error": "Failed to fetch users"}), 500
 
@@ -280,7 +273,7 @@ def update_user(user_id):
             user.is_active = data['is_active']
         
         if 'role' in data:
-            user.role = UserRole(data['role'])
+            user.role = UserRole(data['role']).value
         
         if 'email_verified' in data:
             user.email_verified = data['email_verified']
@@ -295,7 +288,7 @@ def update_user(user_id):
                 "name": user.name,
                 "surname": user.surname,
                 "email": user.email,
-                "role": user.role.value,
+                "role": user.role,
                 "is_active": user.is_active,
                 "email_verified": user.email_verified
             }
@@ -322,28 +315,30 @@ def bulk_update_problems():
         schema = BulkUpdateSchema()
         data = schema.load(request.json)
         
-        problems = db.session.query(Problem).filter(Problem.id.in_(data['problem_ids'])).all()
+        problem_ids = list(dict.fromkeys(data['problem_ids']))
+        current_user_id = int(get_jwt_identity())
         
-        if not problems:
+        # Set-based statements per chunk, history and owner notifications included
+        attachment_paths = []
+        if data['action'] == 'delete':
+            updated_count, attachment_paths = bulk_delete(problem_ids)
+        else:
+            if data['action'] == 'change_status' and 'new_status' not in data:
+                return jsonify({"error": "new_status is required for change_status"}), 400
+            new_state = {
+                'activate': ProblemStatus.SUBMITTED.value,
+                'deactivate': ProblemStatus.REJECTED.value,
+            }.get(data['action']) or ProblemStatus(data['new_status']).value
+            updated_count = bulk_set_state(problem_ids, new_state, current_user_id)
+        
+        if not updated_count:
+            db.session.rollback()
             return jsonify({"error": "No problems found"}), 404
         
-        updated_count = 0
-        
-        for problem in problems:
-            if data['action'] == 'activate':
-                problem.state = ProblemStatus.SUBMITTED
-            elif data['action'] == 'deactivate':
-                problem.state = ProblemStatus.REJECTED
-            elif data['action'] == 'delete':
-                db.session.delete(problem)
-            elif data['action'] == 'change_status' and 'new_status' in data:
-                problem.state = ProblemStatus(data['new_status'])
-                if data['new_status'] == 'Problème traité':
-                    problem.resolved_at = datetime.utcnow()
-            
-            updated_count += 1
-        
         db.session.commit()
+        remove_files_async(attachment_paths)
+        # Every cached response carries 'problems': one write busts them all
+        invalidate_tags('problems')
         
         return jsonify({
             "message": f"Successfully updated {updated_count} problems",
@@ -370,86 +365,63 @@ def get_analytics():
         
         # Get date range
         days = request.args.get('days', 30, type=int)
-        end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=days)
-        
-        # Problems over time
-        problems_over_time = db.session.query(
-            func.date(Problem.created_at).label('date'),
-            func.count(Problem.id).label('count')
-        ).filter(
-            Problem.created_at >= start_date
-        ).group_by(
-            func.date(Problem.created_at)
-        ).order_by(
-            func.date(Problem.created_at)
-        ).all()
-        
-        # Problems by category
-        problems_by_category = db.session.query(
-            Problem.category,
-            func.count(Problem.id).label('count')
-        ).group_by(Problem.category).order_by(
-            func.count(Problem.id).desc()
-        ).all()
-        
-        # Problems by urgency
-        problems_by_urgency = db.session.query(
-            Problem.urgency,
-            func.count(Problem.id).label('count')
-        ).group_by(Problem.urgency).all()
-        
-        # Resolution time distribution
-        resolved_problems = db.session.query(Problem).filter(
-            and_(
-                Problem.state == ProblemStatus.RESOLVED,
-                Problem.resolved_at.isnot(None),
-                Problem.created_at >= start_date
-            )
-        ).all()
-        
-        resolution_times = []
-        for problem in resolved_problems:
-            if problem.resolved_at and problem.created_at:
-                hours = (problem.resolved_at - problem.created_at).total_seconds() / 3600
-                resolution_times.append(hours)
-        
-        # User activity
-        active_users = db.session.query(
-            func.date(User.last_login).label('date'),
-            func.count(User.id).label('count')
-        ).filter(
-            and_(
-                User.last_login >= start_date,
-                User.last_login.isnot(None)
-            )
-        ).group_by(
-            func.date(User.last_login)
-        ).order_by(
-            func.date(User.last_login)
-        ).all()
+        start_day = (datetime.utcnow() - timedelta(days=days)).date()
+        
+        # Closed days come from the daily rollups, only the rest (today) is computed live
+        daily = window_summaries(start_day)
+        totals = merge_summaries(daily.values())
+        problems_by_category = sorted(totals['categories'].items(), key=lambda item: (-item[1], item[0]))
+        
+        # Resolution time distribution: histogram and percentiles, raw values only on request
+        try:
+            bins = parse_bins(request.args.get('bins'), current_app.config['ANALYTICS_RESOLUTION_BINS'])
+        except ValueError:
+            return jsonify({"error": "Invalid bins"}), 400
+        resolution_time = resolution_distribution(start_day, bins)
+        
+        raw = {}
+        if request.args.get('include_raw', 'false').lower() == 'true':
+            page = max(request.args.get('page', 1, type=int), 1)
+            per_page = min(max(request.args.get('per_page', 100, type=int), 1), 1000)
+            resolution_times, has_next = resolution_times_page(start_day, page, per_page)
+            total = resolution_time['overall']['count']
+            raw = {
+                "resolution_times": resolution_times,
+                "resolution_times_pagination": {
+                    "page": page,
+                    "per_page": per_page,
+                    "total": total,
+                    "pages": (total + per_page - 1) // per_page,
+                    "has_next": has_next,
+                    "has_prev": page > 1
+                }
+            }
         
         return jsonify({
             "problems_over_time": [
-                {"date": str(item.date), "count": item.count}
-                for item in problems_over_time
+                {"date": day.isoformat(), "count": summary['total']}
+                for day, summary in sorted(daily.items()) if summary['total']
             ],
             "problems_by_category": [
-                {"category": item.category, "count": item.count}
-                for item in problems_by_category
+                {"category": category, "count": count}
+                for category, count in problems_by_category
             ],
             "problems_by_urgency": [
-                {"urgency": item.urgency.value, "count": item.count}
-                for item in problems_by_urgency
+                {"urgency": urgency, "count": count}
+                for urgency, count in sorted(totals['urgency'].items()) if count
             ],
-            "resolution_times": resolution_times,
+            "resolution_time": resolution_time,
+            **raw,
             "active_users": [
-                {"date": str(item.date), "count": item.count}
-                for item in active_users
+                {"date": day.isoformat(), "count": summary['active_users']}
+                for day, summary in sorted(daily.items()) if summary['active_users']
             ],
             "summary": {
-                "total_problems": len(resolved_problems),
-                "avg_resolution_time": sum(resolution_times) / len(resolution_times) if resolution_times else 0,
+                "total_problems": totals['total'],
+                "resolved_problems": totals['resolved'],
+                "avg_resolution_time": (
+                    totals['resolution_seconds'] / totals['resolved'] / 3600 if totals['resolved'] else 0
+                ),
                 "total_categories": len(problems_by_category)
             }
         }), 200
@@ -471,24 +443,18 @@ def create_notification():
         notifications_created = 0
         
         if data.get('broadcast', False):
-            # Send to all users
-            users = db.session.query(User).filter_by(is_active=True).all()
-            for user in users:
-                notification = Notification(
-                    user_id=user.id,
-                    title=data['title'],
-                    message=data['message'],
-                    type="system"
-                )
-                db.session.add(notification)
-                notifications_created += 1
+            # Stored once, read by every user through their receipts
+            broadcast(data['title'], data['message'])
+            notifications_created = audience_size(type="system")
         else:
             # Send to specific users
             if not data.get('user_ids'):
                 return jsonify({"error": "User IDs required when not broadcasting"}), 400
             
+            # Users who turned off system notifications are skipped
+            accepting = set(recipients(data['user_ids'], 'system'))
             for user_id in data['user_ids']:
-                user = db.session.get(User, user_id)
+                user = db.session.get(User, user_id) if user_id in accepting else None
                 if user:
                     notification = Notification(
                         user_id=user_id,
@@ -554,6 +520,7 @@ def system_health():
                 "total_problems": total_problems,
                 "total_notifications": total_notifications
             },
+            "email_outbox": queue_stats(),
             "timestamp": datetime.utcnow().isoformat()
         }), 200
         
@@ -562,4 +529,29 @@ def system_health():
             "status": "unhealthy",
             "error": str(e),
             "timestamp": datetime.utcnow().isoformat()
-        }), 500 
\ No newline at end of file
+        }), 500 
+
+@admin_bp.route('/system/queries', methods=['GET', 'DELETE', 'OPTIONS'])
+@jwt_required()
+def system_queries():
+    """Slow queries and N+1 patterns seen by this worker (DELETE clears them)"""
+    # Handle OPTIONS request for CORS preflight
+    if request.method == 'OPTIONS':
+        return '', 200
+
+    if get_jwt().get('role') != 'admin':
+        return jsonify({"error": "Insufficient permissions"}), 403
+
+    if request.method == 'DELETE':
+        query_diagnostics.clear()
+        return jsonify({"message": "Query reports cleared"}), 200
+
+    kind = request.args.get('kind')
+    if kind not in (None, 'slow', 'repeated'):
+        return jsonify({"error": "Invalid kind"}), 400
+    reports = query_diagnostics.reports(kind)
+    return jsonify({
+        "settings": query_diagnostics.settings(),
+        "reports": reports,
+        "total": len(reports)
+    }), 200
@@ -1,16 +1,17 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
 from flask_bcrypt import Bcrypt
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from marshmallow import Schema, fields, validate, ValidationError
 from datetime import datetime, timedelta
+import logging
 import re
 from flask_sqlalchemy import SQLAlchemy
 from models import User, UserRole, Notification
 from extensions import db, bcrypt, limiter
+from services.rate_limits import account_key, failed_login
 
 auth_bp = Blueprint('auth', __name__)
+logger = logging.getLogger(__name__)
 
 # Validation schemas
 class LoginSchema(Schema):
@@ -46,7 +47,8 @@ def validate_password_strength(password):
         raise ValidationError("Password must contain at least one special character")
 
 @auth_bp.route('/register/', methods=['POST', 'OPTIONS'])
-@limiter.limit("5 per minute")
+@limiter.limit("5 per minute", key_func=account_key)
+@limiter.limit("60 per minute")
 def register():
     """Register a new user"""
     # Handle OPTIONS request for CORS preflight
@@ -105,11 +107,14 @@ def register():
         return jsonify({"error": "Validation error", "details": e.messages}), 400
     except Exception as e:
         db.session.rollback()
-        print("Erreur lors de l'inscription :", e)
+        logger.exception("Registration failed")
         return jsonify({"error": "Registration failed"}), 500
 
 @auth_bp.route('/login/', methods=['POST', 'OPTIONS'])
-@limiter.limit("10 per minute")
+# Failed attempts per targeted account and address (brute force), and per address
+# (credential stuffing); successful logins behind the campus NAT are not counted
+@limiter.limit("10 per minute", key_func=account_key, deduct_when=failed_login)
+@limiter.limit("30 per minute;200 per hour", deduct_when=failed_login)
 def login():
     """Login user and return JWT tokens"""
     # Handle OPTIONS request for CORS preflight
@@ -160,7 +165,7 @@ def login():
     except ValidationError as e:
         return jsonify({"error": "Validation error", "details": e.messages}), 400
     except Exception as e:
-        print("Erreur lors du login :", e)
+        logger.exception("Login failed")
         return jsonify({"error": "Login failed"}), 500
 
 @auth_bp.route('/refresh/', methods=['POST', 'OPTIONS'])
@@ -276,7 +281,8 @@ def change_password():
         return jsonify({"error": "Failed to change password"}), 500
 
 @auth_bp.route('/forgot-password/', methods=['POST', 'OPTIONS'])
-@limiter.limit("3 per hour")
+@limiter.limit("3 per hour", key_func=account_key)
+@limiter.limit("100 per hour")
 def forgot_password():
     """Request password reset"""
     # Handle OPTIONS request for CORS preflight
@@ -1,10 +1,24 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, Response, current_app, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt, verify_jwt_in_request
 from marshmallow import Schema, fields, validate, ValidationError
 from sqlalchemy import desc
 from datetime import datetime
+import json
+import queue
+import time
 from extensions import db, cache
 from models import Notification, User
+from services.pagination import keyset_paginate, InvalidCursor
+from services.notifications import (
+    inbox_query, unread_clause, unread_count, read_broadcast_ids, get_for_user,
+    mark_read, dismiss, mark_all_read, clear_all
+)
+from services.unread_counters import unread_high_water
+from services.notification_stream import notification_stream, serialize_notification
+from services.notification_preferences import get_settings, muted_types, update_settings
+
+# Missed notifications replayed on reconnection; beyond that the client reloads its list
+STREAM_CATCH_UP_LIMIT = 100
 
 notifications_bp = Blueprint('notifications', __name__)
 
@@ -26,45 +40,38 @@ def get_notifications():
         return '', 200
         
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         
         # Get query parameters
         page = request.args.get('page', 1, type=int)
         per_page = min(request.args.get('per_page', 20, type=int), 100)
         unread_only = request.args.get('unread_only', 'false').lower() == 'true'
         notification_type = request.args.get('type', '')
+        cursor = request.args.get('cursor')  # Opt-in keyset pagination
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
         
-        # Build query
-        query = db.session.query(Notification).filter_by(user_id=current_user_id)
+        # Build query: personal notifications merged with broadcasts
+        query = inbox_query(current_user_id)
         
         # Apply filters
         if unread_only:
-            query = query.filter_by(is_read=False)
+            query = query.filter(unread_clause())
         
         if notification_type:
-            query = query.filter_by(type=notification_type)
-        
-        # Order by creation date (newest first)
-        query = query.order_by(desc(Notification.created_at))
-        
-        # Paginate
-        pagination = query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
-        
-        notifications_data = [{
-            "id": notification.id,
-            "title": notification.title,
-            "message": notification.message,
-            "type": notification.type,
-            "is_read": notification.is_read,
-            "data": notification.data,
-            "created_at": notification.created_at.isoformat()
-        } for notification in pagination.items]
-        
-        return jsonify({
-            "notifications": notifications_data,
-            "pagination": {
+            query = query.filter(Notification.type == notification_type)
+        
+        # Paginate, newest first
+        if cursor is not None:
+            items, pagination_data = keyset_paginate(
+                query, Notification.created_at, 'created_at', cursor, per_page, with_total=include_total
+            )
+        else:
+            query = query.order_by(desc(Notification.created_at), desc(Notification.id))
+            pagination = query.paginate(
+                page=page, per_page=per_page, error_out=False
+            )
+            items = pagination.items
+            pagination_data = {
                 "page": page,
                 "per_page": per_page,
                 "total": pagination.total,
@@ -72,8 +79,20 @@ def get_notifications():
                 "has_next": pagination.has_next,
                 "has_prev": pagination.has_prev
             }
+        
+        read_broadcasts = read_broadcast_ids(current_user_id, items)
+        notifications_data = [
+            serialize_notification(notification, notification.is_read or notification.id in read_broadcasts)
+            for notification in items
+        ]
+        
+        return jsonify({
+            "notifications": notifications_data,
+            "pagination": pagination_data
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({"error": "Invalid cursor", "details": str(e)}), 400
     except Exception as e:
         return jsonify({"error": "Failed to fetch notifications"}), 500
 
@@ -86,23 +105,21 @@ def mark_as_read(notification_id):
         return '', 200
         
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         
-        notification = db.session.query(Notification).filter_by(
-            id=notification_id, user_id=current_user_id
-        ).first()
+        notification = get_for_user(current_user_id, notification_id)
         
         if not notification:
             return jsonify({"error": "Notification not found"}), 404
         
-        notification.is_read = True
+        mark_read(current_user_id, notification)
         db.session.commit()
         
         return jsonify({
             "message": "Notification marked as read",
             "notification": {
-                "id": notification.id,
-                "is_read": notification.is_read
+                "id": notification_id,
+                "is_read": True
             }
         }), 200
         
@@ -119,12 +136,10 @@ def mark_all_as_read():
         return '', 200
         
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         
-        # Update all unread notifications for the user
-        updated_count = db.session.query(Notification).filter_by(
-            user_id=current_user_id, is_read=False
-        ).update({"is_read": True})
+        # Update all unread notifications and broadcasts for the user
+        updated_count = mark_all_read(current_user_id)
         
         db.session.commit()
         
@@ -146,16 +161,15 @@ def delete_notification(notification_id):
         return '', 200
         
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         
-        notification = db.session.query(Notification).filter_by(
-            id=notification_id, user_id=current_user_id
-        ).first()
+        notification = get_for_user(current_user_id, notification_id)
         
         if not notification:
             return jsonify({"error": "Notification not found"}), 404
         
-        db.session.delete(notification)
+        # Broadcasts are only hidden for this user
+        dismiss(current_user_id, notification)
         db.session.commit()
         
         return jsonify({
@@ -175,10 +189,10 @@ def clear_all_notifications():
         return '', 200
         
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         
-        # Delete all notifications for the user
-        deleted_count = db.session.query(Notification).filter_by(user_id=current_user_id).delete()
+        # Delete all notifications for the user, dismiss the broadcasts
+        deleted_count = clear_all(current_user_id)
         
         db.session.commit()
         
@@ -200,19 +214,109 @@ def get_unread_count():
         return '', 200
         
     try:
-        current_user_id = get_jwt_identity()
-        
-        unread_count = db.session.query(Notification).filter_by(
-            user_id=current_user_id, is_read=False
-        ).count()
+        current_user_id = int(get_jwt_identity())
         
         return jsonify({
-            "unread_count": unread_count
+            "unread_count": unread_count(current_user_id)
         }), 200
         
     except Exception as e:
         return jsonify({"error": "Failed to get unread count"}), 500
 
+def sse_message(event, data, event_id=None):
+    """Format one Server-Sent Events message"""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data)}"]
+    return '\n'.join(lines) + '\n\n'
+
+@notifications_bp.route('/stream', methods=['GET', 'OPTIONS'])
+def stream_notifications():
+    """Server-Sent Events: new notifications and unread count changes"""
+    # Handle OPTIONS request for CORS preflight
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    # EventSource cannot send headers: the token may come as ?jwt=
+    verify_jwt_in_request(locations=['headers', 'query_string'])
+    current_user_id = int(get_jwt_identity())
+    claims = get_jwt()
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID"}), 400
+    
+    # Subscribe before reading so nothing committed in between is lost
+    subscriber = notification_stream.subscribe(current_user_id, claims.get('role'),
+                                               muted_types(current_user_id))
+    try:
+        count, counted_up_to = unread_high_water(current_user_id)
+        missed = []
+        if last_event_id is not None:
+            missed = inbox_query(current_user_id)\
+                .filter(Notification.id > last_event_id)\
+                .order_by(Notification.id)\
+                .limit(STREAM_CATCH_UP_LIMIT + 1).all()
+        read_broadcasts = read_broadcast_ids(current_user_id, missed)
+        replay = [
+            serialize_notification(notification, notification.is_read or notification.id in read_broadcasts)
+            for notification in missed[:STREAM_CATCH_UP_LIMIT]
+        ]
+    except Exception:
+        notification_stream.unsubscribe(subscriber)
+        return jsonify({"error": "Failed to open notification stream"}), 500
+    
+    heartbeat = current_app.config['NOTIFICATION_STREAM_HEARTBEAT']
+    retry = current_app.config['NOTIFICATION_STREAM_RETRY']
+    expires_at = claims['exp']
+    
+    resync = len(missed) > STREAM_CATCH_UP_LIMIT
+    # Live events up to here were replayed already
+    replayed_up_to = replay[-1]['id'] if replay else (last_event_id or 0)
+    
+    def generate():
+        try:
+            yield f"retry: {retry}\n\n" + sse_message('unread', {"unread_count": count})
+            
+            if resync:
+                yield sse_message('resync', {})
+            for notification in replay:
+                yield sse_message('notification', {"notification": notification, "unread_delta": 0},
+                                  notification['id'])
+            
+            while True:
+                remaining = expires_at - time.time()
+                if remaining <= 0:
+                    # The client refreshes its token and reconnects with Last-Event-ID
+                    yield sse_message('expired', {})
+                    return
+                try:
+                    item = subscriber.events.get(timeout=min(heartbeat, remaining))
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                
+                if item['kind'] == 'unread':
+                    data = {"delta": item['delta']} if item['unread_count'] is None \
+                        else {"unread_count": item['unread_count']}
+                    yield sse_message('unread', data)
+                    continue
+                notification_id = item['notification']['id']
+                if notification_id <= replayed_up_to:
+                    continue
+                yield sse_message('notification', {
+                    "notification": item['notification'],
+                    # Already part of the initial count if committed before it was read
+                    "unread_delta": 0 if notification_id <= counted_up_to else 1
+                }, notification_id)
+        finally:
+            notification_stream.unsubscribe(subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # nginx must not buffer the stream
+    })
+
 @notifications_bp.route('/settings', methods=['GET', 'OPTIONS'])
 @jwt_required()
 def get_notification_settings():
@@ -228,15 +332,7 @@ def get_notification_settings():
         if not user:
             return jsonify({"error": "User not found"}), 404
         
-        # For now, return default settings
-        # In a real app, you would store these in the database
-        settings = {
-            "email_notifications": True,
-            "push_notifications": True,
-            "problem_updates": True,
-            "comments": True,
-            "system_notifications": True
-        }
+        settings = get_settings(user.id)
         
         return jsonify({
             "settings": settings
@@ -260,20 +356,22 @@ def update_notification_settings():
         if not user:
             return jsonify({"error": "User not found"}), 404
         
+        # Omitted settings keep their current value
         schema = NotificationSettingsSchema()
-        data = schema.load(request.json)
+        data = schema.load(request.json, partial=True)
         
-        # In a real app, you would save these settings to the database
-        # For now, we'll just return the updated settings
+        settings = update_settings(user.id, data)
+        db.session.commit()
         
         return jsonify({
             "message": "Notification settings updated successfully",
-            "settings": data
+            "settings": settings
         }), 200
         
     except ValidationError as e:
         return jsonify({"error": "Validation error", "details": e.messages}), 400
     except Exception as e:
+        db.session.rollback()
         return jsonify({"error": "Failed to update notification settings"}), 500
 
 @notifications_bp.route('/types', methods=['GET', 'OPTIONS'])
@@ -286,10 +384,10 @@ def get_notification_types():
         
     try:
         # Get unique notification types for the current user
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         
-        types = db.session.query(Notification.type)\
-            .filter_by(user_id=current_user_id)\
+        types = inbox_query(current_user_id)\
+            .with_entities(Notification.type)\
             .distinct()\
             .all()
         
@@ -1,20 +1,34 @@
-from flask import Blueprint, request, jsonify, current_app
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from flask import Blueprint, request, jsonify, current_app, url_for
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt, verify_jwt_in_request
 from marshmallow import Schema, fields, validate, ValidationError
 from sqlalchemy import and_, or_, desc, func
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
 import os
-import uuid
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 from werkzeug.utils import secure_filename
-from extensions import db, cache, mail
+from extensions import db
 from models import (
     User, Problem, ProblemLike, Comment, Attachment, ProblemHistory, 
     Notification, ProblemStatus, UrgencyLevel, UserRole
 )
-from flask_mail import Message
+from services.response_cache import cached_response, add_cache_tags, invalidate_tags
+from services.pagination import keyset_paginate, InvalidCursor
+from services.search import apply_search
+from services.view_counter import view_counter
+from services.counters import problem_counts
+from services.email_outbox import enqueue_email
+from services.notifications import broadcast
+from services.notification_preferences import recipients, wants
+from services.attachment_store import send_attachment, send_stored_file, store_upload
+from services.thumbnails import is_image, thumbnail_mime_type, thumbnailer
+from services.similarity import find_similar
+from services.structured_logging import sampled
 import json
+import logging
 
 problems_bp = Blueprint('problems', __name__)
+logger = logging.getLogger(__name__)
 
 # Validation schemas
 class ProblemCreateSchema(Schema):
@@ -29,12 +43,25 @@ class ProblemCreateSchema(Schema):
     tags = fields.List(fields.Str(), validate=validate.Length(max=10))
     location_coordinates = fields.Dict()
 
+class SimilarProblemSchema(Schema):
+    room = fields.Str(required=True, validate=validate.Length(min=1, max=100))
+    type_of_problem = fields.Str(validate=validate.Length(max=100))
+    description = fields.Str(required=True, validate=validate.Length(min=1, max=2000))
+
 class ProblemUpdateSchema(Schema):
     state = fields.Str(validate=validate.OneOf(['Soumis', 'En cours de traitement', 'Problème traité', 'Rejeté', 'Doublon']))
     message = fields.Str(validate=validate.Length(max=1000))
     estimated_resolution_time = fields.Int(validate=validate.Range(min=1, max=720))  # Max 30 days
     assigned_to = fields.Int()
 
+# sort_by option -> column (always descending, id as tie-breaker)
+PROBLEM_SORT_COLUMNS = {
+    'priority': Problem.priority_score,
+    'urgency': Problem.urgency,
+    'likes': Problem.likes_count,
+    'created_at': Problem.created_at
+}
+
 class CommentSchema(Schema):
     content = fields.Str(required=True, validate=validate.Length(min=1, max=1000))
     is_internal = fields.Bool(load_default=False)
@@ -46,24 +73,23 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
 def save_attachment(file, problem_id):
-    """Save uploaded file"""
+    """Save uploaded file in the content-addressed store"""
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-        
-        # Ensure upload directory exists
-        os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+        blob = store_upload(file.stream)
         
-        file.save(file_path)
+        # The stored type comes from the content, never from the client
+        if blob.mime_type not in current_app.config['ALLOWED_MIME_TYPES']:
+            return None
         
         attachment = Attachment(
             problem_id=problem_id,
-            filename=unique_filename,
+            filename=blob.sha256,
             original_filename=filename,
-            file_path=file_path,
-            file_size=os.path.getsize(file_path),
-            mime_type=file.content_type
+            file_path=blob.path,
+            file_size=blob.size,
+            mime_type=blob.mime_type,
+            sha256=blob.sha256
         )
         
         db.session.add(attachment)
@@ -81,6 +107,16 @@ def create_problem_history(problem_id, user_id, action, old_value=None, new_valu
     )
     db.session.add(history)
 
+def get_liked_problem_ids(user_id, problem_ids):
+    """Return the subset of problem_ids liked by user_id, in a single query"""
+    if not user_id or not problem_ids:
+        return set()
+    rows = db.session.query(ProblemLike.problem_id).filter(
+        ProblemLike.user_id == user_id,
+        ProblemLike.problem_id.in_(problem_ids)
+    ).all()
+    return {row.problem_id for row in rows}
+
 def calculate_priority_score(urgency, likes_count, created_at):
     """Calculate priority score for problem"""
     # Base score from urgency
@@ -96,31 +132,13 @@ def calculate_priority_score(urgency, likes_count, created_at):
     return base_score + like_bonus + time_bonus
 
 def send_email_notification(recipient_email, subject, body, html_body=None):
-    """Send email notification using Flask-Mail"""
-    try:
-        # Check if email sending is suppressed (development mode)
-        if current_app.config.get('MAIL_SUPPRESS_SEND', True):
-            print(f"[EMAIL SUPPRESSED] Would send to {recipient_email}: {subject}")
-            return True
-        
-        # Check if mail configuration is complete
-        if not current_app.config.get('MAIL_USERNAME') or not current_app.config.get('MAIL_PASSWORD'):
-            print(f"[EMAIL ERROR] Mail configuration incomplete. Would send to {recipient_email}: {subject}")
-            return False
-        
-        msg = Message(
-            subject=subject,
-            recipients=[recipient_email],
-            body=body,
-            html=html_body
-        )
-        mail.send(msg)
-        print(f"[EMAIL SENT] Successfully sent to {recipient_email}: {subject}")
-        return True
-    except Exception as e:
-        print(f"[EMAIL ERROR] Failed to send email to {recipient_email}: {e}")
-        # Don't raise the exception to avoid blocking the application
-        return False
+    """Queue an email notification in the outbox.
+
+    The row is part of the current transaction: the email is delivered by the
+    outbox worker once the caller commits, and dropped if it rolls back.
+    """
+    enqueue_email(recipient_email, subject, body, html_body)
+    return True
 
 def send_status_change_email(problem, new_state, admin_message=None):
     """Send email to student when problem status changes"""
@@ -179,7 +197,7 @@ L'équipe EasyReport
         
         return send_email_notification(student.email, subject, body, html_body)
     except Exception as e:
-        print(f"Error sending status change email: {e}")
+        logger.exception("Could not queue the status change email of problem %s", problem.id)
         return False
 
 def send_problem_resolved_email(problem, admin_message=None):
@@ -245,13 +263,17 @@ L'équipe EasyReport
         
         return send_email_notification(student.email, subject, body, html_body)
     except Exception as e:
-        print(f"Error sending problem resolved email: {e}")
+        logger.exception("Could not queue the resolution email of problem %s", problem.id)
         return False
 
-def send_new_problem_admin_email(problem):
+def send_new_problem_admin_email(problem, admins=None):
     """Send email to all admins when a new problem is submitted"""
     try:
-        admins = db.session.query(User).filter_by(role='admin').all()
+        if admins is None:
+            admins = db.session.query(User).filter_by(role='admin').all()
+        # Admins who turned off new problem emails are skipped
+        accepting = set(recipients([admin.id for admin in admins], 'problem_update', email=True))
+        admins = [admin for admin in admins if admin.id in accepting]
         if not admins:
             return False
         
@@ -319,7 +341,7 @@ Système EasyReport
         
         return success_count > 0
     except Exception as e:
-        print(f"Error sending new problem admin email: {e}")
+        logger.exception("Could not queue the new problem emails of problem %s", problem.id)
         return False
 
 # Routes
@@ -348,12 +370,14 @@ def create_problem():
         current_user_id = get_jwt_identity()
         
         # Check for duplicate problem (same room, category, same day)
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
         existing_problem = db.session.query(Problem).filter(
             and_(
                 Problem.user_id == current_user_id,
+                Problem.created_at >= today,
+                Problem.created_at < today + timedelta(days=1),
                 Problem.room == data['room'],
-                Problem.category == data['category'],
-                func.date(Problem.created_at) == func.date(func.now())
+                Problem.category == data['category']
             )
         ).first()
         
@@ -380,6 +404,14 @@ def create_problem():
         db.session.add(problem)
         db.session.flush()  # Get the ID
         
+        # Link to an open problem of the same room describing the same thing
+        threshold = current_app.config['SIMILARITY_AUTO_LINK_THRESHOLD']
+        if threshold is not None:
+            matches = find_similar(problem.room, problem.type_of_problem, problem.description,
+                                   exclude=problem.id, threshold=threshold, limit=1)
+            if matches:
+                problem.duplicate_of_id = matches[0][0].id
+        
         # Handle file uploads
         if 'files' in request.files:
             files = request.files.getlist('files')
@@ -392,28 +424,24 @@ def create_problem():
             problem.urgency, 0, problem.created_at
         )
         
-        db.session.commit()
-        
         # Create history entry
         create_problem_history(problem.id, current_user_id, 'problem_created')
         
-        # Notify admins
-        admins = db.session.query(User).filter_by(role='admin').all()
-        for admin in admins:
-            notification = Notification(
-                user_id=admin.id,
-                title="New Problem Submitted",
-                message=f"A new problem has been submitted in {problem.room}",
-                type="problem_update",
-                data=json.dumps({"problem_id": problem.id})
-            )
-            db.session.add(notification)
-        
-        db.session.commit()
+        # Notify admins: a single broadcast instead of one copy per admin
+        broadcast(
+            "New Problem Submitted",
+            f"A new problem has been submitted in {problem.room}",
+            type="problem_update",
+            audience=UserRole.ADMIN.value,
+            data=json.dumps({"problem_id": problem.id})
+        )
         
-        # Send email notification to admins
+        # Queue the email to admins: one transaction with the problem and notification
         send_new_problem_admin_email(problem)
         
+        db.session.commit()
+        invalidate_tags('problems', f'user:{current_user_id}')
+        
         return jsonify({
             "message": "Problem submitted successfully",
             "problem": {
@@ -422,6 +450,7 @@ def create_problem():
                 "category": problem.category,
                 "urgency": problem.urgency,
                 "state": problem.state,
+                "duplicate_of_id": problem.duplicate_of_id,
                 "created_at": problem.created_at.isoformat()
             }
         }), 201
@@ -430,13 +459,44 @@ def create_problem():
         return jsonify({"error": "Validation error", "details": e.messages}), 400
     except Exception as e:
         db.session.rollback()
-        import traceback; traceback.print_exc()
-        print('Erreur soumission problème:', e)
+        logger.exception("Problem submission failed")
         return jsonify({"error": "Failed to submit problem", "details": str(e)}), 500
 
+@problems_bp.route('/similar', methods=['POST', 'OPTIONS'])
+@jwt_required()
+def similar_problems():
+    """Open problems of the same room close to a draft (preview before submitting)"""
+    # Handle OPTIONS request for CORS preflight
+    if request.method == 'OPTIONS':
+        return '', 200
+        
+    try:
+        data = SimilarProblemSchema().load(request.get_json() or {})
+        matches = find_similar(data['room'], data.get('type_of_problem'), data['description'])
+        
+        # Anonymous, like the all-problems view
+        return jsonify({
+            "similar_problems": [{
+                "id": problem.id,
+                "room": problem.room,
+                "category": problem.category,
+                "type_of_problem": problem.type_of_problem,
+                "description": problem.description,
+                "state": problem.state,
+                "likes_count": problem.likes_count,
+                "created_at": problem.created_at.isoformat(),
+                "similarity": round(score, 3)
+            } for problem, score in matches]
+        }), 200
+        
+    except ValidationError as e:
+        return jsonify({"error": "Validation error", "details": e.messages}), 400
+    except Exception as e:
+        return jsonify({"error": "Failed to find similar problems"}), 500
+
 @problems_bp.route('/', methods=['GET', 'OPTIONS'])
 @jwt_required(optional=True)  # Make JWT optional for OPTIONS requests
-@cache.cached(timeout=300)  # Cache for 5 minutes
+@cached_response(timeout=300)  # Cache for 5 minutes, per identity
 def get_problems():
     """Get problems with pagination, search, and filters"""
     # Handle OPTIONS request for CORS preflight
@@ -454,14 +514,16 @@ def get_problems():
         room = request.args.get('room', '')
         sort_by = request.args.get('sort_by', 'created_at')
         sort_order = request.args.get('sort_order', 'desc')
+        cursor = request.args.get('cursor')  # Opt-in keyset pagination
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
         
         # Get current user info
         current_user_id = get_jwt_identity()
         claims = get_jwt() if current_user_id else {}
         user_role = claims.get('role') if claims else None
         
-        # Build query
-        query = db.session.query(Problem)
+        # Build query (owner loaded in the same SELECT)
+        query = db.session.query(Problem).options(joinedload(Problem.user))
         
         # Filter by user role for confidentiality
         if user_role == 'student':
@@ -475,13 +537,9 @@ def get_problems():
             return jsonify({"error": "Authentication required"}), 401
         
         # Apply filters
+        search_rank = None
         if search:
-            search_filter = or_(
-                Problem.description.ilike(f'%{search}%'),
-                Problem.type_of_problem.ilike(f'%{search}%'),
-                Problem.room.ilike(f'%{search}%')
-            )
-            query = query.filter(search_filter)
+            query, search_rank = apply_search(query, search)
         
         if category:
             query = query.filter(Problem.category == category)
@@ -495,25 +553,48 @@ def get_problems():
         if room:
             query = query.filter(Problem.room.ilike(f'%{room}%'))
         
-        # Apply sorting
-        if sort_by == 'priority':
-            query = query.order_by(desc(Problem.priority_score))
-        elif sort_by == 'urgency':
-            query = query.order_by(desc(Problem.urgency))
-        elif sort_by == 'likes':
-            query = query.order_by(desc(Problem.likes_count))
-        else:
-            query = query.order_by(desc(Problem.created_at))
+        # Apply sorting (full-text matches rank by relevance unless sort_by is given)
+        rank_by_relevance = search_rank is not None and 'sort_by' not in request.args
+        if sort_by not in PROBLEM_SORT_COLUMNS:
+            sort_by = 'created_at'
+        sort_column = PROBLEM_SORT_COLUMNS[sort_by]
+        if sort_by in ('priority', 'likes'):
+            # Which problems make the page depends on every like: tag before reading
+            add_cache_tags('problems:ranking')
         
         # Paginate
-        pagination = query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        if cursor is not None:
+            items, pagination_data = keyset_paginate(
+                query, sort_column, sort_by, cursor, per_page, with_total=include_total
+            )
+        else:
+            if rank_by_relevance:
+                query = query.order_by(search_rank, desc(Problem.id))
+            else:
+                query = query.order_by(desc(sort_column), desc(Problem.id))
+            pagination = query.paginate(
+                page=page, per_page=per_page, error_out=False
+            )
+            items = pagination.items
+            pagination_data = {
+                "page": page,
+                "per_page": per_page,
+                "total": pagination.total,
+                "pages": pagination.pages,
+                "has_next": pagination.has_next,
+                "has_prev": pagination.has_prev
+            }
+        
+        # Tag the page as soon as it is read: a like landing later busts it
+        add_cache_tags(*[f'problem:{problem.id}' for problem in items])
         
-        # Check if user liked each problem
+        # Resolve is_liked for the whole page in one query
+        liked_ids = get_liked_problem_ids(
+            current_user_id, [problem.id for problem in items]
+        )
         problems_data = []
         
-        for problem in pagination.items:
+        for problem in items:
             # For students, don't show other users' names for confidentiality
             user_info = {}
             if user_role == 'admin':
@@ -552,24 +633,17 @@ def get_problems():
                 "tags": json.loads(problem.tags) if problem.tags else [],
                 "created_at": problem.created_at.isoformat(),
                 "updated_at": problem.updated_at.isoformat(),
-                "is_liked": db.session.query(ProblemLike).filter_by(
-                    user_id=current_user_id, problem_id=problem.id
-                ).first() is not None if current_user_id else False
+                "is_liked": problem.id in liked_ids
             }
             problems_data.append(problem_dict)
         
         return jsonify({
             "problems": problems_data,
-            "pagination": {
-                "page": page,
-                "per_page": per_page,
-                "total": pagination.total,
-                "pages": pagination.pages,
-                "has_next": pagination.has_next,
-                "has_prev": pagination.has_prev
-            }
+            "pagination": pagination_data
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({"error": "Invalid cursor", "details": str(e)}), 400
     except Exception as e:
         return jsonify({"error": "Failed to fetch problems"}), 500
 
@@ -583,10 +657,11 @@ def get_problem(problem_id):
         
     try:
         problem = db.session.get(Problem, problem_id)
+        if not problem:
+            return jsonify({"error": "Problem not found"}), 404
         
-        # Increment view count
-        problem.views_count += 1
-        db.session.commit()
+        # Increment view count (buffered, flushed in bulk by the view counter)
+        view_counter.record(problem_id)
         
         # Get comments
         comments = db.session.query(Comment).filter_by(problem_id=problem_id).order_by(Comment.created_at).all()
@@ -619,7 +694,13 @@ def get_problem(problem_id):
             "filename": att.original_filename,
             "file_size": att.file_size,
             "mime_type": att.mime_type,
-            "uploaded_at": att.uploaded_at.isoformat()
+            "uploaded_at": att.uploaded_at.isoformat(),
+            "url": url_for('problems.download_attachment', problem_id=problem_id, attachment_id=att.id),
+            "thumbnails": {
+                size: url_for('problems.attachment_thumbnail', problem_id=problem_id,
+                              attachment_id=att.id, size=size)
+                for size in current_app.config['THUMBNAIL_SIZES']
+            } if is_image(att) else {}
         } for att in attachments]
         
         # Check if user liked
@@ -646,7 +727,7 @@ def get_problem(problem_id):
             "state": problem.state,
             "message": problem.message,
             "likes_count": problem.likes_count,
-            "views_count": problem.views_count,
+            "views_count": problem.views_count + view_counter.pending(problem_id),
             "priority_score": problem.priority_score,
             "estimated_resolution_time": problem.estimated_resolution_time,
             "assigned_to": problem.assigned_to,
@@ -655,6 +736,7 @@ def get_problem(problem_id):
             "created_at": problem.created_at.isoformat(),
             "updated_at": problem.updated_at.isoformat(),
             "resolved_at": problem.resolved_at.isoformat() if problem.resolved_at else None,
+            "duplicate_of_id": problem.duplicate_of_id,
             "is_liked": is_liked,
             "comments": comments_data,
             "attachments": attachments_data
@@ -665,12 +747,78 @@ def get_problem(problem_id):
     except Exception as e:
         return jsonify({"error": "Failed to fetch problem"}), 500
 
+def load_authorized_attachment(problem_id, attachment_id):
+    """Return (attachment, None) or (None, error response) for the current user"""
+    # <img src> and download links cannot send headers: the token may come as ?jwt=
+    verify_jwt_in_request(locations=['headers', 'query_string'])
+    row = db.session.query(Attachment, Problem.user_id)\
+        .join(Problem, Problem.id == Attachment.problem_id)\
+        .filter(Attachment.id == attachment_id, Attachment.problem_id == problem_id)\
+        .first()
+    if not row:
+        return None, (jsonify({"error": "Attachment not found"}), 404)
+    attachment, owner_id = row
+    
+    claims = get_jwt()
+    if claims.get('role') == 'student' and owner_id != int(get_jwt_identity()):
+        return None, (jsonify({"error": "Access denied"}), 403)
+    return attachment, None
+
+@problems_bp.route('/<int:problem_id>/attachments/<int:attachment_id>', methods=['GET', 'OPTIONS'])
+def download_attachment(problem_id, attachment_id):
+    """Download an attachment (owner and staff only)"""
+    # Handle OPTIONS request for CORS preflight
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    attachment, error = load_authorized_attachment(problem_id, attachment_id)
+    if error:
+        return error
+    try:
+        return send_attachment(attachment, as_attachment=request.args.get('download') == 'true')
+        
+    except RequestedRangeNotSatisfiable as e:
+        return e
+    except FileNotFoundError:
+        return jsonify({"error": "Attachment file not found"}), 404
+    except Exception as e:
+        return jsonify({"error": "Failed to fetch attachment"}), 500
+
+@problems_bp.route('/<int:problem_id>/attachments/<int:attachment_id>/thumbnails/<size>', methods=['GET', 'OPTIONS'])
+def attachment_thumbnail(problem_id, attachment_id, size):
+    """Thumbnail of an image attachment, generated on first request"""
+    # Handle OPTIONS request for CORS preflight
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    attachment, error = load_authorized_attachment(problem_id, attachment_id)
+    if error:
+        return error
+    if size not in current_app.config['THUMBNAIL_SIZES']:
+        return jsonify({"error": "Unknown thumbnail size"}), 404
+    if not is_image(attachment):
+        return jsonify({"error": "Attachment is not an image"}), 404
+    try:
+        path = thumbnailer.get(attachment, size)
+        base = os.path.splitext(attachment.original_filename)[0]
+        return send_stored_file(
+            path, thumbnail_mime_type(attachment), f"{base}-{size}{os.path.splitext(path)[1]}",
+            etag=f"{attachment.sha256}-{size}" if attachment.sha256 else None
+        )
+        
+    except RequestedRangeNotSatisfiable as e:
+        return e
+    except FileNotFoundError:
+        return jsonify({"error": "Attachment file not found"}), 404
+    except Exception as e:
+        return jsonify({"error": "Failed to generate thumbnail"}), 500
+
 @problems_bp.route('/<int:problem_id>/like', methods=['POST', 'OPTIONS'])
 @jwt_required(optional=True)
 def toggle_like(problem_id):
     """Toggle like on a problem"""
     if request.method == 'OPTIONS':
-        print(f'OPTIONS preflight received for /api/problems/{problem_id}/like')
+        logger.debug("Like preflight for problem %s", problem_id, extra=sampled())
         return '', 200
         
     try:
@@ -705,6 +853,7 @@ def toggle_like(problem_id):
         create_problem_history(problem_id, current_user_id, f'problem_{action}')
         
         db.session.commit()
+        invalidate_tags(f'problem:{problem_id}', f'user:{current_user_id}', 'problems:ranking')
         
         return jsonify({
             "message": f"Problem {action} successfully",
@@ -718,7 +867,7 @@ def toggle_like(problem_id):
 
 @problems_bp.route('/<int:problem_id>/like/', methods=['OPTIONS'])
 def like_options_slash(problem_id):
-    print(f'OPTIONS explicit route for /api/problems/{problem_id}/like/ (slash)')
+    logger.debug("Like preflight for problem %s", problem_id, extra=sampled())
     return '', 200
 
 @problems_bp.route('/<int:problem_id>/like/', methods=['POST'])
@@ -760,8 +909,9 @@ def add_comment(problem_id):
         # Create history entry
         create_problem_history(problem_id, current_user_id, 'comment_added')
         
-        # Notify problem owner if comment is not internal
-        if not data.get('is_internal', False) and problem.user_id != current_user_id:
+        # Notify problem owner if comment is not internal (and they want comment notifications)
+        if not data.get('is_internal', False) and problem.user_id != current_user_id \
+                and wants(problem.user_id, 'comment'):
             notification = Notification(
                 user_id=problem.user_id,
                 title="New Comment on Your Problem",
@@ -772,6 +922,7 @@ def add_comment(problem_id):
             db.session.add(notification)
         
         db.session.commit()
+        invalidate_tags(f'problem:{problem_id}')
         
         return jsonify({
             "message": "Comment added successfully",
@@ -838,8 +989,8 @@ def update_problem(problem_id):
                 str(change['old']), str(change['new'])
             )
         
-        # Notify problem owner of status change
-        if 'state' in changes:
+        # Notify problem owner of status change, as their settings allow
+        if 'state' in changes and wants(problem.user_id, 'problem_update'):
             notification = Notification(
                 user_id=problem.user_id,
                 title="Problem Status Updated",
@@ -848,7 +999,8 @@ def update_problem(problem_id):
                 data=json.dumps({"problem_id": problem_id, "new_state": data['state']})
             )
             db.session.add(notification)
-            
+        
+        if 'state' in changes and wants(problem.user_id, 'problem_update', email=True):
             # Send email notification to student
             admin_message = data.get('message') if data.get('message') else None
             
@@ -860,6 +1012,8 @@ def update_problem(problem_id):
                 send_status_change_email(problem, data['state'], admin_message)
         
         db.session.commit()
+        # A state change moves the problem between filtered lists and stats buckets
+        invalidate_tags(f'problem:{problem_id}', 'problems' if 'state' in changes else None)
         
         return jsonify({
             "message": "Problem updated successfully",
@@ -872,13 +1026,11 @@ def update_problem(problem_id):
         }), 200
         
     except ValidationError as e:
-        print('VALIDATION ERROR:', e)
+        logger.info("Problem %s update rejected: %s", problem_id, e.messages)
         return jsonify({"error": "Validation error", "details": e.messages}), 400
     except Exception as e:
-        import traceback
         db.session.rollback()
-        print('ERROR:', e)
-        traceback.print_exc()
+        logger.exception("Update of problem %s failed", problem_id)
         return jsonify({"error": "Failed to update problem", "details": str(e)}), 500
 
 @problems_bp.route('/<int:problem_id>/history', methods=['GET'])
@@ -912,13 +1064,11 @@ def get_problem_history(problem_id):
 
 @problems_bp.route('/categories', methods=['GET'])
 @jwt_required()
-@cache.cached(timeout=3600)  # Cache for 1 hour
+@cached_response(timeout=3600)  # Cache for 1 hour, busted with the problems tag
 def get_categories():
     """Get all available categories"""
     try:
-        categories = db.session.query(Problem.category, func.count(Problem.id))\
-            .group_by(Problem.category)\
-            .order_by(func.count(Problem.id).desc()).all()
+        categories = problem_counts()['categories']
         
         return jsonify({
             "categories": [{"name": cat, "count": count} for cat, count in categories]
@@ -929,54 +1079,27 @@ def get_categories():
 
 @problems_bp.route('/stats', methods=['GET'])
 @jwt_required()
-@cache.cached(timeout=300)  # Cache for 5 minutes
+@cached_response(timeout=300)  # Cache for 5 minutes, per identity
 def get_stats():
     """Get problem statistics"""
     try:
         claims = get_jwt()
         current_user_id = get_jwt_identity()
         
-        # Base query
-        query = db.session.query(Problem)
-        
-        # Filter by user role
-        if claims.get('role') == 'student':
-            query = query.filter(Problem.user_id == current_user_id)
-        
-        # Get counts
-        total_problems = query.count()
-        resolved_problems = query.filter(Problem.state == 'Problème traité').count()
-        in_progress = query.filter(Problem.state == 'En cours de traitement').count()
-        pending = query.filter(Problem.state == 'Soumis').count()
+        # Students only see statistics about their own problems
+        user_id = current_user_id if claims.get('role') == 'student' else None
         
-        # Get urgency distribution
-        urgency_stats = db.session.query(
-            Problem.urgency, func.count(Problem.id)
-        ).group_by(Problem.urgency).all()
+        # Counts, urgency split and average resolution time from the live counters
+        stats = problem_counts(user_id)
+        total_problems = stats['total']
+        resolved_problems = stats['resolved']
+        in_progress = stats['in_progress']
+        pending = stats['pending']
+        avg_resolution_time = stats['avg_resolution_hours']
+        urgency_stats = [(urgency, count) for urgency, count in stats['urgency'].items() if count]
         
         # Get category distribution
-        category_stats = db.session.query(
-            Problem.category, func.count(Problem.id)
-        ).group_by(Problem.category).order_by(func.count(Problem.id).desc()).limit(10).all()
-        
-        # Calculate average resolution time
-        resolved_problems_with_time = query.filter(
-            and_(
-                Problem.state == 'Problème traité',
-                Problem.resolved_at.isnot(None)
-            )
-        ).all()
-        
-        total_resolution_time = 0
-        count_with_time = 0
-        
-        for problem in resolved_problems_with_time:
-            if problem.resolved_at and problem.created_at:
-                resolution_time = (problem.resolved_at - problem.created_at).total_seconds() / 3600  # hours
-                total_resolution_time += resolution_time
-                count_with_time += 1
-        
-        avg_resolution_time = total_resolution_time / count_with_time if count_with_time > 0 else 0
+        category_stats = stats['categories'][:10]
         
         return jsonify({
             "total_problems": total_problems,
@@ -1000,7 +1123,7 @@ def get_stats():
 
 @problems_bp.route('/all', methods=['GET', 'OPTIONS'])
 @jwt_required()
-@cache.cached(timeout=300)  # Cache for 5 minutes
+@cached_response(timeout=300)  # Cache for 5 minutes, per identity
 def get_all_problems():
     """Get all problems for the all-problems page (anonymous view for students)"""
     # Handle OPTIONS request for CORS preflight
@@ -1018,6 +1141,8 @@ def get_all_problems():
         room = request.args.get('room', '')
         sort_by = request.args.get('sort_by', 'created_at')
         sort_order = request.args.get('sort_order', 'desc')
+        cursor = request.args.get('cursor')  # Opt-in keyset pagination
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
         
         # Get current user info
         current_user_id = get_jwt_identity()
@@ -1025,16 +1150,12 @@ def get_all_problems():
         user_role = claims.get('role')
         
         # Build query - show ALL problems for all-problems page
-        query = db.session.query(Problem)
+        query = db.session.query(Problem).options(joinedload(Problem.user))
         
         # Apply filters
+        search_rank = None
         if search:
-            search_filter = or_(
-                Problem.description.ilike(f'%{search}%'),
-                Problem.type_of_problem.ilike(f'%{search}%'),
-                Problem.room.ilike(f'%{search}%')
-            )
-            query = query.filter(search_filter)
+            query, search_rank = apply_search(query, search)
         
         if category:
             query = query.filter(Problem.category == category)
@@ -1048,25 +1169,48 @@ def get_all_problems():
         if room:
             query = query.filter(Problem.room.ilike(f'%{room}%'))
         
-        # Apply sorting
-        if sort_by == 'priority':
-            query = query.order_by(desc(Problem.priority_score))
-        elif sort_by == 'urgency':
-            query = query.order_by(desc(Problem.urgency))
-        elif sort_by == 'likes':
-            query = query.order_by(desc(Problem.likes_count))
-        else:
-            query = query.order_by(desc(Problem.created_at))
+        # Apply sorting (full-text matches rank by relevance unless sort_by is given)
+        rank_by_relevance = search_rank is not None and 'sort_by' not in request.args
+        if sort_by not in PROBLEM_SORT_COLUMNS:
+            sort_by = 'created_at'
+        sort_column = PROBLEM_SORT_COLUMNS[sort_by]
+        if sort_by in ('priority', 'likes'):
+            # Which problems make the page depends on every like: tag before reading
+            add_cache_tags('problems:ranking')
         
         # Paginate
-        pagination = query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        if cursor is not None:
+            items, pagination_data = keyset_paginate(
+                query, sort_column, sort_by, cursor, per_page, with_total=include_total
+            )
+        else:
+            if rank_by_relevance:
+                query = query.order_by(search_rank, desc(Problem.id))
+            else:
+                query = query.order_by(desc(sort_column), desc(Problem.id))
+            pagination = query.paginate(
+                page=page, per_page=per_page, error_out=False
+            )
+            items = pagination.items
+            pagination_data = {
+                "page": page,
+                "per_page": per_page,
+                "total": pagination.total,
+                "pages": pagination.pages,
+                "has_next": pagination.has_next,
+                "has_prev": pagination.has_prev
+            }
         
-        # Check if user liked each problem
+        # Tag the page as soon as it is read: a like landing later busts it
+        add_cache_tags(*[f'problem:{problem.id}' for problem in items])
+        
+        # Resolve is_liked for the whole page in one query
+        liked_ids = get_liked_problem_ids(
+            current_user_id, [problem.id for problem in items]
+        )
         problems_data = []
         
-        for problem in pagination.items:
+        for problem in items:
             # For students, always hide user names for confidentiality in all-problems view
             user_info = {}
             if user_role == 'admin':
@@ -1100,23 +1244,16 @@ def get_all_problems():
                 "tags": json.loads(problem.tags) if problem.tags else [],
                 "created_at": problem.created_at.isoformat(),
                 "updated_at": problem.updated_at.isoformat(),
-                "is_liked": db.session.query(ProblemLike).filter_by(
-                    user_id=current_user_id, problem_id=problem.id
-                ).first() is not None
+                "is_liked": problem.id in liked_ids
             }
             problems_data.append(problem_dict)
         
         return jsonify({
             "problems": problems_data,
-            "pagination": {
-                "page": page,
-                "per_page": per_page,
-                "total": pagination.total,
-                "pages": pagination.pages,
-                "has_next": pagination.has_next,
-                "has_prev": pagination.has_prev
-            }
+            "pagination": pagination_data
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({"error": "Invalid cursor", "details": str(e)}), 400
     except Exception as e:
         return jsonify({"error": "Failed to fetch all problems"}), 500 
\ No newline at end of file
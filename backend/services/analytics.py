@@ -0,0 +1,442 @@
+"""
+Agrégats quotidiens (table ``analytics``) pour ``/api/admin/analytics``.
+
+Chaque jour UTC clos a une ligne : problèmes créés (total, par catégorie, par
+urgence), problèmes résolus ce jour-là avec la somme de leurs temps de
+résolution, et utilisateurs dont la dernière connexion tombe ce jour-là. La
+ligne garde aussi la distribution des temps de résolution du jour, par couple
+(catégorie, urgence) : histogramme sur ``ANALYTICS_RESOLUTION_BINS`` et
+sketch de quantiles, fusionnés à la lecture.
+
+``flask analytics rollup`` (cron nocturne) ne calcule que les jours pas encore
+agrégés ; ``flask analytics backfill`` recalcule l'historique. L'endpoint lit
+les lignes de la fenêtre et ne calcule en direct que les jours non agrégés
+(normalement aujourd'hui seulement) : son coût ne dépend pas du nombre de
+problèmes de la fenêtre. Seule la page de temps bruts (``include_raw``) lit
+les problèmes un à un. Un histogramme demandé sur d'autres bornes (``bins``)
+est déduit des sketchs des jours agrégés : exact sauf pour les valeurs à
+moins de ``SKETCH_ACCURACY`` près d'une borne.
+
+Note : ``users.last_login`` ne garde que la dernière connexion, un backfill
+sous-estime donc les utilisateurs actifs des jours anciens ; l'agrégat
+nocturne, lui, les compte exactement.
+"""
+
+import bisect
+import json
+import math
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, func
+from sqlalchemy.orm import defer
+
+from extensions import db
+from models import Analytics, Problem, ProblemStatus, User
+from services.stats import hours_between
+
+# Relative error of the resolution time percentiles
+SKETCH_ACCURACY = 0.01
+SKETCH_MIN_VALUE = 1e-6
+STREAM_BATCH_SIZE = 1000
+MAX_BINS = 50
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _start_of(day):
+    return datetime(day.year, day.month, day.day)
+
+
+def today():
+    return datetime.utcnow().date()
+
+
+def empty_summary():
+    return {
+        "total": 0,
+        "resolved": 0,
+        "resolution_seconds": 0,
+        "categories": Counter(),
+        "urgency": Counter(),
+        "active_users": 0,
+    }
+
+
+def summarize_days(start_day, end_day):
+    """Per-day summaries for ``[start_day, end_day)``, three GROUP BY queries in all"""
+    start, end = _start_of(start_day), _start_of(end_day)
+    summaries = {}
+
+    def summary(day):
+        return summaries.setdefault(_as_date(day), empty_summary())
+
+    created_day = func.date(Problem.created_at)
+    created = db.session.query(created_day, Problem.category, Problem.urgency, func.count(Problem.id))\
+        .filter(Problem.created_at >= start, Problem.created_at < end)\
+        .group_by(created_day, Problem.category, Problem.urgency).all()
+    for day, category, urgency, count in created:
+        day_summary = summary(day)
+        day_summary['total'] += count
+        day_summary['categories'][category] += count
+        day_summary['urgency'][urgency] += count
+
+    resolved_day = func.date(Problem.resolved_at)
+    resolved = db.session.query(
+        resolved_day,
+        func.count(Problem.id),
+        func.sum(func.round(hours_between(Problem.created_at, Problem.resolved_at) * 3600))
+    ).filter(
+        Problem.state == ProblemStatus.RESOLVED.value,
+        Problem.resolved_at >= start, Problem.resolved_at < end
+    ).group_by(resolved_day).all()
+    for day, count, seconds in resolved:
+        day_summary = summary(day)
+        day_summary['resolved'] = count
+        day_summary['resolution_seconds'] = int(seconds or 0)
+
+    login_day = func.date(User.last_login)
+    logins = db.session.query(login_day, func.count(User.id))\
+        .filter(User.last_login >= start, User.last_login < end)\
+        .group_by(login_day).all()
+    for day, count in logins:
+        summary(day)['active_users'] = count
+
+    return summaries
+
+
+def summary_from_row(row):
+    return {
+        "total": row.total_problems or 0,
+        "resolved": row.resolved_problems or 0,
+        "resolution_seconds": row.resolution_seconds or 0,
+        "categories": Counter(json.loads(row.problems_by_category or '{}')),
+        "urgency": Counter({int(level): count for level, count in json.loads(row.problems_by_urgency or '{}').items()}),
+        "active_users": row.active_users or 0,
+    }
+
+
+def rollup_days(start_day, end_day):
+    """(Re)write one Analytics row per day of ``[start_day, end_day)``; returns the day count"""
+    if start_day >= end_day:
+        return 0
+    summaries = summarize_days(start_day, end_day)
+    db.session.query(Analytics)\
+        .filter(Analytics.date >= _start_of(start_day), Analytics.date < _start_of(end_day))\
+        .delete(synchronize_session=False)
+
+    edges = current_app.config['ANALYTICS_RESOLUTION_BINS']
+    distributions = distribution_days(start_day, end_day, edges)
+    day = start_day
+    while day < end_day:
+        summary = summaries.get(day) or empty_summary()
+        db.session.add(Analytics(
+            date=_start_of(day),
+            total_problems=summary['total'],
+            resolved_problems=summary['resolved'],
+            resolution_seconds=summary['resolution_seconds'],
+            avg_resolution_time=(
+                round(summary['resolution_seconds'] / summary['resolved'] / 3600) if summary['resolved'] else None
+            ),
+            problems_by_category=json.dumps(dict(summary['categories'])),
+            problems_by_urgency=json.dumps(dict(summary['urgency'])),
+            active_users=summary['active_users'],
+            resolution_distribution=json.dumps(dump_distribution(distributions.get(day, {}), edges))
+        ))
+        day += timedelta(days=1)
+    db.session.commit()
+    return (end_day - start_day).days
+
+
+def last_rolled_up_day():
+    last = db.session.query(func.max(Analytics.date)).scalar()
+    return _as_date(last) if last is not None else None
+
+
+def first_activity_day():
+    first = db.session.query(func.min(Problem.created_at)).scalar()
+    return _as_date(first) if first is not None else None
+
+
+def rollup_pending():
+    """Roll up every closed day after the last rollup; returns the day count"""
+    last = last_rolled_up_day()
+    start_day = last + timedelta(days=1) if last else first_activity_day()
+    if start_day is None:
+        return 0
+    return rollup_days(start_day, today())
+
+
+def window_summaries(start_day):
+    """Per-day summaries from ``start_day`` to today: rollups, then live for the rest"""
+    rows = db.session.query(Analytics).options(defer(Analytics.resolution_distribution))\
+        .filter(Analytics.date >= _start_of(start_day)).order_by(Analytics.date).all()
+    summaries = {_as_date(row.date): summary_from_row(row) for row in rows}
+
+    # Rows are open-ended from start_day, so the last one is the latest rollup
+    live_start = max(summaries) + timedelta(days=1) if summaries else start_day
+    summaries.update(summarize_days(live_start, today() + timedelta(days=1)))
+    return summaries
+
+
+def merge_summaries(summaries):
+    merged = empty_summary()
+    for summary in summaries:
+        for key in ('total', 'resolved', 'resolution_seconds', 'active_users'):
+            merged[key] += summary[key]
+        merged['categories'].update(summary['categories'])
+        merged['urgency'].update(summary['urgency'])
+    return merged
+
+
+class QuantileSketch(object):
+    """Log-bucketed quantile sketch (DDSketch): memory grows with log(max/min),
+    not with the number of values, and quantiles are within ``accuracy``
+    relative error"""
+
+    def __init__(self, accuracy=SKETCH_ACCURACY):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = Counter()
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= SKETCH_MIN_VALUE:
+            self.zeros += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / self._log_gamma)] += 1
+
+    def merge(self, other):
+        """Add the values of a sketch of the same accuracy"""
+        self.buckets.update(other.buckets)
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def value_of(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return self.value_of(key)
+
+    def histogram(self, edges):
+        """Counts per bin of ``edges``, each bucket counted at its representative value"""
+        counts = [0] * (len(edges) + 1)
+        counts[0] += self.zeros
+        for key, count in self.buckets.items():
+            counts[bisect.bisect_right(edges, self.value_of(key))] += count
+        return counts
+
+    def to_json(self):
+        return {"zeros": self.zeros, "buckets": {str(key): count for key, count in self.buckets.items()}}
+
+
+class ResolutionStats(object):
+    """Histogram, percentiles and mean of resolution times, fed one value at a time"""
+
+    def __init__(self, edges):
+        self.edges = list(edges)
+        self.histogram = [0] * (len(edges) + 1)
+        self.sketch = QuantileSketch()
+        # Merged values binned on other edges: placed from their sketch buckets
+        self.unbinned = QuantileSketch()
+        self.total = 0.0
+
+    def add(self, hours):
+        hours = max(hours, 0.0)
+        self.histogram[bisect.bisect_right(self.edges, hours)] += 1
+        self.sketch.add(hours)
+        self.total += hours
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        self.total += other.total
+        if other.edges == self.edges:
+            self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+            self.unbinned.merge(other.unbinned)
+        else:
+            self.unbinned.merge(other.sketch)
+
+    def merge_json(self, data, edges):
+        """``merge`` of a stored ``to_json`` document binned on ``edges``, without building it"""
+        buckets = {int(key): count for key, count in data['buckets'].items()}
+        count = data['zeros'] + sum(buckets.values())
+        sketches = [self.sketch]
+        if list(edges) == self.edges:
+            self.histogram = [a + b for a, b in zip(self.histogram, data['histogram'])]
+        else:
+            sketches.append(self.unbinned)
+        for sketch in sketches:
+            sketch.buckets.update(buckets)
+            sketch.zeros += data['zeros']
+            sketch.count += count
+        self.total += data['total']
+
+    def to_json(self):
+        """Stored form (exact histogram on ``edges``, kept apart); ``unbinned`` must be empty"""
+        return {"histogram": self.histogram, "total": self.total, **self.sketch.to_json()}
+
+    def to_dict(self):
+        bounds = [0] + list(self.edges)
+        count = self.sketch.count
+        histogram = [a + b for a, b in zip(self.histogram, self.unbinned.histogram(self.edges))]
+        return {
+            "count": count,
+            "mean": self.total / count if count else None,
+            "p50": self.sketch.quantile(0.5),
+            "p90": self.sketch.quantile(0.9),
+            "p99": self.sketch.quantile(0.99),
+            "histogram": [
+                {"min": low, "max": bounds[i + 1] if i + 1 < len(bounds) else None, "count": n}
+                for i, (low, n) in enumerate(zip(bounds, histogram))
+            ]
+        }
+
+
+def parse_bins(value, default):
+    """Histogram edges from ``"1,4,24"``: positive, strictly increasing, at most MAX_BINS"""
+    if not value:
+        return list(default)
+    edges = [float(edge) for edge in value.split(',')]
+    if len(edges) > MAX_BINS or any(not math.isfinite(edge) or edge <= 0 for edge in edges) \
+            or any(a >= b for a, b in zip(edges, edges[1:])):
+        raise ValueError(f"Invalid histogram bins: {value!r}")
+    return edges
+
+
+def _resolved_since(start_day):
+    return and_(Problem.state == ProblemStatus.RESOLVED.value, Problem.resolved_at >= _start_of(start_day))
+
+
+def distribution_days(start_day, end_day, edges):
+    """Resolution stats per resolution day of ``[start_day, end_day)``, keyed by (category, urgency).
+
+    Rows are streamed: memory depends on the number of days, groups and
+    bins, not on the number of resolved problems.
+    """
+    days = {}
+    resolved_day = func.date(Problem.resolved_at)
+    rows = db.session.query(
+        resolved_day, Problem.category, Problem.urgency, hours_between(Problem.created_at, Problem.resolved_at)
+    ).filter(
+        _resolved_since(start_day), Problem.resolved_at < _start_of(end_day)
+    ).yield_per(STREAM_BATCH_SIZE)
+    for day, category, urgency, hours in rows:
+        groups = days.setdefault(_as_date(day), {})
+        groups.setdefault((category, urgency), ResolutionStats(edges)).add(float(hours or 0))
+    return days
+
+
+def dump_distribution(groups, edges):
+    """JSON document of one day's ``{(category, urgency): ResolutionStats}``"""
+    return {
+        "edges": list(edges),
+        "groups": [
+            dict(category=category, urgency=urgency, **stats.to_json())
+            for (category, urgency), stats in sorted(groups.items())
+        ]
+    }
+
+
+def resolution_distribution(start_day, edges):
+    """Resolution time statistics overall, per category and per urgency.
+
+    Merges the distributions stored by the rollups with a live pass over the
+    days not rolled up yet (normally today only).
+    """
+    groups = {}
+
+    def group(key):
+        return groups.get(key) or groups.setdefault(key, ResolutionStats(edges))
+
+    rows = db.session.query(Analytics.date, Analytics.resolution_distribution)\
+        .filter(Analytics.date >= _start_of(start_day)).all()
+    # Days rolled up before distributions were stored are recomputed live
+    missing = set()
+    for day, payload in rows:
+        if payload is None:
+            missing.add(_as_date(day))
+            continue
+        document = json.loads(payload)
+        for stored in document['groups']:
+            group((stored['category'], stored['urgency'])).merge_json(stored, document['edges'])
+
+    live_start = max(_as_date(day) for day, _ in rows) + timedelta(days=1) if rows else start_day
+    live = distribution_days(live_start, today() + timedelta(days=1), edges)
+    if missing:
+        old = distribution_days(min(missing), max(missing) + timedelta(days=1), edges)
+        live.update((day, day_groups) for day, day_groups in old.items() if day in missing)
+    for day_groups in live.values():
+        for key, stats in day_groups.items():
+            group(key).merge(stats)
+
+    overall = ResolutionStats(edges)
+    by_category, by_urgency = {}, {}
+    for (category, urgency), stats in groups.items():
+        overall.merge(stats)
+        by_category.setdefault(category, ResolutionStats(edges)).merge(stats)
+        by_urgency.setdefault(urgency, ResolutionStats(edges)).merge(stats)
+
+    return {
+        "unit": "hours",
+        "overall": overall.to_dict(),
+        "by_category": [
+            dict(category=category, **stats.to_dict())
+            for category, stats in sorted(by_category.items(), key=lambda item: (-item[1].sketch.count, item[0]))
+        ],
+        "by_urgency": [
+            dict(urgency=urgency, **stats.to_dict())
+            for urgency, stats in sorted(by_urgency.items())
+        ]
+    }
+
+
+def resolution_times_page(start_day, page, per_page):
+    """One page of raw resolution times (hours), oldest resolution first"""
+    query = db.session.query(hours_between(Problem.created_at, Problem.resolved_at))\
+        .filter(_resolved_since(start_day))\
+        .order_by(Problem.resolved_at, Problem.id)
+    rows = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+    return [float(hours or 0) for hours, in rows[:per_page]], len(rows) > per_page
+
+
+analytics_cli = AppGroup('analytics', help="Daily analytics rollup commands.")
+
+
+@analytics_cli.command('rollup')
+def rollup_command():
+    """Roll up the closed days not aggregated yet (run nightly)."""
+    days = rollup_pending()
+    click.echo(f"Analytics rolled up for {days} day(s)")
+
+
+@analytics_cli.command('backfill')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']),
+              help="First day to recompute (default: day of the first problem).")
+def backfill_command(since):
+    """Recompute the daily rollups from SINCE up to yesterday."""
+    start_day = since.date() if since else first_activity_day()
+    if start_day is None:
+        click.echo("No problems yet: nothing to backfill")
+        return
+    days = rollup_days(start_day, today())
+    click.echo(f"Analytics backfilled for {days} day(s) since {start_day.isoformat()}")
@@ -0,0 +1,295 @@
+"""
+Stockage adressé par contenu des pièces jointes.
+
+Un upload est copié par blocs dans un fichier temporaire de
+``UPLOAD_FOLDER/tmp`` tout en calculant son SHA-256, puis renommé en
+``UPLOAD_FOLDER/ab/cd/<sha256>`` : un même fichier joint à plusieurs problèmes
+n'est stocké qu'une fois. Le type MIME enregistré est déduit des premiers
+octets du contenu, pas de l'en-tête ``Content-Type`` envoyé par le client.
+
+Le nombre de références d'un blob est le nombre de lignes ``attachments``
+portant son hash (index ``ix_attachments_sha256``). Supprimer une pièce jointe
+ne touche pas au disque : ``flask attachments gc`` efface les blobs que plus
+aucune ligne ne référence, après un délai de grâce qui protège les uploads en
+cours de transaction. Les anciennes lignes sans hash gardent leur chemin.
+
+Un blob ne change jamais : il est servi avec son hash pour ``ETag`` et un
+cache ``immutable``. L'envoi passe par ``send_file`` (``sendfile`` zéro copie
+via ``wsgi.file_wrapper`` sous gunicorn, requêtes ``Range`` comprises) ou est
+délégué au proxy (``X-Sendfile`` / ``X-Accel-Redirect``) selon
+``ATTACHMENT_SEND_MODE`` : le contenu ne transite jamais en mémoire Python.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import zipfile
+
+import click
+from flask import current_app, request
+from flask.cli import AppGroup
+from sqlalchemy import func
+from werkzeug.utils import send_file
+
+from extensions import db
+from models import Attachment
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+TEMP_DIR = 'tmp'
+# Keeps every IN (...) list under SQLite's bound-parameter limit
+GC_CHUNK_SIZE = 500
+
+OCTET_STREAM = 'application/octet-stream'
+DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# Leading bytes -> MIME type
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/msword'),
+    (b'PK\x03\x04', 'application/zip'),
+)
+
+
+class StoredBlob(object):
+    """Result of ``store_upload``: where the content lives and what it is"""
+
+    def __init__(self, sha256, path, size, mime_type):
+        self.sha256 = sha256
+        self.path = path
+        self.size = size
+        self.mime_type = mime_type
+
+
+def sniff_mime_type(head, path=None):
+    """MIME type from the first bytes of a file (``path`` lets zips be inspected)"""
+    for signature, mime_type in SIGNATURES:
+        if head.startswith(signature):
+            break
+    else:
+        return OCTET_STREAM
+    if mime_type == 'application/zip':
+        # A .docx is a zip: only a Word document is accepted as such
+        try:
+            with zipfile.ZipFile(path) as archive:
+                if 'word/document.xml' in archive.namelist():
+                    return DOCX
+        except (zipfile.BadZipFile, OSError, TypeError):
+            pass
+        return OCTET_STREAM
+    return mime_type
+
+
+def blob_path(root, sha256):
+    return os.path.join(root, sha256[:2], sha256[2:4], sha256)
+
+
+def _is_hash(name):
+    return len(name) == 64 and all(c in '0123456789abcdef' for c in name)
+
+
+def store_upload(stream, root=None):
+    """Copy ``stream`` into the store by chunks; returns a StoredBlob.
+
+    The file is hashed while it is written, so it is read once and never held
+    in memory. Identical content is kept once; its mtime is refreshed so a
+    concurrent ``gc`` leaves it alone until the caller commits its row.
+    """
+    root = root or current_app.config['UPLOAD_FOLDER']
+    temp_dir = os.path.join(root, TEMP_DIR)
+    os.makedirs(temp_dir, exist_ok=True)
+
+    digest, size, head = hashlib.sha256(), 0, b''
+    fd, temp_path = tempfile.mkstemp(dir=temp_dir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(head) < 16:
+                    head += chunk[:16 - len(head)]
+                digest.update(chunk)
+                temp.write(chunk)
+                size += len(chunk)
+
+        sha256 = digest.hexdigest()
+        mime_type = sniff_mime_type(head, temp_path)
+        path = blob_path(root, sha256)
+        if os.path.exists(path):
+            os.utime(path)
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return StoredBlob(sha256, path, size, mime_type)
+
+
+def reference_counts(hashes):
+    """``{sha256: attachment rows}`` for the given hashes (missing = unreferenced)"""
+    counts = {}
+    hashes = list(hashes)
+    for start in range(0, len(hashes), GC_CHUNK_SIZE):
+        chunk = hashes[start:start + GC_CHUNK_SIZE]
+        counts.update(
+            db.session.query(Attachment.sha256, func.count(Attachment.id))
+            .filter(Attachment.sha256.in_(chunk))
+            .group_by(Attachment.sha256)
+            .all()
+        )
+    return counts
+
+
+def _stored_files(root):
+    """``(sha256, path)`` of every blob under ``root``"""
+    for first in os.listdir(root):
+        if len(first) != 2 or not os.path.isdir(os.path.join(root, first)):
+            continue
+        for second in os.listdir(os.path.join(root, first)):
+            directory = os.path.join(root, first, second)
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    if _is_hash(name):
+                        yield name, os.path.join(directory, name)
+
+
+def _older_than(path, cutoff):
+    try:
+        return os.stat(path).st_mtime < cutoff
+    except FileNotFoundError:
+        return False
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError:
+        logger.exception("Could not delete attachment blob %s", path)
+        return False
+
+
+def collect_garbage(grace=None, root=None):
+    """Delete unreferenced blobs and abandoned temp files older than ``grace`` seconds.
+
+    Returns ``(blobs_removed, bytes_freed)``.
+    """
+    root = root or current_app.config['UPLOAD_FOLDER']
+    if grace is None:
+        grace = current_app.config['ATTACHMENT_GC_GRACE']
+    if not os.path.isdir(root):
+        return 0, 0
+    cutoff = time.time() - grace
+
+    candidates = {sha256: path for sha256, path in _stored_files(root) if _older_than(path, cutoff)}
+    referenced = reference_counts(candidates)
+    removed, freed = 0, 0
+    for sha256, path in candidates.items():
+        if sha256 in referenced:
+            continue
+        # Re-checked just before deleting: an upload may have reused the blob meanwhile
+        if not _older_than(path, cutoff):
+            continue
+        size = os.path.getsize(path)
+        if _remove(path):
+            removed += 1
+            freed += size
+            # Files derived from the blob (thumbnails) go with it
+            directory = os.path.dirname(path)
+            for name in os.listdir(directory):
+                if name.startswith(sha256 + '.'):
+                    _remove(os.path.join(directory, name))
+
+    temp_dir = os.path.join(root, TEMP_DIR)
+    if os.path.isdir(temp_dir):
+        for name in os.listdir(temp_dir):
+            path = os.path.join(temp_dir, name)
+            if _older_than(path, cutoff):
+                _remove(path)
+    return removed, freed
+
+
+SEND_MODES = ('sendfile', 'x-sendfile', 'x-accel-redirect')
+PROXY_HEADERS = {'x-sendfile': 'X-Sendfile', 'x-accel-redirect': 'X-Accel-Redirect'}
+
+
+def send_attachment(attachment, as_attachment=False):
+    """Response serving ``attachment``'s file, conditional and cacheable.
+
+    Raises FileNotFoundError when the file is missing on disk.
+    """
+    # Older files have no hash: fall back to an mtime/size ETag
+    return send_stored_file(
+        attachment.file_path, attachment.mime_type, attachment.original_filename,
+        etag=attachment.sha256, as_attachment=as_attachment
+    )
+
+
+def send_stored_file(path, mime_type, download_name, etag=None, as_attachment=False):
+    """Serve a file of UPLOAD_FOLDER; ``etag`` (a content hash) makes it immutable"""
+    mode = current_app.config['ATTACHMENT_SEND_MODE']
+    if mode not in SEND_MODES:
+        raise ValueError(f"Unknown ATTACHMENT_SEND_MODE {mode!r}")
+    path = os.path.abspath(path)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(path)
+
+    proxied = mode != 'sendfile'
+    response = send_file(
+        path, mimetype=mime_type, as_attachment=as_attachment,
+        download_name=download_name, etag=etag or True,
+        # The proxy answers Range requests itself
+        conditional=not proxied, use_x_sendfile=proxied,
+        environ=request.environ, response_class=current_app.response_class
+    )
+    if proxied:
+        response.headers.pop('X-Sendfile', None)
+        response = response.make_conditional(request)
+        if response.status_code != 304:
+            response.headers[PROXY_HEADERS[mode]] = _proxy_location(mode, path)
+
+    # Authorized content: browsers may keep it, shared caches may not
+    response.cache_control.public = None
+    response.cache_control.private = True
+    response.expires = None
+    if etag:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = current_app.config['ATTACHMENT_CACHE_MAX_AGE']
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+        response.cache_control.max_age = None
+    return response
+
+
+def _proxy_location(mode, path):
+    if mode == 'x-sendfile':
+        return path
+    # nginx: an `internal` location aliased to UPLOAD_FOLDER
+    relative = os.path.relpath(path, os.path.abspath(current_app.config['UPLOAD_FOLDER']))
+    return current_app.config['ATTACHMENT_ACCEL_PREFIX'].rstrip('/') + '/' + relative.replace(os.sep, '/')
+
+
+attachments_cli = AppGroup('attachments', help="Attachment storage commands.")
+
+
+@attachments_cli.command('gc')
+@click.option('--grace', type=int, default=None,
+              help="Keep unreferenced blobs younger than this many seconds (default: ATTACHMENT_GC_GRACE).")
+def gc_command(grace):
+    """Delete stored files no attachment references anymore."""
+    removed, freed = collect_garbage(grace)
+    click.echo(f"Attachment blobs removed: {removed} ({freed} bytes freed)")
@@ -0,0 +1,208 @@
+"""
+Actions en masse sur les problèmes (``/api/admin/problems/bulk-update``).
+
+Aucun objet ORM n'est chargé : les identifiants sont traités par lots de
+``CHUNK_SIZE``, chaque lot coûte un ``SELECT`` des colonnes utiles, un
+``UPDATE``/``DELETE`` ensembliste, puis un ``executemany`` pour l'historique et
+un pour les notifications des auteurs qui les acceptent (préférences jointes
+au ``SELECT``). Ces écritures contournant la session, les compteurs live
+(services/counters.py, services/unread_counters.py) sont ajustés explicitement
+dans la même transaction, et les événements du flux de notifications sont mis
+en file pour le commit. Les anciens fichiers joints
+(sans hash) des problèmes supprimés sont effacés en arrière-plan, après le
+commit ; les blobs partagés sont laissés à ``flask attachments gc``.
+"""
+
+import json
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select, update
+
+from extensions import db
+from models import (
+    Attachment, Comment, Notification, NotificationPreference, Problem, ProblemHistory, ProblemLike,
+    ProblemStatus
+)
+from services.counters import TRACKED, apply_deltas, problem_buckets
+from services.notification_preferences import required_bits
+from services.notification_stream import notification_event, publish_after_commit, unread_event
+from services.similarity import mark_dirty_after_commit
+from services.unread_counters import adjust_unread
+
+logger = logging.getLogger(__name__)
+
+# Keeps every IN (...) list under SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+
+_file_cleanup = ThreadPoolExecutor(max_workers=1, thread_name_prefix='attachment-cleanup')
+
+
+def _chunks(ids):
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def _load(connection, ids):
+    table = Problem.__table__
+    preferences = NotificationPreference.__table__
+    columns = [table.c.id, table.c.room] + [table.c[name] for name in TRACKED]
+    # The owners' notification settings come with the rows, no extra query
+    columns.append(func.coalesce(preferences.c.disabled, 0).label('notifications_disabled'))
+    return connection.execute(
+        select(*columns)
+        .outerjoin(preferences, preferences.c.user_id == table.c.user_id)
+        .where(table.c.id.in_(ids))
+    ).all()
+
+
+def _values(row, **changes):
+    values = {name: getattr(row, name) for name in TRACKED}
+    values.update(changes)
+    return values
+
+
+def _notify_owners(connection, rows, title, message, data, now):
+    # Owners who turned off problem updates get no row
+    required = required_bits('problem_update')
+    rows = [row for row in rows if not row.notifications_disabled & required]
+    if not rows:
+        return
+    table = Notification.__table__
+    values = [{
+        "user_id": row.user_id,
+        "title": title,
+        "message": message.format(room=row.room),
+        "type": "problem_update",
+        "is_read": False,
+        "data": json.dumps(dict(data, problem_id=row.id)),
+        "created_at": now,
+        "updated_at": now
+    } for row in rows]
+    # Core inserts skip the session hooks: count them and queue the stream events here
+    owners = Counter(row["user_id"] for row in values)
+    adjust_unread(connection, owners)
+    if connection.dialect.insert_executemany_returning:
+        # Whole rows come back, so their order does not matter
+        inserted = connection.execute(
+            insert(table).returning(table.c.id, table.c.user_id, table.c.message, table.c.data), values
+        ).all()
+        publish_after_commit(*(notification_event(Notification(
+            title=title, type="problem_update", created_at=now, **row._mapping
+        )) for row in inserted))
+    else:
+        connection.execute(insert(table), values)
+        publish_after_commit(*(unread_event(user_id, delta=count) for user_id, count in owners.items()))
+
+
+def bulk_set_state(problem_ids, new_state, actor_id):
+    """Move problems to ``new_state`` with history and owner notifications.
+
+    Runs in the session's transaction (the caller commits); returns the number
+    of problems found.
+    """
+    connection = db.session.connection()
+    table = Problem.__table__
+    now = datetime.utcnow()
+    resolving = new_state == ProblemStatus.RESOLVED.value
+    found = 0
+
+    for chunk in _chunks(problem_ids):
+        rows = _load(connection, chunk)
+        found += len(rows)
+        changing = [row for row in rows if row.state != new_state]
+        if not changing:
+            continue
+
+        values = {"state": new_state, "updated_at": now}
+        if resolving:
+            values["resolved_at"] = now
+        connection.execute(update(table).where(table.c.id.in_([row.id for row in changing])).values(**values))
+        mark_dirty_after_commit()
+
+        deltas = Counter()
+        for row in changing:
+            deltas.update(problem_buckets(_values(row, state=new_state,
+                                                  resolved_at=now if resolving else row.resolved_at)))
+            deltas.update(problem_buckets(_values(row), weight=-1))
+        apply_deltas(connection, deltas)
+
+        connection.execute(insert(ProblemHistory.__table__), [{
+            "problem_id": row.id,
+            "user_id": actor_id,
+            "action": "state_updated",
+            "old_value": row.state,
+            "new_value": new_state,
+            "created_at": now
+        } for row in changing])
+        _notify_owners(
+            connection, changing, "Problem Status Updated",
+            "Your problem in {room} has been updated to: " + new_state,
+            {"new_state": new_state}, now
+        )
+    return found
+
+
+def bulk_delete(problem_ids):
+    """Delete problems and their likes, comments, attachments and history.
+
+    Runs in the session's transaction (the caller commits); returns
+    ``(found, attachment_paths)`` so files are removed only once committed.
+    Content-addressed blobs may be shared and are left to the garbage collector.
+    """
+    connection = db.session.connection()
+    now = datetime.utcnow()
+    found, paths = 0, []
+
+    for chunk in _chunks(problem_ids):
+        rows = _load(connection, chunk)
+        found += len(rows)
+        if not rows:
+            continue
+        ids = [row.id for row in rows]
+
+        attachments = Attachment.__table__
+        paths.extend(connection.execute(
+            select(attachments.c.file_path)
+            .where(attachments.c.problem_id.in_(ids), attachments.c.sha256.is_(None))
+        ).scalars())
+        for child in (ProblemLike, Comment, Attachment, ProblemHistory):
+            connection.execute(delete(child.__table__).where(child.__table__.c.problem_id.in_(ids)))
+        problems = Problem.__table__
+        # Duplicates of the deleted problems are unlinked, not deleted
+        connection.execute(
+            update(problems).where(problems.c.duplicate_of_id.in_(ids)).values(duplicate_of_id=None)
+        )
+        connection.execute(delete(problems).where(problems.c.id.in_(ids)))
+
+        deltas = Counter()
+        for row in rows:
+            deltas.update(problem_buckets(_values(row), weight=-1))
+        apply_deltas(connection, deltas)
+
+        _notify_owners(
+            connection, rows, "Problem Deleted",
+            "Your problem in {room} has been deleted by an administrator",
+            {"deleted": True}, now
+        )
+    return found, paths
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.exception("Could not delete attachment file %s", path)
+
+
+def remove_files_async(paths):
+    """Delete files in the background; returns the Future (None when there is nothing to do)"""
+    if not paths:
+        return None
+    return _file_cleanup.submit(_remove_files, list(paths))
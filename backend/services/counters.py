@@ -0,0 +1,254 @@
+"""
+Compteurs de problèmes tenus à jour en direct (table ``problem_counters``).
+
+Chaque problème contribue à un ensemble de cases (dimension, valeur) : total,
+état, urgence, catégorie, mois de création et temps de résolution. Les cases
+existent en global (``user_id`` 0) et pour l'auteur du problème. Les deltas
+sont calculés à chaque flush de la session ORM et appliqués par un upsert dans
+la même transaction que l'écriture du problème : création, mise à jour,
+mise à jour en masse ou suppression. Les statistiques ne lisent plus que ces
+cases, quel que soit le nombre de problèmes.
+
+Une écriture hors ORM (SQL brut, import) doit être suivie de
+``flask counters rebuild``, qui recalcule la table depuis ``problems``.
+"""
+
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, case, delete, event, func, inspect, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from extensions import db
+from models import Problem, ProblemCounter, ProblemStatus, UrgencyLevel
+from services.stats import count_if, hours_between
+
+GLOBAL = 0
+
+# Problem attributes that decide which buckets a problem falls into
+TRACKED = ('user_id', 'state', 'urgency', 'category', 'created_at', 'resolved_at')
+
+_DELTAS_KEY = 'problem_counter_deltas'
+
+
+def month_key(column):
+    """SQL expression for ``YYYY-MM`` of a timestamp, per backend"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return func.strftime('%Y-%m', column)
+    if dialect == 'mysql':
+        return func.date_format(column, '%Y-%m')
+    return func.to_char(column, 'YYYY-MM')
+
+
+def _resolution_seconds(values):
+    if values['state'] != ProblemStatus.RESOLVED.value:
+        return None
+    if values['resolved_at'] is None or values['created_at'] is None:
+        return None
+    return round((values['resolved_at'] - values['created_at']).total_seconds())
+
+
+def problem_buckets(values, weight=1):
+    """Counter deltas for one problem described by its TRACKED ``values``"""
+    deltas = Counter()
+    seconds = _resolution_seconds(values)
+    for scope in (GLOBAL, values['user_id']):
+        deltas[('total', '', scope)] += weight
+        deltas[('state', values['state'], scope)] += weight
+        deltas[('urgency', str(values['urgency']), scope)] += weight
+        deltas[('category', values['category'], scope)] += weight
+        if values['created_at'] is not None:
+            deltas[('created_month', values['created_at'].strftime('%Y-%m'), scope)] += weight
+        if seconds is not None:
+            deltas[('resolution', 'count', scope)] += weight
+            deltas[('resolution', 'seconds', scope)] += weight * seconds
+    return deltas
+
+
+def _current_values(problem):
+    return {name: getattr(problem, name) for name in TRACKED}
+
+
+def _previous_values(session, problem):
+    """TRACKED values as last flushed, read from attribute history"""
+    state = inspect(problem)
+    values, missing = {}, []
+    for name in TRACKED:
+        history = state.attrs[name].history
+        if history.deleted:
+            values[name] = history.deleted[0]
+        elif history.unchanged:
+            values[name] = history.unchanged[0]
+        elif history.added:
+            # Assigned while expired: the old value was never loaded
+            missing.append(name)
+        else:
+            values[name] = getattr(problem, name)
+    if missing:
+        table = Problem.__table__
+        row = session.connection().execute(
+            select(*[table.c[name] for name in missing]).where(table.c.id == problem.id)
+        ).one()
+        values.update(zip(missing, row))
+    return values
+
+
+def _tracked_changes(problem):
+    state = inspect(problem)
+    return any(state.attrs[name].history.has_changes() for name in TRACKED)
+
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_counter_deltas(session, flush_context, instances):
+    # Old values must be read before the flush overwrites or deletes the rows;
+    # new problems are counted after the flush, once defaults are applied
+    deltas = Counter()
+    for obj in session.dirty:
+        if isinstance(obj, Problem) and _tracked_changes(obj):
+            deltas.update(problem_buckets(_current_values(obj)))
+            deltas.update(problem_buckets(_previous_values(session, obj), weight=-1))
+    for obj in session.deleted:
+        if isinstance(obj, Problem):
+            deltas.update(problem_buckets(_previous_values(session, obj), weight=-1))
+    flush_context.attributes[_DELTAS_KEY] = deltas
+
+
+@event.listens_for(db.session, 'after_flush')
+def _apply_counter_deltas(session, flush_context):
+    deltas = flush_context.attributes.pop(_DELTAS_KEY, Counter())
+    for obj in session.new:
+        if isinstance(obj, Problem):
+            deltas.update(problem_buckets(_current_values(obj)))
+    apply_deltas(session.connection(), deltas)
+
+
+def apply_deltas(connection, deltas):
+    """Add ``deltas`` ({(dimension, value, user_id): n}) with one upsert"""
+    rows = [
+        {"dimension": dimension, "value": value, "user_id": user_id, "count": count}
+        for (dimension, value, user_id), count in deltas.items() if count
+    ]
+    if not rows:
+        return
+
+    table = ProblemCounter.__table__
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = (sqlite_insert if dialect == 'sqlite' else postgresql_insert)(table)
+        statement = insert.on_conflict_do_update(
+            index_elements=[table.c.dimension, table.c.value, table.c.user_id],
+            set_={"count": table.c.count + insert.excluded['count']}
+        )
+        connection.execute(statement, rows)
+    elif dialect == 'mysql':
+        insert = mysql_insert(table)
+        connection.execute(
+            insert.on_duplicate_key_update(count=table.c.count + insert.inserted['count']),
+            rows
+        )
+    else:
+        for row in rows:
+            result = connection.execute(
+                update(table)
+                .where(and_(table.c.dimension == row['dimension'],
+                            table.c.value == row['value'],
+                            table.c.user_id == row['user_id']))
+                .values(count=table.c.count + row['count'])
+            )
+            if not result.rowcount:
+                connection.execute(table.insert(), row)
+
+
+def read_counters(user_id=None):
+    """All non-empty buckets of a scope, as {dimension: {value: count}}"""
+    scope = GLOBAL if user_id is None else int(user_id)
+    rows = db.session.query(ProblemCounter.dimension, ProblemCounter.value, ProblemCounter.count)\
+        .filter(ProblemCounter.user_id == scope, ProblemCounter.count != 0).all()
+    buckets = defaultdict(dict)
+    for dimension, value, count in rows:
+        buckets[dimension][value] = count
+    return buckets
+
+
+def problem_counts(user_id=None):
+    """Same figures as ``stats.problem_aggregates`` plus categories, from the counters"""
+    buckets = read_counters(user_id)
+    states = buckets['state']
+    urgencies = buckets['urgency']
+    resolution = buckets['resolution']
+    resolved_timed = resolution.get('count', 0)
+    return {
+        "total": buckets['total'].get('', 0),
+        "resolved": states.get(ProblemStatus.RESOLVED.value, 0),
+        "in_progress": states.get(ProblemStatus.IN_PROGRESS.value, 0),
+        "pending": states.get(ProblemStatus.SUBMITTED.value, 0),
+        "urgency": {level.value: urgencies.get(str(level.value), 0) for level in UrgencyLevel},
+        "this_month": buckets['created_month'].get(datetime.utcnow().strftime('%Y-%m'), 0),
+        "avg_resolution_hours": (
+            resolution.get('seconds', 0) / resolved_timed / 3600.0 if resolved_timed else 0.0
+        ),
+        "categories": sorted(buckets['category'].items(), key=lambda item: (-item[1], item[0]))
+    }
+
+
+def compute_counters():
+    """Recount every bucket from ``problems`` with one GROUP BY"""
+    resolved = and_(Problem.state == ProblemStatus.RESOLVED.value, Problem.resolved_at.isnot(None))
+    month = month_key(Problem.created_at)
+    rows = db.session.query(
+        Problem.user_id, Problem.state, Problem.urgency, Problem.category,
+        month.label('month'),
+        func.count(Problem.id).label('total'),
+        count_if(resolved).label('resolved_timed'),
+        func.sum(case(
+            (resolved, func.round(hours_between(Problem.created_at, Problem.resolved_at) * 3600)),
+            else_=0
+        )).label('resolution_seconds')
+    ).group_by(Problem.user_id, Problem.state, Problem.urgency, Problem.category, month).all()
+
+    counters = Counter()
+    for row in rows:
+        for scope in (GLOBAL, row.user_id):
+            counters[('total', '', scope)] += row.total
+            counters[('state', row.state, scope)] += row.total
+            counters[('urgency', str(row.urgency), scope)] += row.total
+            counters[('category', row.category, scope)] += row.total
+            if row.month:
+                counters[('created_month', row.month, scope)] += row.total
+            if row.resolved_timed:
+                counters[('resolution', 'count', scope)] += row.resolved_timed
+                counters[('resolution', 'seconds', scope)] += int(row.resolution_seconds or 0)
+    return counters
+
+
+def rebuild_counters():
+    """Replace the counters table with a fresh recount; returns (buckets, drifted)"""
+    expected = compute_counters()
+    current = Counter({
+        (dimension, value, user_id): count
+        for dimension, value, user_id, count in db.session.query(
+            ProblemCounter.dimension, ProblemCounter.value, ProblemCounter.user_id, ProblemCounter.count
+        ).filter(ProblemCounter.count != 0)
+    })
+    drifted = sum(1 for key in set(expected) | set(current) if expected[key] != current[key])
+
+    connection = db.session.connection()
+    connection.execute(delete(ProblemCounter.__table__))
+    apply_deltas(connection, expected)
+    db.session.commit()
+    return len(expected), drifted
+
+
+counters_cli = AppGroup('counters', help="Live problem counters commands.")
+
+
+@counters_cli.command('rebuild')
+def rebuild_command():
+    """Reconcile problem_counters by recounting it from the problems table."""
+    buckets, drifted = rebuild_counters()
+    click.echo(f"Problem counters rebuilt: {buckets} buckets, {drifted} corrected")
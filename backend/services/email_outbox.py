@@ -0,0 +1,254 @@
+"""
+File d'envoi des emails (outbox transactionnelle).
+
+Les routes n'appellent plus le serveur SMTP : ``enqueue_email`` ajoute une
+ligne ``email_outbox`` dans la transaction de l'écriture métier, l'email part
+donc si et seulement si cette transaction est validée. Un pool de threads
+réclame les lignes dues par lots (``UPDATE`` atomique avec un jeton, sûr entre
+threads et entre processus gunicorn), envoie chaque lot sur une seule
+connexion ``mail.connect()`` et replanifie les échecs avec un délai
+exponentiel. Une ligne réclamée par un worker mort redevient due à la fin de
+son bail.
+"""
+
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from flask_mail import Message
+from sqlalchemy import and_, bindparam, delete, event, func, select, update
+
+from extensions import db, mail
+from models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+PENDING, SENDING, SENT, FAILED = 'pending', 'sending', 'sent', 'failed'
+
+_ENQUEUED_KEY = 'email_outbox_enqueued'
+
+
+def enqueue_email(recipient, subject, body, html_body=None):
+    """Queue an email in the current transaction; it is sent once committed"""
+    email = EmailOutbox(recipient=recipient, subject=subject, body=body, html_body=html_body)
+    db.session.add(email)
+    db.session.info[_ENQUEUED_KEY] = True
+    return email
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop(_ENQUEUED_KEY, False):
+        email_outbox.notify()
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_enqueued(session, previous_transaction):
+    session.info.pop(_ENQUEUED_KEY, None)
+
+
+class _OutboxState(object):
+    def __init__(self):
+        self.wakeup = threading.Event()
+        self.stop = threading.Event()
+
+
+class EmailOutboxWorker(object):
+    """Flask extension draining ``email_outbox`` with a pool of background threads"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EMAIL_OUTBOX_WORKERS', 1)
+        app.config.setdefault('EMAIL_OUTBOX_POLL_INTERVAL', 5)
+        app.config.setdefault('EMAIL_OUTBOX_BATCH_SIZE', 50)
+        app.config.setdefault('EMAIL_OUTBOX_MAX_ATTEMPTS', 6)
+        app.config.setdefault('EMAIL_OUTBOX_RETRY_DELAY', 30)
+        app.config.setdefault('EMAIL_OUTBOX_MAX_RETRY_DELAY', 3600)
+        app.config.setdefault('EMAIL_OUTBOX_LEASE', 300)
+        state = app.extensions['email_outbox'] = _OutboxState()
+
+        for number in range(app.config['EMAIL_OUTBOX_WORKERS']):
+            thread = threading.Thread(
+                target=self._run, args=(app, state),
+                name=f'email-outbox-{number}', daemon=True
+            )
+            thread.start()
+
+    def notify(self):
+        """Wake the workers up now instead of at their next poll"""
+        state = current_app.extensions.get('email_outbox')
+        if state is not None:
+            state.wakeup.set()
+
+    def retry_delay(self, attempts):
+        """Seconds before the next try after ``attempts`` failures (exponential)"""
+        config = current_app.config
+        return min(config['EMAIL_OUTBOX_RETRY_DELAY'] * 2 ** (attempts - 1),
+                   config['EMAIL_OUTBOX_MAX_RETRY_DELAY'])
+
+    def claim_batch(self):
+        """Atomically take up to a batch of due emails; returns their rows"""
+        config = current_app.config
+        table = EmailOutbox.__table__
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        due = and_(table.c.status.in_((PENDING, SENDING)), table.c.next_attempt_at <= now)
+        with db.engine.begin() as connection:
+            ids = select(table.c.id).where(due)\
+                .order_by(table.c.next_attempt_at, table.c.id)\
+                .limit(config['EMAIL_OUTBOX_BATCH_SIZE'])
+            # `due` is repeated so a concurrent claimer re-checking the row skips it
+            connection.execute(
+                update(table)
+                .where(and_(table.c.id.in_(ids.scalar_subquery()), due))
+                .values(status=SENDING, claim_token=token,
+                        next_attempt_at=now + timedelta(seconds=config['EMAIL_OUTBOX_LEASE']))
+            )
+            return connection.execute(
+                select(table).where(table.c.claim_token == token).order_by(table.c.id)
+            ).all()
+
+    def process_batch(self):
+        """Send one claimed batch over a single SMTP connection; returns (sent, failed)"""
+        rows = self.claim_batch()
+        if not rows:
+            return 0, 0
+
+        sent, failures = [], {}
+        try:
+            with mail.connect() as connection:
+                for row in rows:
+                    try:
+                        connection.send(Message(
+                            subject=row.subject, recipients=[row.recipient],
+                            body=row.body, html=row.html_body
+                        ))
+                        sent.append(row.id)
+                    except Exception as e:
+                        failures[row.id] = str(e)
+        except Exception as e:
+            # Connection, login or quit failed: whatever was not sent is retried
+            logger.warning("SMTP connection failed: %s", e)
+            failures.update({row.id: str(e) for row in rows if row.id not in sent})
+
+        self._record(rows, sent, failures)
+        return len(sent), len(failures)
+
+    def _record(self, rows, sent, failures):
+        config = current_app.config
+        table = EmailOutbox.__table__
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            if sent:
+                connection.execute(
+                    update(table).where(table.c.id.in_(sent))
+                    .values(status=SENT, sent_at=now, claim_token=None, last_error=None,
+                            attempts=table.c.attempts + 1)
+                )
+            retries = []
+            for row in rows:
+                if row.id not in failures:
+                    continue
+                attempts = row.attempts + 1
+                given_up = attempts >= config['EMAIL_OUTBOX_MAX_ATTEMPTS']
+                if given_up:
+                    logger.error("Giving up on email %s to %s after %s attempts: %s",
+                                 row.id, row.recipient, attempts, failures[row.id])
+                retries.append({
+                    "row_id": row.id,
+                    "new_status": FAILED if given_up else PENDING,
+                    "new_attempts": attempts,
+                    "retry_at": now + timedelta(seconds=self.retry_delay(attempts)),
+                    "error": failures[row.id][:1000]
+                })
+            if retries:
+                connection.execute(
+                    update(table).where(table.c.id == bindparam('row_id'))
+                    .values(status=bindparam('new_status'), attempts=bindparam('new_attempts'),
+                            next_attempt_at=bindparam('retry_at'), last_error=bindparam('error'),
+                            claim_token=None),
+                    retries
+                )
+
+    def drain(self):
+        """Process batches until nothing is due; returns (sent, failed)"""
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = self.process_batch()
+            if not sent and not failed:
+                return total_sent, total_failed
+            total_sent += sent
+            total_failed += failed
+
+    def _run(self, app, state):
+        interval = app.config['EMAIL_OUTBOX_POLL_INTERVAL']
+        while not state.stop.is_set():
+            state.wakeup.wait(interval)
+            state.wakeup.clear()
+            try:
+                with app.app_context():
+                    self.drain()
+            except Exception:
+                logger.exception("Email outbox worker failed")
+
+
+def queue_stats():
+    """Queue depth per status and age of the oldest due email, in one query"""
+    table = EmailOutbox.__table__
+    rows = db.session.execute(
+        select(table.c.status, func.count(table.c.id), func.min(table.c.created_at))
+        .group_by(table.c.status)
+    ).all()
+    stats = {status: 0 for status in (PENDING, SENDING, SENT, FAILED)}
+    oldest = None
+    for status, count, created_at in rows:
+        stats[status] = count
+        if status in (PENDING, SENDING) and created_at is not None:
+            oldest = created_at if oldest is None else min(oldest, created_at)
+    stats['oldest_pending_seconds'] = (
+        round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest is not None else 0
+    )
+    return stats
+
+
+def purge_sent(days):
+    """Delete emails delivered more than ``days`` days ago; returns the row count"""
+    table = EmailOutbox.__table__
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    with db.engine.begin() as connection:
+        return connection.execute(
+            delete(table).where(and_(table.c.status == SENT, table.c.sent_at < cutoff))
+        ).rowcount
+
+
+email_outbox = EmailOutboxWorker()
+
+outbox_cli = AppGroup('outbox', help="Email outbox commands.")
+
+
+@outbox_cli.command('drain')
+def drain_command():
+    """Send every due email now."""
+    sent, failed = email_outbox.drain()
+    click.echo(f"Emails sent: {sent}, failed: {failed}")
+
+
+@outbox_cli.command('stats')
+def stats_command():
+    """Show the outbox queue depth."""
+    for key, value in queue_stats().items():
+        click.echo(f"{key}: {value}")
+
+
+@outbox_cli.command('purge')
+@click.option('--days', default=7, show_default=True, help="Keep sent emails this many days.")
+def purge_command(days):
+    """Delete sent emails older than --days."""
+    click.echo(f"Purged {purge_sent(days)} sent email(s)")
@@ -0,0 +1,166 @@
+"""
+Métriques Prometheus de l'application, exposées sur ``/metrics``.
+
+Pour chaque requête : latence par endpoint (histogramme), statut, nombre de
+requêtes SQL et temps SQL (événements ``before/after_cursor_execute`` du
+moteur). Les requêtes SQL ne sont comptées que dans ``g`` : aucun état
+partagé n'est touché par requête SQL, seulement quelques observations à la fin
+de la requête HTTP. S'y ajoutent les succès/échecs des caches applicatifs
+(``record_cache``) et, calculée au moment de la collecte, la profondeur de la
+file d'emails.
+
+En production (``METRICS_REQUIRE_TOKEN``), ``/metrics`` n'est enregistré que
+si ``METRICS_TOKEN`` est défini : les noms d'endpoints, le trafic par route et
+la file d'emails ne sont pas publics. L'instrumentation, elle, reste active.
+
+Avec plusieurs workers gunicorn, lancez-les avec ``PROMETHEUS_MULTIPROC_DIR``
+pointant vers un répertoire vidé au démarrage : chaque processus écrit ses
+valeurs dans ses propres fichiers mmap, sans coordination entre workers, et
+``/metrics`` les additionne à la lecture, quel que soit le worker qui répond.
+"""
+
+import hmac
+import logging
+import os
+import time
+
+from flask import Response, current_app, g, has_request_context, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+from sqlalchemy import event
+
+from extensions import db, limiter
+
+logger = logging.getLogger(__name__)
+
+MULTIPROC_DIR_ENV = 'PROMETHEUS_MULTIPROC_DIR'
+# Label of requests that matched no route (bounded cardinality)
+UNMATCHED = 'unmatched'
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request', ['endpoint', 'method']
+)
+REQUESTS = Counter(
+    'http_requests', 'Requests handled, by response status', ['endpoint', 'method', 'status']
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    'http_request_sql_statements', 'SQL statements executed per request', ['endpoint'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200)
+)
+REQUEST_SQL_SECONDS = Histogram(
+    'http_request_sql_duration_seconds', 'Time spent in SQL per request', ['endpoint'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+CACHE_REQUESTS = Counter(
+    'cache_requests', 'Application cache lookups', ['cache', 'result']
+)
+
+
+def record_cache(name, hits=0, misses=0):
+    """Count lookups of the application cache ``name`` (response, notification_preferences, ...)"""
+    if hits:
+        CACHE_REQUESTS.labels(name, 'hit').inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(name, 'miss').inc(misses)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # On the statement's context: nothing is left behind when the statement raises
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    # Background threads (outbox, view flush) have no request to charge
+    if has_request_context() and 'sql_statements' in g:
+        g.sql_statements += 1
+        g.sql_seconds += elapsed
+
+
+class EmailOutboxCollector(object):
+    """Email queue depth, queried when scraped"""
+
+    def collect(self):
+        from services.email_outbox import queue_stats
+
+        stats = queue_stats()
+        oldest = stats.pop('oldest_pending_seconds')
+        depth = GaugeMetricFamily('email_outbox_emails', 'Emails in the outbox, by status', labels=['status'])
+        for status, count in stats.items():
+            depth.add_metric([status], count)
+        yield depth
+        yield GaugeMetricFamily('email_outbox_oldest_pending_seconds',
+                                'Age of the oldest email waiting to be sent', value=oldest)
+
+
+def render_metrics(multiproc_dir=None):
+    """Prometheus text exposition: this process, or every worker writing to ``multiproc_dir``"""
+    if multiproc_dir:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry, path=multiproc_dir)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+class Metrics(object):
+    """Flask extension: request instrumentation and the ``/metrics`` endpoint"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_TOKEN', None)
+        app.config.setdefault('METRICS_REQUIRE_TOKEN', False)
+        if not app.config['METRICS_ENABLED']:
+            return
+        with app.app_context():
+            engine = db.engine
+        if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        if app.config['METRICS_REQUIRE_TOKEN'] and not app.config['METRICS_TOKEN']:
+            logger.warning("/metrics not registered: set METRICS_TOKEN (or METRICS_REQUIRE_TOKEN=False "
+                           "if only an internal network can reach the app)")
+            return
+        app.add_url_rule('/metrics', 'metrics', limiter.exempt(self._scrape))
+
+    @staticmethod
+    def _start_request():
+        g.metrics_started = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+    @staticmethod
+    def _end_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or UNMATCHED
+        REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - started)
+        REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+        REQUEST_SQL_STATEMENTS.labels(endpoint).observe(g.pop('sql_statements', 0))
+        REQUEST_SQL_SECONDS.labels(endpoint).observe(g.pop('sql_seconds', 0.0))
+        return response
+
+    @staticmethod
+    def _scrape():
+        token = current_app.config['METRICS_TOKEN']
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        outbox = CollectorRegistry(auto_describe=False)
+        outbox.register(EmailOutboxCollector())
+        body = render_metrics(os.environ.get(MULTIPROC_DIR_ENV)) + generate_latest(outbox)
+        return Response(body, mimetype=CONTENT_TYPE_LATEST)
+
+
+metrics = Metrics()
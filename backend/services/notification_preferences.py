@@ -0,0 +1,157 @@
+"""
+Préférences de notification par utilisateur.
+
+Chaque réglage (``SETTINGS``) est un bit de ``notification_preferences.disabled``,
+une ligne de deux entiers par utilisateur ; sans ligne, tout est activé. Les
+masques sont lus à travers le cache de l'application, en une seule requête
+pour tous les destinataires manquants d'une notification, et invalidés au
+commit qui les modifie. Avec le cache partagé par les workers (``CACHE_TYPE``
+``FileSystemCache`` ou ``RedisCache``), l'invalidation atteint tous les
+processus. Avec un cache propre au processus (``SimpleCache``), les autres
+workers gardent l'ancien masque au plus
+``NOTIFICATION_PREFERENCES_LOCAL_CACHE_TIMEOUT`` secondes.
+
+Une notification personnelle n'est pas écrite pour un utilisateur qui a coupé
+son type (``TYPE_SETTINGS``), et un email n'est mis en file que si
+``email_notifications`` et le type sont activés. Une diffusion reste une seule
+ligne : les membres de l'audience qui ont coupé son type reçoivent à la place
+un accusé déjà lu et supprimé, qui la retire de leur boîte et de leur compteur
+de non-lues (services/notifications.py).
+"""
+
+from flask import current_app
+from sqlalchemy import event
+
+from extensions import cache, db
+from models import NotificationPreference
+from services.metrics import record_cache
+from services.response_cache import is_process_local_cache
+
+SETTINGS = (
+    'email_notifications',
+    'push_notifications',
+    'problem_updates',
+    'comments',
+    'system_notifications',
+)
+BITS = {name: 1 << position for position, name in enumerate(SETTINGS)}
+
+# Notification.type -> setting that turns it off
+TYPE_SETTINGS = {
+    'problem_update': 'problem_updates',
+    'comment': 'comments',
+    'system': 'system_notifications',
+}
+
+CACHE_PREFIX = 'notification_prefs:'
+_INVALIDATE_KEY = 'notification_preferences_changed'
+
+
+def _key(user_id):
+    return f'{CACHE_PREFIX}{int(user_id)}'
+
+
+def to_settings(disabled):
+    """``{setting: enabled}`` for a ``disabled`` bitmask"""
+    return {name: not disabled & bit for name, bit in BITS.items()}
+
+
+def to_mask(settings, disabled=0):
+    """Bitmask ``disabled`` updated with ``{setting: enabled}``"""
+    for name, enabled in settings.items():
+        if enabled:
+            disabled &= ~BITS[name]
+        else:
+            disabled |= BITS[name]
+    return disabled
+
+
+def _cache_timeout():
+    config = current_app.config
+    if is_process_local_cache(config):
+        # Other workers never see the invalidation: bound how long they can be wrong
+        return config['NOTIFICATION_PREFERENCES_LOCAL_CACHE_TIMEOUT']
+    return config['NOTIFICATION_PREFERENCES_CACHE_TIMEOUT']
+
+
+def disabled_masks(user_ids):
+    """``{user_id: disabled bitmask}``: cache first, one query for the misses"""
+    user_ids = list({int(user_id) for user_id in user_ids})
+    if not user_ids:
+        return {}
+    masks = dict(zip(user_ids, cache.get_many(*[_key(user_id) for user_id in user_ids])))
+    missing = [user_id for user_id, mask in masks.items() if mask is None]
+    record_cache('notification_preferences', hits=len(user_ids) - len(missing), misses=len(missing))
+    if missing:
+        stored = dict(db.session.query(NotificationPreference.user_id, NotificationPreference.disabled)
+                      .filter(NotificationPreference.user_id.in_(missing)).all())
+        loaded = {user_id: stored.get(user_id, 0) for user_id in missing}
+        cache.set_many({_key(user_id): mask for user_id, mask in loaded.items()}, timeout=_cache_timeout())
+        masks.update(loaded)
+    return masks
+
+
+def get_settings(user_id):
+    return to_settings(disabled_masks([user_id])[int(user_id)])
+
+
+def update_settings(user_id, changes):
+    """Apply ``{setting: enabled}`` in the current transaction; returns the new settings"""
+    preference = db.session.get(NotificationPreference, int(user_id))
+    if preference is None:
+        preference = NotificationPreference(user_id=int(user_id), disabled=0)
+        db.session.add(preference)
+    preference.disabled = to_mask(changes, preference.disabled or 0)
+    db.session.info.setdefault(_INVALIDATE_KEY, set()).add(int(user_id))
+    return to_settings(preference.disabled)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_committed(session):
+    # After the commit: a concurrent read cannot cache the old value again
+    changed = session.info.pop(_INVALIDATE_KEY, None)
+    if changed:
+        cache.delete_many(*[_key(user_id) for user_id in changed])
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_changes(session, previous_transaction):
+    session.info.pop(_INVALIDATE_KEY, None)
+
+
+def required_bits(notification_type=None, email=False):
+    """Bits of ``disabled`` any of which turns the notification off"""
+    bits = BITS[TYPE_SETTINGS[notification_type]] if notification_type in TYPE_SETTINGS else 0
+    if email:
+        bits |= BITS['email_notifications']
+    return bits
+
+
+def recipients(user_ids, notification_type=None, email=False):
+    """The ``user_ids`` (order kept) who accept ``notification_type``, by email if ``email``"""
+    required = required_bits(notification_type, email)
+    user_ids = list(user_ids)
+    if not required or not user_ids:
+        return user_ids
+    masks = disabled_masks(user_ids)
+    return [user_id for user_id in user_ids if not masks[int(user_id)] & required]
+
+
+def wants(user_id, notification_type=None, email=False):
+    return bool(recipients([user_id], notification_type, email))
+
+
+def muted_types(user_id):
+    """Notification types ``user_id`` turned off"""
+    disabled = disabled_masks([user_id])[int(user_id)]
+    return {notification_type for notification_type, name in TYPE_SETTINGS.items()
+            if disabled & BITS[name]}
+
+
+def opted_out_clause(notification_type):
+    """SQL filter on ``NotificationPreference`` rows of users who turned ``notification_type`` off;
+    None for a type no setting controls"""
+    required = required_bits(notification_type)
+    if not required:
+        return None
+    return NotificationPreference.disabled.op('&')(required) != 0
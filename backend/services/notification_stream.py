@@ -0,0 +1,247 @@
+"""
+Flux Server-Sent Events des notifications (``/api/notifications/stream``).
+
+Chaque processus garde en mémoire les abonnés de ses connexions SSE. Les
+événements (nouvelle notification, variation du nombre de non-lues) sont
+collectés pendant la transaction et publiés au commit : un datagramme est
+envoyé sur chaque socket Unix du dossier ``NOTIFICATION_STREAM_DIR``, un par
+processus gunicorn ayant des abonnés, ce qui réveille les abonnés de tous les
+workers sans Redis. Un thread par processus lit sa socket et distribue les
+événements aux files des abonnés concernés. Sans dossier (ou sans
+``AF_UNIX``), la distribution reste locale au processus.
+
+Les ids d'événements sont les ids des notifications : un client qui se
+reconnecte avec ``Last-Event-ID`` reçoit d'abord ce qu'il a manqué.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import uuid
+
+from flask import current_app
+from sqlalchemy import event
+
+from extensions import db
+from models import Notification
+
+logger = logging.getLogger(__name__)
+
+# Stays well under the default Unix datagram size limit
+MAX_DATAGRAM_SIZE = 60000
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+_EVENTS_KEY = 'notification_stream_events'
+
+
+def serialize_notification(notification, is_read=None):
+    """JSON shape shared by the notification list and the stream"""
+    return {
+        "id": notification.id,
+        "title": notification.title,
+        "message": notification.message,
+        "type": notification.type,
+        "is_read": notification.is_read if is_read is None else is_read,
+        "data": notification.data,
+        "created_at": notification.created_at.isoformat()
+    }
+
+
+def notification_event(notification):
+    """Stream event for a new notification (personal or broadcast)"""
+    return {
+        "kind": "notification",
+        "user_id": int(notification.user_id) if notification.user_id is not None else None,
+        "audience": notification.audience,
+        "notification": serialize_notification(notification, is_read=False)
+    }
+
+
+def unread_event(user_id, delta=None, unread_count=None):
+    """Stream event for a change of ``user_id``'s unread count"""
+    return {"kind": "unread", "user_id": user_id, "delta": delta, "unread_count": unread_count}
+
+
+def publish_after_commit(*events):
+    """Queue events in the current transaction; they are published once committed"""
+    db.session.info.setdefault(_EVENTS_KEY, []).extend(events)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_new_notifications(session, flush_context):
+    events = [notification_event(obj) for obj in session.new if isinstance(obj, Notification)]
+    if events:
+        session.info.setdefault(_EVENTS_KEY, []).extend(events)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_committed(session):
+    events = session.info.pop(_EVENTS_KEY, None)
+    if events:
+        try:
+            notification_stream.publish(events)
+        except Exception:
+            # Clients catch up with Last-Event-ID; the commit must not fail
+            logger.exception("Could not publish %s notification event(s)", len(events))
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_events(session, previous_transaction):
+    session.info.pop(_EVENTS_KEY, None)
+
+
+def _datagrams(events):
+    """JSON arrays of events, each under MAX_DATAGRAM_SIZE"""
+    batch, size = [], 2
+    for item in events:
+        encoded = json.dumps(item, separators=(',', ':'))
+        if batch and size + len(encoded) + 1 > MAX_DATAGRAM_SIZE:
+            yield ('[' + ','.join(batch) + ']').encode('utf-8')
+            batch, size = [], 2
+        batch.append(encoded)
+        size += len(encoded) + 1
+    if batch:
+        yield ('[' + ','.join(batch) + ']').encode('utf-8')
+
+
+def send_datagrams(directory, events):
+    """Send ``events`` to every process listening in ``directory``; usable without an app"""
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith('.sock')]
+    except FileNotFoundError:
+        return
+    if not names:
+        return
+    payloads = list(_datagrams(events))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+        sender.setblocking(False)
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                for payload in payloads:
+                    sender.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that died without cleaning up
+                _remove_socket(path)
+            except BlockingIOError:
+                logger.warning("Notification stream listener %s is not keeping up, events dropped", name)
+
+
+def _remove_socket(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class Subscriber(object):
+    """One SSE connection: receives the events of a user (and their role's broadcasts)"""
+
+    def __init__(self, state, user_id, role, muted_types=()):
+        self.state = state
+        self.user_id = user_id
+        self.role = role
+        # Broadcast types the user turned off (dismissed for them when sent)
+        self.muted_types = frozenset(muted_types)
+        self.events = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def wants(self, item):
+        if item['user_id'] is not None:
+            return item['user_id'] == self.user_id
+        return item['kind'] == 'notification' and item['audience'] in ('all', self.role) \
+            and item['notification']['type'] not in self.muted_types
+
+
+class _StreamState(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.socket_path = None
+
+
+class NotificationStream(object):
+    """Flask extension fanning notification events out to SSE subscribers"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('NOTIFICATION_STREAM_DIR', os.path.join(app.instance_path, 'notification-stream'))
+        app.config.setdefault('NOTIFICATION_STREAM_HEARTBEAT', 15)
+        app.config.setdefault('NOTIFICATION_STREAM_RETRY', 3000)
+        app.extensions['notification_stream'] = _StreamState()
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['notification_stream']
+
+    @staticmethod
+    def _directory():
+        directory = current_app.config['NOTIFICATION_STREAM_DIR']
+        return directory if directory and hasattr(socket, 'AF_UNIX') else None
+
+    def subscribe(self, user_id, role, muted_types=()):
+        state = self._state()
+        subscriber = Subscriber(state, user_id, role, muted_types)
+        with state.lock:
+            state.subscribers.add(subscriber)
+            # The listener starts with the first subscriber of the process (after the fork)
+            directory = self._directory()
+            if directory and state.socket_path is None:
+                state.socket_path = self._listen(state, directory)
+        return subscriber
+
+    @staticmethod
+    def unsubscribe(subscriber):
+        """Safe outside the app context (end of the streamed response)"""
+        with subscriber.state.lock:
+            subscriber.state.subscribers.discard(subscriber)
+
+    def publish(self, events):
+        """Deliver events to the subscribers of every worker"""
+        directory = self._directory()
+        if directory:
+            send_datagrams(directory, events)
+        else:
+            self.dispatch(self._state(), events)
+
+    @staticmethod
+    def dispatch(state, events):
+        with state.lock:
+            subscribers = list(state.subscribers)
+        for item in events:
+            for subscriber in subscribers:
+                if subscriber.wants(item):
+                    try:
+                        subscriber.events.put_nowait(item)
+                    except queue.Full:
+                        logger.warning("Dropping notification event for slow subscriber %s", subscriber.user_id)
+
+    def _listen(self, state, directory):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        listener.bind(path)
+        atexit.register(_remove_socket, path)
+        thread = threading.Thread(
+            target=self._run, args=(state, listener),
+            name='notification-stream', daemon=True
+        )
+        thread.start()
+        return path
+
+    def _run(self, state, listener):
+        while True:
+            try:
+                payload = listener.recv(MAX_DATAGRAM_SIZE + 1024)
+                self.dispatch(state, json.loads(payload))
+            except Exception:
+                logger.exception("Notification stream listener failed")
+
+
+notification_stream = NotificationStream()
@@ -0,0 +1,210 @@
+"""
+Notifications diffusées (fan-out à la lecture).
+
+Une diffusion (``broadcast``) est une seule ligne ``notifications`` sans
+``user_id``, adressée à une ``audience`` : ``'all'`` ou un rôle. Elle n'est
+visible que des utilisateurs créés avant elle, comme l'était la copie par
+utilisateur qu'elle remplace. L'état lu / supprimé de chaque utilisateur vit
+dans ``notification_receipts``, une ligne n'étant écrite qu'au moment où il
+lit ou supprime la diffusion, ou dès l'envoi s'il a désactivé ce type de
+notification (services/notification_preferences.py). La boîte de réception d'un utilisateur est une
+seule requête : ses notifications personnelles plus les diffusions qui le
+visent, jointes à ses accusés.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import and_, insert, literal, or_, select, true, update
+
+from extensions import db
+from models import Notification, NotificationPreference, NotificationReceipt, User
+from services.notification_preferences import opted_out_clause
+from services.notification_stream import publish_after_commit, unread_event
+from services.unread_counters import AUDIENCE_ALL, adjust_seen, adjust_unread, read_unread
+
+
+def broadcast(title, message, type='system', audience=AUDIENCE_ALL, data=None):
+    """Add one notification for a whole audience to the current transaction"""
+    notification = Notification(
+        user_id=None, audience=audience, title=title, message=message, type=type, data=data
+    )
+    db.session.add(notification)
+    _dismiss_for_opted_out(notification)
+    return notification
+
+
+def _in_audience(audience):
+    return User.role == audience if audience != AUDIENCE_ALL else true()
+
+
+def _dismiss_for_opted_out(notification):
+    """Read-and-dismissed receipts for the audience members who turned the type off"""
+    opted_out = opted_out_clause(notification.type)
+    if opted_out is None:
+        return
+    user_ids = db.session.query(NotificationPreference.user_id)\
+        .join(User, User.id == NotificationPreference.user_id)\
+        .filter(opted_out, _in_audience(notification.audience)).all()
+    if not user_ids:
+        return
+    db.session.flush()
+    connection = db.session.connection()
+    connection.execute(insert(NotificationReceipt.__table__), [{
+        "user_id": user_id, "notification_id": notification.id,
+        "read_at": notification.created_at, "dismissed_at": notification.created_at
+    } for user_id, in user_ids])
+    # Core statements bypass the flush hooks
+    adjust_seen(connection, {user_id: 1 for user_id, in user_ids})
+
+
+def audience_size(audience=AUDIENCE_ALL, type=None):
+    """Number of active users a broadcast to ``audience`` (of ``type``) reaches"""
+    query = db.session.query(User).filter_by(is_active=True).filter(_in_audience(audience))
+    opted_out = opted_out_clause(type)
+    if opted_out is not None:
+        query = query.filter(~db.session.query(NotificationPreference.user_id).filter(
+            NotificationPreference.user_id == User.id, opted_out
+        ).exists())
+    return query.count()
+
+
+def _broadcasts_for(user_id):
+    # Broadcasts sit under user_id IS NULL in ix_notifications_user_id_created_at
+    # Uncorrelated scalar subqueries: evaluated once, no extra round trip
+    role = select(User.role).where(User.id == user_id).scalar_subquery()
+    joined_at = select(User.created_at).where(User.id == user_id).scalar_subquery()
+    return and_(
+        Notification.user_id.is_(None),
+        Notification.audience.in_([AUDIENCE_ALL, role]),
+        Notification.created_at >= joined_at
+    )
+
+
+def _receipt_join(user_id):
+    return and_(NotificationReceipt.notification_id == Notification.id,
+                NotificationReceipt.user_id == user_id)
+
+
+def inbox_query(user_id):
+    """Personal notifications and broadcasts ``user_id`` has not dismissed"""
+    return db.session.query(Notification)\
+        .outerjoin(NotificationReceipt, _receipt_join(user_id))\
+        .filter(or_(Notification.user_id == user_id, _broadcasts_for(user_id)))\
+        .filter(NotificationReceipt.dismissed_at.is_(None))
+
+
+def unread_clause():
+    """Filter for ``inbox_query`` rows the user has not read"""
+    return and_(Notification.is_read.is_(False), NotificationReceipt.read_at.is_(None))
+
+
+def unread_count(user_id):
+    """Maintained counter (services/unread_counters.py), no COUNT over the inbox"""
+    return read_unread(user_id)
+
+
+def count_unread(user_id):
+    """Exact unread count from the inbox itself"""
+    return inbox_query(user_id).filter(unread_clause()).count()
+
+
+def read_broadcast_ids(user_id, notifications):
+    """Ids of the broadcasts among ``notifications`` that ``user_id`` has read, in a single query"""
+    ids = [notification.id for notification in notifications if notification.user_id is None]
+    if not ids:
+        return set()
+    rows = db.session.query(NotificationReceipt.notification_id).filter(
+        NotificationReceipt.user_id == user_id,
+        NotificationReceipt.notification_id.in_(ids),
+        NotificationReceipt.read_at.isnot(None)
+    ).all()
+    return {row.notification_id for row in rows}
+
+
+def get_for_user(user_id, notification_id):
+    """The notification if it is in ``user_id``'s inbox, else None"""
+    return inbox_query(user_id).filter(Notification.id == notification_id).first()
+
+
+def _receipt(user_id, notification):
+    receipt = db.session.get(NotificationReceipt, (user_id, notification.id))
+    if receipt is None:
+        receipt = NotificationReceipt(user_id=user_id, notification_id=notification.id)
+        db.session.add(receipt)
+    return receipt
+
+
+def _is_unread(user_id, notification):
+    if notification.user_id is None:
+        receipt = db.session.get(NotificationReceipt, (user_id, notification.id))
+        return receipt is None or receipt.read_at is None
+    return not notification.is_read
+
+
+def mark_read(user_id, notification):
+    if not _is_unread(user_id, notification):
+        return
+    if notification.user_id is None:
+        _receipt(user_id, notification).read_at = datetime.utcnow()
+    else:
+        notification.is_read = True
+    publish_after_commit(unread_event(user_id, delta=-1))
+
+
+def dismiss(user_id, notification):
+    """Delete a personal notification, hide a broadcast for this user only"""
+    if _is_unread(user_id, notification):
+        publish_after_commit(unread_event(user_id, delta=-1))
+    if notification.user_id is None:
+        _receipt(user_id, notification).dismissed_at = datetime.utcnow()
+    else:
+        db.session.delete(notification)
+
+
+def _receipt_all(user_id, column, pending):
+    """Set ``column`` on every receipt of the user's visible broadcasts matching
+    ``pending``, creating the missing receipts; returns (updated, created)"""
+    connection = db.session.connection()
+    receipts = NotificationReceipt.__table__
+    now = datetime.utcnow()
+
+    updated = connection.execute(
+        update(receipts)
+        .where(receipts.c.user_id == user_id, receipts.c.dismissed_at.is_(None), pending)
+        .values({column: now})
+    ).rowcount
+    missing = select(literal(user_id), Notification.id, literal(now))\
+        .select_from(Notification)\
+        .outerjoin(NotificationReceipt, _receipt_join(user_id))\
+        .where(_broadcasts_for(user_id), NotificationReceipt.user_id.is_(None))
+    inserted = connection.execute(
+        insert(receipts).from_select(['user_id', 'notification_id', column], missing)
+    ).rowcount
+    # Core statements bypass the flush hooks
+    adjust_seen(connection, {user_id: inserted})
+    return updated, inserted
+
+
+def mark_all_read(user_id):
+    """Mark the whole inbox as read; returns the number of notifications changed"""
+    updated = db.session.query(Notification).filter_by(user_id=user_id, is_read=False)\
+        .update({"is_read": True}, synchronize_session=False)
+    adjust_unread(db.session.connection(), {user_id: -updated})
+    receipts = NotificationReceipt.__table__
+    updated += sum(_receipt_all(user_id, 'read_at', receipts.c.read_at.is_(None)))
+    if updated:
+        publish_after_commit(unread_event(user_id, unread_count=0))
+    return updated
+
+
+def clear_all(user_id):
+    """Empty the inbox; returns the number of notifications removed"""
+    unread = db.session.query(Notification).filter_by(user_id=user_id, is_read=False).count()
+    deleted = db.session.query(Notification).filter_by(user_id=user_id)\
+        .delete(synchronize_session=False)
+    adjust_unread(db.session.connection(), {user_id: -unread})
+    receipts = NotificationReceipt.__table__
+    deleted += sum(_receipt_all(user_id, 'dismissed_at', receipts.c.dismissed_at.is_(None)))
+    if deleted:
+        publish_after_commit(unread_event(user_id, unread_count=0))
+    return deleted
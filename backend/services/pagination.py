@@ -0,0 +1,98 @@
+"""
+Pagination par curseur (keyset) pour les listes volumineuses.
+
+Le curseur encode la clé de tri de la dernière ligne servie et son id : la
+page suivante est obtenue par une comparaison sur l'index (sort_key, id) au
+lieu d'un OFFSET, et le COUNT(*) n'est exécuté que sur demande. Le coût d'une
+page reste donc le même quelle que soit sa profondeur.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, asc, desc, or_, tuple_
+from sqlalchemy.types import DateTime
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor cannot be decoded for the requested sort"""
+
+
+def _serialize(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def encode_cursor(sort_key, value, row_id):
+    payload = json.dumps({"s": sort_key, "v": _serialize(value), "id": row_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, sort_key, column):
+    """Return (value, id) from a cursor produced by encode_cursor"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if payload['s'] != sort_key or not isinstance(payload['id'], int):
+            raise InvalidCursor("Cursor does not match the requested sort")
+        value = payload['v']
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        return value, payload['id']
+    except InvalidCursor:
+        raise
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+
+
+def keyset_paginate(query, column, sort_key, cursor, per_page, descending=True, with_total=False):
+    """Fetch one page of ``query`` ordered by ``column`` then id.
+
+    ``cursor`` is the token returned as ``next_cursor`` by the previous page
+    (empty for the first page). Returns ``(items, pagination_dict)``.
+    """
+    id_column = column.class_.id
+    direction = desc if descending else asc
+    nullable = column.expression.nullable
+
+    total = query.order_by(None).count() if with_total else None
+
+    if nullable:
+        # NULLs always last, whatever the backend's default placement
+        query = query.order_by(None).order_by(column.is_(None), direction(column), direction(id_column))
+    else:
+        query = query.order_by(None).order_by(direction(column), direction(id_column))
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort_key, column)
+        if descending:
+            after_id = id_column < last_id
+            after_key = tuple_(column, id_column) < tuple_(value, last_id)
+        else:
+            after_id = id_column > last_id
+            after_key = tuple_(column, id_column) > tuple_(value, last_id)
+
+        if value is None:
+            query = query.filter(and_(column.is_(None), after_id))
+        elif nullable:
+            query = query.filter(or_(and_(column.isnot(None), after_key), column.is_(None)))
+        else:
+            query = query.filter(after_key)
+
+    rows = query.limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    items = rows[:per_page]
+
+    next_cursor = None
+    if has_next:
+        last = items[-1]
+        next_cursor = encode_cursor(sort_key, getattr(last, column.key), last.id)
+
+    pagination = {
+        "per_page": per_page,
+        "next_cursor": next_cursor,
+        "has_next": has_next
+    }
+    if with_total:
+        pagination["total"] = total
+    return items, pagination
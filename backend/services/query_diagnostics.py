@@ -0,0 +1,211 @@
+"""
+Diagnostic des requêtes SQL : requêtes lentes et motifs N+1.
+
+Branché sur les événements ``before/after_cursor_execute`` du moteur, actif
+si ``QUERY_DIAGNOSTICS_ENABLED`` (par défaut en développement, activable en
+production). Deux types de rapports :
+
+- ``slow`` : une requête plus longue que ``SLOW_QUERY_THRESHOLD_MS``, avec
+  son plan (``EXPLAIN QUERY PLAN`` sous SQLite, ``EXPLAIN`` ailleurs) capturé
+  sur la même connexion ;
+- ``repeated`` : une requête HTTP qui exécute plus de
+  ``N_PLUS_ONE_THRESHOLD`` fois la même forme de requête (paramètres et
+  listes ``IN`` repliés), typiquement un chargement paresseux dans une boucle.
+
+Chaque rapport donne l'endpoint et la ligne du code de l'application qui a
+déclenché la requête ; les rapports identiques sont agrégés (occurrences, pire
+durée). Ils sont journalisés et gardés en mémoire dans chaque processus
+(``QUERY_DIAGNOSTICS_MAX_REPORTS`` au plus, les plus anciens sont oubliés),
+consultables par ``GET /api/admin/system/queries``.
+"""
+
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+SLOW, REPEATED = 'slow', 'repeated'
+
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """The statement with its whitespace and expanded ``IN (?, ?, ...)`` lists collapsed"""
+    return _IN_LIST.sub('(?)', _WHITESPACE.sub(' ', statement).strip())
+
+
+def call_site(root):
+    """``file:line in function`` of the innermost application frame under ``root``"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (filename.startswith(root) and filename != __file__
+                and 'site-packages' not in filename):
+            return f"{os.path.relpath(filename, root)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+class _DiagnosticsState(object):
+    def __init__(self, config, root):
+        self.enabled = config['QUERY_DIAGNOSTICS_ENABLED']
+        self.slow_ms = config['SLOW_QUERY_THRESHOLD_MS']
+        self.repeat_threshold = config['N_PLUS_ONE_THRESHOLD']
+        self.max_reports = config['QUERY_DIAGNOSTICS_MAX_REPORTS']
+        self.root = root
+        self.lock = threading.Lock()
+        self.reports = OrderedDict()
+
+    def record(self, kind, shape, site, duration_ms, executions=None, **details):
+        endpoint = request.endpoint if has_request_context() else None
+        key = (kind, shape, endpoint, site)
+        now = datetime.utcnow().isoformat()
+        with self.lock:
+            report = self.reports.pop(key, None)
+            if report is None:
+                report = {
+                    'kind': kind, 'statement': shape, 'endpoint': endpoint, 'call_site': site,
+                    'occurrences': 0, 'max_duration_ms': 0.0, 'first_seen': now
+                }
+            report['occurrences'] += 1
+            report['max_duration_ms'] = max(report['max_duration_ms'], round(duration_ms, 3))
+            if executions is not None:
+                report['max_executions'] = max(report.get('max_executions', 0), executions)
+            report['last_seen'] = now
+            report.update(details)
+            # Most recent last; the least recently seen go first
+            self.reports[key] = report
+            while len(self.reports) > self.max_reports:
+                self.reports.popitem(last=False)
+        return report
+
+
+class QueryDiagnostics(object):
+    """Flask extension reporting slow statements and N+1 patterns of the app's engine"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('QUERY_DIAGNOSTICS_ENABLED', False)
+        app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', 100)
+        app.config.setdefault('N_PLUS_ONE_THRESHOLD', 10)
+        app.config.setdefault('QUERY_DIAGNOSTICS_MAX_REPORTS', 200)
+        state = app.extensions['query_diagnostics'] = _DiagnosticsState(app.config, app.root_path)
+
+        # Always attached: while disabled, a statement costs one attribute read
+        with app.app_context():
+            engine = db.engine
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            # On the statement's context: nothing is left behind when the statement raises
+            if state.enabled and context is not None:
+                context._diagnostics_started = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            started = getattr(context, '_diagnostics_started', None)
+            if started is None:
+                return
+            duration_ms = (time.perf_counter() - started) * 1000
+            self._inspect(state, conn, cursor, statement, parameters, executemany, duration_ms)
+
+        app.before_request(self._start_request)
+        app.teardown_request(self._end_request)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['query_diagnostics']
+
+    def _inspect(self, state, conn, cursor, statement, parameters, executemany, duration_ms):
+        shape = None
+        if has_request_context() and 'query_shapes' in g:
+            shape = statement_shape(statement)
+            g.query_shapes[shape] += 1
+            g.query_seconds[shape] = g.query_seconds.get(shape, 0.0) + duration_ms / 1000
+            # The site is taken once, when the shape crosses the threshold
+            if g.query_shapes[shape] == state.repeat_threshold + 1:
+                g.query_sites[shape] = call_site(state.root)
+        if duration_ms >= state.slow_ms:
+            shape = shape or statement_shape(statement)
+            plan = None if executemany else self._explain(conn, cursor, statement, parameters)
+            report = state.record(SLOW, shape, call_site(state.root), duration_ms, plan=plan)
+            logger.warning("Slow query", extra={
+                'duration_ms': round(duration_ms, 3), 'statement': shape,
+                'call_site': report['call_site'], 'plan': plan
+            })
+
+    @staticmethod
+    def _explain(conn, cursor, statement, parameters):
+        prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+        explain = cursor.connection.cursor()
+        try:
+            explain.execute(prefix + statement, parameters)
+            return [' | '.join(str(value) for value in row) for row in explain.fetchall()]
+        except Exception:
+            # Statements the database cannot explain (PRAGMA, DDL...)
+            logger.debug("Could not explain %s", statement, exc_info=True)
+            return None
+        finally:
+            explain.close()
+
+    def _start_request(self):
+        if self._state().enabled:
+            g.query_shapes = Counter()
+            g.query_seconds = {}
+            g.query_sites = {}
+
+    def _end_request(self, exc):
+        shapes = g.pop('query_shapes', None)
+        seconds = g.pop('query_seconds', {})
+        sites = g.pop('query_sites', {})
+        if not shapes:
+            return
+        state = self._state()
+        for shape, count in shapes.items():
+            if count > state.repeat_threshold:
+                # Duration of a repeated report: all the executions of the request together
+                report = state.record(REPEATED, shape, sites.get(shape), seconds[shape] * 1000,
+                                      executions=count, method=request.method, path=request.path)
+                logger.warning("Repeated query (N+1)", extra={
+                    'statement': shape, 'executions': count, 'call_site': report['call_site']
+                })
+
+    def reports(self, kind=None):
+        """Reports of this process, most recently seen first"""
+        state = self._state()
+        with state.lock:
+            reports = [dict(report) for report in reversed(state.reports.values())]
+        return [report for report in reports if kind is None or report['kind'] == kind]
+
+    def clear(self):
+        state = self._state()
+        with state.lock:
+            state.reports.clear()
+
+    def settings(self):
+        state = self._state()
+        return {
+            'enabled': state.enabled,
+            'slow_query_threshold_ms': state.slow_ms,
+            'n_plus_one_threshold': state.repeat_threshold,
+            'max_reports': state.max_reports,
+            'pid': os.getpid()
+        }
+
+
+query_diagnostics = QueryDiagnostics()
@@ -0,0 +1,215 @@
+"""
+Limitation de débit par identité, partagée entre les workers.
+
+Les compteurs sont indexés par utilisateur (identité du JWT, qu'il soit en
+en-tête ou en ``?jwt=``) et non par adresse IP : derrière le NAT du campus,
+des centaines d'étudiants partagent une adresse et ne doivent pas s'épuiser
+mutuellement. Les requêtes sans jeton valide retombent sur l'adresse IP. Les
+quotas par défaut dépendent du rôle (``RATELIMIT_ROLE_LIMITS``). La
+connexion et les demandes de réinitialisation sont limitées par couple
+(compte visé, adresse) : un tiers ne peut pas bloquer le compte d'un autre
+depuis sa propre adresse, seulement depuis la même (même NAT). S'y ajoute un
+plafond par adresse ; pour la connexion, seuls les échecs (401) comptent,
+si bien qu'un NAT partagé n'est freiné que par des mots de passe erronés.
+
+Les compteurs vivent dans une base SQLite locale (``sqlite:///chemin``) que
+tous les processus gunicorn de la machine partagent, sans service réseau.
+Chaque décision est une transaction ``BEGIN IMMEDIATE`` sur deux lignes
+(fenêtre précédente et fenêtre courante de la stratégie
+``sliding-window-counter``), en mode WAL : quelques dizaines de
+microsecondes, sans course entre workers. Les lignes expirées sont purgées
+au fil de l'eau.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from math import floor
+
+from flask import current_app, request
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+from flask_limiter.util import get_remote_address
+from limits.storage import SlidingWindowCounterSupport, Storage
+from limits.storage.base import TimestampedSlidingWindow
+
+ANONYMOUS = 'anonymous'
+# Expired counters are deleted at most this often, per process
+PRUNE_INTERVAL = 60
+
+
+def _verified_claims():
+    """Claims of the request's valid JWT, None without one (expired or forged included)"""
+    try:
+        if verify_jwt_in_request(optional=True, locations=['headers', 'query_string']) is None:
+            return None
+    except Exception:
+        return None
+    return get_jwt()
+
+
+def rate_limit_key():
+    """Limiter key: the user of a valid JWT, else the client address"""
+    claims = _verified_claims()
+    if claims is not None and claims.get('sub') is not None:
+        return f"user:{claims['sub']}"
+    return f"ip:{get_remote_address()}"
+
+
+def account_key():
+    """Limiter key for anonymous account endpoints (login, password reset): the email targeted, per address"""
+    data = request.get_json(silent=True)
+    email = data.get('email') if isinstance(data, dict) else None
+    if isinstance(email, str) and email.strip():
+        return f"account:{email.strip().lower()}:{get_remote_address()}"
+    return f"ip:{get_remote_address()}"
+
+
+def failed_login(response):
+    """``deduct_when`` of the login limits: only rejected credentials count"""
+    return response.status_code == 401
+
+
+def role_limits():
+    """Default quota of the current request, from ``RATELIMIT_ROLE_LIMITS``"""
+    quotas = current_app.config['RATELIMIT_ROLE_LIMITS']
+    claims = _verified_claims()
+    role = claims.get('role') if claims is not None else None
+    return quotas.get(role) or quotas[ANONYMOUS]
+
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """``limits`` storage in a SQLite file shared by every process of the host.
+
+    ``sqlite:///relative/path`` or ``sqlite:////absolute/path``; supports the
+    fixed window and sliding window counter strategies.
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri, wrap_exceptions=False, timeout=5, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.path = uri.split('://', 1)[1][1:]
+        self.timeout = float(timeout)
+        self._local = threading.local()
+        self._last_prune = 0.0
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits ("
+                "key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        # One connection per thread and per process (never shared across a fork)
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        # Write lock up front: read-then-increment cannot interleave across workers
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    @staticmethod
+    def _count(connection, key, now):
+        row = connection.execute(
+            "SELECT count FROM rate_limits WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _incr(connection, key, expiry, amount, now):
+        # An expired row restarts from ``amount`` with a new expiry
+        return connection.execute(
+            "INSERT INTO rate_limits (key, count, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "count = CASE WHEN expires_at <= ? THEN excluded.count ELSE count + excluded.count END, "
+            "expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END "
+            "RETURNING count",
+            (key, amount, now + expiry, now, now)
+        ).fetchone()[0]
+
+    def _maybe_prune(self, connection, now):
+        if now - self._last_prune >= PRUNE_INTERVAL:
+            self._last_prune = now
+            connection.execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        with self._transaction() as connection:
+            self._maybe_prune(connection, now)
+            return self._incr(connection, key, expiry, amount, now)
+
+    def get(self, key):
+        return self._count(self._connection(), key, time.time())
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT expires_at FROM rate_limits WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def check(self):
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with self._transaction() as connection:
+            return connection.execute("DELETE FROM rate_limits").rowcount
+
+    def clear(self, key):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+    def _window(self, connection, key, expiry, now):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count = self._count(connection, previous_key, now)
+        current_count = self._count(connection, current_key, now)
+        previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous_count else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        with self._transaction() as connection:
+            self._maybe_prune(connection, now)
+            previous_count, previous_ttl, current_count, _ = self._window(connection, key, expiry, now)
+            if floor(previous_count * previous_ttl / expiry + current_count) + amount > limit:
+                return False
+            # The current window is still weighed in during the next one
+            self._incr(connection, self.sliding_window_keys(key, expiry, now)[1], 2 * expiry, amount, now)
+            return True
+
+    def get_sliding_window(self, key, expiry):
+        return self._window(self._connection(), key, expiry, time.time())
+
+    def clear_sliding_window(self, key, expiry):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM rate_limits WHERE key IN (?, ?)",
+                               self.sliding_window_keys(key, expiry, time.time()))
@@ -0,0 +1,168 @@
+"""
+Cache des réponses JSON par identité avec invalidation par tags.
+
+Chaque entrée est indexée par endpoint, rôle, identité JWT et paramètres de
+requête normalisés. Elle mémorise la version de chacun de ses tags
+(``problems``, ``problem:<id>``, ``user:<id>``...) ; invalider un tag revient
+à lui attribuer une nouvelle version, ce qui rend périmées toutes les entrées
+qui le portent sans avoir à les énumérer.
+
+Les versions des tags doivent être partagées par tous les workers : avec un
+backend propre au processus (``SimpleCache``, ``NullCache``), une écriture
+dans un worker ne périmerait pas les entrées des autres. Hors tests, le cache
+de réponses est alors désactivé au démarrage (``check_cache_backend``).
+"""
+
+import hashlib
+import json
+import logging
+import uuid
+from functools import wraps
+
+from flask import current_app, g, make_response, request
+from flask_jwt_extended import get_jwt, get_jwt_identity
+
+from extensions import cache
+from services.metrics import record_cache
+
+TAG_PREFIX = 'tag:'
+RESPONSE_PREFIX = 'response:'
+# Flask-Caching backends whose entries live in a single process
+PROCESS_LOCAL_CACHES = {'simple', 'simplecache', 'null', 'nullcache'}
+
+logger = logging.getLogger(__name__)
+
+
+def is_process_local_cache(config):
+    """Whether ``CACHE_TYPE`` keeps its entries in the current process only"""
+    cache_type = str(config.get('CACHE_TYPE') or 'null').rsplit('.', 1)[-1]
+    return cache_type.lower() in PROCESS_LOCAL_CACHES
+
+
+def check_cache_backend(app):
+    """Turn the response cache off when workers could not see each other's invalidations"""
+    if app.testing or not app.config.get('RESPONSE_CACHE_ENABLED', True):
+        return
+    if is_process_local_cache(app.config):
+        app.config['RESPONSE_CACHE_ENABLED'] = False
+        logger.warning(
+            "Response cache disabled: CACHE_TYPE %s is per process, use FileSystemCache or RedisCache",
+            app.config.get('CACHE_TYPE')
+        )
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def get_tag_versions(tags):
+    """Return the current version of each tag, creating missing ones"""
+    tags = sorted(tags)
+    if not tags:
+        return {}
+    keys = [TAG_PREFIX + tag for tag in tags]
+    versions = dict(zip(tags, cache.get_many(*keys)))
+
+    # A tag evicted from the cache gets a fresh version so that entries
+    # recorded against the old one can never match again
+    missing = {tag: _new_version() for tag, version in versions.items() if version is None}
+    if missing:
+        cache.set_many({TAG_PREFIX + tag: version for tag, version in missing.items()}, timeout=0)
+        versions.update(missing)
+    return versions
+
+
+def invalidate_tags(*tags):
+    """Bust every cached response carrying one of the given tags"""
+    tags = {tag for tag in tags if tag}
+    if not tags:
+        return
+    try:
+        cache.set_many({TAG_PREFIX + tag: _new_version() for tag in tags}, timeout=0)
+    except Exception:
+        # The write is already committed: never fail the request over the cache
+        logger.exception("Failed to invalidate cache tags %s", sorted(tags))
+
+
+def add_cache_tags(*tags):
+    """Attach extra tags (e.g. the problems of a page) to the response being built.
+
+    Their versions are read now, so call it as soon as the tagged rows are
+    known: a write landing after this point keeps the response out of the cache.
+    """
+    if g.get('cache_tags') is None:
+        return
+    new_tags = set(tags) - g.cache_tags.keys()
+    try:
+        g.cache_tags.update(get_tag_versions(new_tags))
+    except Exception:
+        logger.exception("Response cache unavailable, %s will not be stored", request.endpoint)
+        g.cache_tags = None
+
+
+def make_cache_key():
+    """Key on endpoint, role, JWT identity and normalized query string"""
+    identity = get_jwt_identity() or 'anonymous'
+    role = get_jwt().get('role', '') if get_jwt_identity() else ''
+    # Empty values are kept: ``cursor=`` (first keyset page) differs from no cursor
+    args = sorted(
+        (name, value)
+        for name, values in request.args.lists()
+        for value in values
+    )
+    digest = hashlib.sha1(json.dumps(args).encode('utf-8')).hexdigest()
+    return f"{RESPONSE_PREFIX}{request.endpoint}:{role}:{identity}:{digest}"
+
+
+def cached_response(timeout=300, tags=('problems',)):
+    """Cache successful GET responses of a JWT-protected view.
+
+    ``tags`` are attached to every entry; the view can add more with
+    ``add_cache_tags``. The current identity always contributes ``user:<id>``.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or not current_app.config.get('RESPONSE_CACHE_ENABLED', True):
+                return view(*args, **kwargs)
+
+            base_tags = set(tags)
+            identity = get_jwt_identity()
+            if identity:
+                base_tags.add(f'user:{identity}')
+
+            try:
+                key = make_cache_key()
+                entry = cache.get(key)
+                if entry is not None and get_tag_versions(entry['tags']) == entry['tags']:
+                    record_cache('response', hits=1)
+                    return current_app.response_class(
+                        entry['body'], status=entry['status'], mimetype=entry['mimetype']
+                    )
+                record_cache('response', misses=1)
+                # Snapshot versions before running the view so that a write
+                # committed meanwhile invalidates the entry we are about to store
+                g.cache_tags = get_tag_versions(base_tags)
+            except Exception:
+                logger.exception("Response cache unavailable, serving %s uncached", request.endpoint)
+                return view(*args, **kwargs)
+
+            response = make_response(view(*args, **kwargs))
+            versions = g.pop('cache_tags', None)
+            if versions is not None and response.status_code == 200 and response.is_json:
+                try:
+                    # A tag bumped while the view ran means the body may predate
+                    # that write: serve it but do not store it
+                    if get_tag_versions(versions) != versions:
+                        return response
+                    cache.set(key, {
+                        'tags': versions,
+                        'body': response.get_data(),
+                        'status': response.status_code,
+                        'mimetype': response.mimetype
+                    }, timeout=timeout)
+                except Exception:
+                    logger.exception("Failed to store %s in the response cache", request.endpoint)
+            return response
+        return wrapper
+    return decorator
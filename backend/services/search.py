@@ -0,0 +1,135 @@
+"""
+Recherche plein texte des problèmes (SQLite FTS5).
+
+La table virtuelle ``problems_fts`` indexe ``description``, ``type_of_problem``
+et ``room`` de la table ``problems`` (contenu externe) ; des triggers la
+tiennent à jour à chaque insert, update et delete. Le tokenizer
+``unicode61 remove_diacritics 2`` replie les accents : "ecran" trouve "écran".
+Hors SQLite (ou si la table n'existe pas encore) on retombe sur ILIKE.
+"""
+
+import re
+import weakref
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import column, event, inspect, literal_column, or_, table, text
+
+from extensions import db
+from models import Problem
+
+FTS_TABLE = 'problems_fts'
+MAX_TERMS = 10
+
+# Column weights for bm25(): description, type_of_problem, room
+BM25_WEIGHTS = (1.0, 2.0, 1.5)
+
+FTS_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        description, type_of_problem, room,
+        content='problems', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS problems_fts_ai AFTER INSERT ON problems BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, description, type_of_problem, room)
+        VALUES (new.id, new.description, new.type_of_problem, new.room);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS problems_fts_ad AFTER DELETE ON problems BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, type_of_problem, room)
+        VALUES ('delete', old.id, old.description, old.type_of_problem, old.room);
+    END""",
+    # Only the indexed columns: likes/views/state updates must not touch the index
+    f"""CREATE TRIGGER IF NOT EXISTS problems_fts_au
+        AFTER UPDATE OF description, type_of_problem, room ON problems BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, type_of_problem, room)
+        VALUES ('delete', old.id, old.description, old.type_of_problem, old.room);
+        INSERT INTO {FTS_TABLE}(rowid, description, type_of_problem, room)
+        VALUES (new.id, new.description, new.type_of_problem, new.room);
+    END""",
+]
+
+_fts_available = weakref.WeakKeyDictionary()
+
+
+def install_fts(connection):
+    """Create the FTS table and its sync triggers (SQLite only, idempotent)"""
+    if connection.dialect.name != 'sqlite':
+        return False
+    for statement in FTS_DDL:
+        connection.exec_driver_sql(statement)
+    return True
+
+
+@event.listens_for(Problem.__table__, 'after_create')
+def _create_fts_with_problems(target, connection, **kw):
+    install_fts(connection)
+
+
+@event.listens_for(Problem.__table__, 'before_drop')
+def _drop_fts_with_problems(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        for trigger in ('problems_fts_ai', 'problems_fts_ad', 'problems_fts_au'):
+            connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    _fts_available.pop(db.engine, None)
+
+
+def fts_enabled():
+    engine = db.engine
+    if engine not in _fts_available:
+        _fts_available[engine] = (
+            engine.dialect.name == 'sqlite' and inspect(engine).has_table(FTS_TABLE)
+        )
+    return _fts_available[engine]
+
+
+def build_match_expression(search):
+    """Turn free text into an FTS5 query: every term, prefix-matched"""
+    terms = re.findall(r'\w+', search)[:MAX_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def apply_search(query, search):
+    """Filter a Problem query on ``search``.
+
+    Returns ``(query, rank)`` where ``rank`` is a bm25 expression to order by
+    (lower is better) or None when the ILIKE fallback was used.
+    """
+    if fts_enabled():
+        match = build_match_expression(search)
+        if not match:
+            return query.filter(text('0')), None
+        fts = table(FTS_TABLE, column('rowid'))
+        rank = literal_column(f"bm25({FTS_TABLE}, {', '.join(map(str, BM25_WEIGHTS))})")
+        query = query.join(fts, fts.c.rowid == Problem.id)\
+            .filter(text(f"{FTS_TABLE} MATCH :fts_query").bindparams(fts_query=match))
+        return query, rank
+
+    search_filter = or_(
+        Problem.description.ilike(f'%{search}%'),
+        Problem.type_of_problem.ilike(f'%{search}%'),
+        Problem.room.ilike(f'%{search}%')
+    )
+    return query.filter(search_filter), None
+
+
+def rebuild_index():
+    """(Re)create the FTS table if needed and rebuild it from ``problems``"""
+    with db.engine.begin() as connection:
+        if not install_fts(connection):
+            return False
+        connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    _fts_available.pop(db.engine, None)
+    return True
+
+
+search_cli = AppGroup('search', help="Full-text search index commands.")
+
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Rebuild the problems full-text index from the problems table."""
+    if rebuild_index():
+        click.echo("Full-text index rebuilt")
+    else:
+        click.echo("Full-text search requires SQLite: nothing to rebuild (ILIKE fallback in use)")
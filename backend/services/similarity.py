@@ -0,0 +1,306 @@
+"""
+Détection des quasi-doublons parmi les problèmes ouverts (MinHash + LSH).
+
+Chaque problème ouvert (soumis ou en cours) est réduit à l'ensemble des mots
+de son ``type_of_problem`` et de sa ``description`` (minuscules, sans accents
+ni mots vides), puis à une signature MinHash de ``NUM_HASHES`` valeurs. La
+signature est découpée en ``BANDS`` bandes ; deux problèmes de la même salle
+qui partagent une bande sont candidats, et la similarité de Jaccard exacte de
+leurs mots départage. Une recherche ne coûte donc que ``BANDS`` accès à un
+dictionnaire, quelle que soit la taille de l'index.
+
+L'index vit en mémoire dans chaque processus. Il est construit en arrière-plan
+à la première recherche (une vingtaine de secondes pour 100 000 problèmes
+ouverts ; les recherches ne trouvent rien d'ici là) puis rattrapé de façon incrémentale depuis ``problems.updated_at``
+(index ``ix_problems_updated_at``) : immédiatement après un commit de ce
+processus qui touche un problème, sinon au plus toutes les
+``SIMILARITY_SYNC_INTERVAL`` secondes pour les écritures des autres workers.
+Les problèmes supprimés sont retirés quand une recherche les rencontre.
+"""
+
+import logging
+import re
+import struct
+import threading
+import time
+import unicodedata
+from datetime import datetime, timedelta
+from hashlib import blake2b
+from random import Random
+
+from flask import current_app
+from sqlalchemy import event
+
+from extensions import db
+from models import Problem, ProblemStatus
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATES = (ProblemStatus.SUBMITTED.value, ProblemStatus.IN_PROGRESS.value)
+
+NUM_HASHES = 32
+# Short texts: many narrow bands keep recall high, exact Jaccard filters the candidates
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+# Fixed seed: signatures are comparable across processes and restarts.
+# 30-bit values stay single-digit Python ints, several times faster to XOR and compare
+_rng = Random(20240917)
+_MASKS = tuple(_rng.getrandbits(30) for _ in range(NUM_HASHES))
+
+# Transactions may commit after rows with a later updated_at were seen
+SYNC_OVERLAP = timedelta(seconds=60)
+SYNC_BATCH_SIZE = 5000
+
+STOPWORDS = frozenset("""
+    les des une est dans pour pas que qui sur avec par plus sont ont mais tout
+    ses son sa aux ce cette ces il elle ils elles nous vous leur leurs mon ma mes
+    the and for are not with this that from
+""".split())
+
+_TOKEN = re.compile(r'\w+')
+_DIRTY_KEY = 'similarity_index_dirty'
+
+
+def tokens(*texts):
+    """Normalized word set of ``texts`` (case, accents and stop words removed)"""
+    words = set()
+    for text in texts:
+        if not text:
+            continue
+        folded = unicodedata.normalize('NFKD', text.casefold())
+        folded = ''.join(c for c in folded if not unicodedata.combining(c))
+        words.update(word for word in _TOKEN.findall(folded)
+                     if len(word) > 2 and word not in STOPWORDS)
+    return frozenset(words)
+
+
+def room_key(room):
+    return ' '.join((room or '').casefold().split())
+
+
+def signature(words):
+    """MinHash signature of a word set (XOR-masked 30-bit word hashes)"""
+    if not words:
+        return None
+    hashes = [struct.unpack('<I', blake2b(word.encode('utf-8'), digest_size=4).digest())[0] >> 2
+              for word in words]
+    return tuple([min([h ^ mask for h in hashes]) for mask in _MASKS])
+
+
+def _bands(sig):
+    for band in range(BANDS):
+        yield band, sig[band * ROWS:(band + 1) * ROWS]
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class _Index(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}   # problem id -> (room key, words, signature)
+        self.buckets = {}   # (room key, band, band values) -> set of problem ids
+        self.built = False
+        self.building = False
+        self.synced_to = None
+        self.last_sync = 0.0
+        self.dirty = False
+
+    def add(self, problem_id, room, words):
+        self.discard(problem_id)
+        sig = signature(words)
+        if sig is None:
+            return
+        key = room_key(room)
+        self.entries[problem_id] = (key, words, sig)
+        for band, values in _bands(sig):
+            self.buckets.setdefault((key, band, values), set()).add(problem_id)
+
+    def discard(self, problem_id):
+        entry = self.entries.pop(problem_id, None)
+        if entry is None:
+            return
+        key, _, sig = entry
+        for band, values in _bands(sig):
+            bucket = self.buckets.get((key, band, values))
+            if bucket is not None:
+                bucket.discard(problem_id)
+                if not bucket:
+                    del self.buckets[(key, band, values)]
+
+    def query(self, room, words, threshold, limit, exclude=None):
+        sig = signature(words)
+        if sig is None:
+            return []
+        key = room_key(room)
+        candidates = set()
+        for band, values in _bands(sig):
+            candidates.update(self.buckets.get((key, band, values), ()))
+        candidates.discard(exclude)
+        scored = [(jaccard(words, self.entries[pid][1]), pid) for pid in candidates]
+        scored = [(score, pid) for score, pid in scored if score >= threshold]
+        scored.sort(key=lambda item: (-item[0], -item[1]))
+        return [(pid, score) for score, pid in scored[:limit]]
+
+
+@event.listens_for(db.session, 'after_flush')
+def _note_problem_writes(session, flush_context):
+    if any(isinstance(obj, Problem) for obj in session.new) or \
+            any(isinstance(obj, Problem) for obj in session.dirty):
+        session.info[_DIRTY_KEY] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _sync_after_commit(session):
+    if session.info.pop(_DIRTY_KEY, False):
+        similarity_index.mark_dirty()
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_problem_writes(session, previous_transaction):
+    session.info.pop(_DIRTY_KEY, None)
+
+
+def mark_dirty_after_commit():
+    """For Core writes to ``problems`` that bypass the session hooks"""
+    db.session.info[_DIRTY_KEY] = True
+
+
+class SimilarityIndex(object):
+    """Flask extension holding the per-process near-duplicate index"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SIMILARITY_THRESHOLD', 0.5)
+        app.config.setdefault('SIMILARITY_AUTO_LINK_THRESHOLD', None)
+        app.config.setdefault('SIMILARITY_SYNC_INTERVAL', 5)
+        app.config.setdefault('SIMILAR_PROBLEMS_LIMIT', 5)
+        app.config.setdefault('SIMILARITY_BUILD_IN_BACKGROUND', True)
+        app.extensions['similarity_index'] = _Index()
+
+    @staticmethod
+    def _index():
+        return current_app.extensions['similarity_index']
+
+    def mark_dirty(self):
+        index = current_app.extensions.get('similarity_index')
+        if index is not None:
+            index.dirty = True
+
+    def similar(self, room, type_of_problem, description, threshold=None, limit=None, exclude=None):
+        """``[(problem_id, similarity)]`` of open problems of ``room``, best first.
+
+        Empty while the index of this process is still being built.
+        """
+        config = current_app.config
+        index = self._index()
+        self.sync(index)
+        with index.lock:
+            if not index.built:
+                return []
+            return index.query(
+                room, tokens(type_of_problem, description),
+                config['SIMILARITY_THRESHOLD'] if threshold is None else threshold,
+                config['SIMILAR_PROBLEMS_LIMIT'] if limit is None else limit,
+                exclude
+            )
+
+    def discard(self, problem_ids):
+        index = self._index()
+        with index.lock:
+            for problem_id in problem_ids:
+                index.discard(problem_id)
+
+    def sync(self, index=None):
+        """Build the index, or catch up with the problems updated since the last sync"""
+        index = index or self._index()
+        now = time.monotonic()
+        with index.lock:
+            if not index.built:
+                if index.building:
+                    return 0
+                if current_app.config['SIMILARITY_BUILD_IN_BACKGROUND']:
+                    index.building = True
+                    threading.Thread(
+                        target=self._build_in_background,
+                        args=(current_app._get_current_object(), index),
+                        name='similarity-index-build', daemon=True
+                    ).start()
+                    return 0
+            elif not index.dirty and now - index.last_sync < current_app.config['SIMILARITY_SYNC_INTERVAL']:
+                return 0
+            index.dirty = False
+            index.last_sync = now
+            since = index.synced_to - SYNC_OVERLAP if index.built else None
+        return self._catch_up(index, since)
+
+    def _catch_up(self, index, since):
+        # Rows are read and tokenized outside the lock: lookups go on meanwhile
+        rows = self._fetch(since)
+        with index.lock:
+            for problem_id, room, words, state, updated_at in rows:
+                if state in OPEN_STATES:
+                    index.add(problem_id, room, words)
+                else:
+                    index.discard(problem_id)
+                if index.synced_to is None or updated_at > index.synced_to:
+                    index.synced_to = updated_at
+            if index.synced_to is None:
+                index.synced_to = datetime.utcnow()
+            index.built = True
+        return len(rows)
+
+    @staticmethod
+    def _fetch(since):
+        """Changed problems since ``since`` (every open problem when None)"""
+        query = db.session.query(
+            Problem.id, Problem.room, Problem.type_of_problem, Problem.description,
+            Problem.state, Problem.updated_at
+        )
+        if since is None:
+            query = query.filter(Problem.state.in_(OPEN_STATES))
+        else:
+            query = query.filter(Problem.updated_at > since)
+        return [
+            (row.id, row.room, tokens(row.type_of_problem, row.description), row.state, row.updated_at)
+            for row in query.yield_per(SYNC_BATCH_SIZE)
+        ]
+
+    def _build_in_background(self, app, index):
+        try:
+            with app.app_context():
+                index.last_sync = time.monotonic()
+                self._catch_up(index, None)
+                db.session.remove()
+        except Exception:
+            logger.exception("Could not build the similarity index")
+        finally:
+            with index.lock:
+                index.building = False
+
+    def size(self):
+        return len(self._index().entries)
+
+
+similarity_index = SimilarityIndex()
+
+
+def find_similar(room, type_of_problem, description, exclude=None, threshold=None, limit=None):
+    """``[(problem, similarity)]``: open problems of ``room`` close to the given text"""
+    matches = similarity_index.similar(room, type_of_problem, description,
+                                       threshold=threshold, limit=limit, exclude=exclude)
+    if not matches:
+        return []
+    problems = {problem.id: problem for problem in db.session.query(Problem).filter(
+        Problem.id.in_([problem_id for problem_id, _ in matches]),
+        Problem.state.in_(OPEN_STATES)
+    )}
+    # Deleted (or closed since the last sync) problems leave the index now
+    similarity_index.discard([problem_id for problem_id, _ in matches if problem_id not in problems])
+    return [(problems[problem_id], score) for problem_id, score in matches if problem_id in problems]
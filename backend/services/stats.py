@@ -0,0 +1,97 @@
+"""
+Statistiques agrégées calculées côté SQL en une seule passe par table.
+
+Les compteurs par état, urgence et période sont des ``SUM(CASE ...)`` dans
+une même requête et la durée moyenne de résolution est calculée par la base :
+aucun objet ORM n'est chargé, la mémoire reste constante quelle que soit la
+taille des tables.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import and_, case, func, literal_column
+
+from extensions import db
+from models import Problem, ProblemStatus, User, UserRole, UrgencyLevel
+
+
+def hours_between(start, end):
+    """SQL expression for ``end - start`` in hours, per backend"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return (func.julianday(end) - func.julianday(start)) * 24.0
+    if dialect == 'mysql':
+        return func.timestampdiff(literal_column('SECOND'), start, end) / 3600.0
+    return func.extract('epoch', end - start) / 3600.0
+
+
+def count_if(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def resolution_hours():
+    """Resolution time of a resolved problem, NULL otherwise"""
+    return case(
+        (and_(Problem.state == ProblemStatus.RESOLVED.value, Problem.resolved_at.isnot(None)),
+         hours_between(Problem.created_at, Problem.resolved_at)),
+        else_=None
+    )
+
+
+def start_of_month():
+    return datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def problem_aggregates(user_id=None):
+    """One pass over ``problems`` (optionally restricted to a user's problems).
+
+    The endpoints read ``counters.problem_counts`` instead; this recount from
+    the table is the reference the counters are checked against (test_counters).
+    """
+    query = db.session.query(
+        func.count(Problem.id).label('total'),
+        count_if(Problem.state == ProblemStatus.RESOLVED.value).label('resolved'),
+        count_if(Problem.state == ProblemStatus.IN_PROGRESS.value).label('in_progress'),
+        count_if(Problem.state == ProblemStatus.SUBMITTED.value).label('pending'),
+        count_if(Problem.urgency == UrgencyLevel.HIGH.value).label('high_urgency'),
+        count_if(Problem.urgency == UrgencyLevel.MEDIUM.value).label('medium_urgency'),
+        count_if(Problem.urgency == UrgencyLevel.LOW.value).label('low_urgency'),
+        count_if(Problem.created_at >= start_of_month()).label('this_month'),
+        func.avg(resolution_hours()).label('avg_resolution_hours')
+    )
+    if user_id is not None:
+        query = query.filter(Problem.user_id == user_id)
+    row = query.one()
+    return {
+        "total": row.total,
+        "resolved": row.resolved,
+        "in_progress": row.in_progress,
+        "pending": row.pending,
+        "urgency": {
+            UrgencyLevel.LOW.value: row.low_urgency,
+            UrgencyLevel.MEDIUM.value: row.medium_urgency,
+            UrgencyLevel.HIGH.value: row.high_urgency
+        },
+        "this_month": row.this_month,
+        "avg_resolution_hours": float(row.avg_resolution_hours or 0)
+    }
+
+
+def user_aggregates():
+    """One pass over ``users``"""
+    row = db.session.query(
+        func.count(User.id).label('total'),
+        count_if(User.is_active.is_(True)).label('active'),
+        count_if(User.role == UserRole.STUDENT.value).label('students'),
+        count_if(User.role == UserRole.ADMIN.value).label('admins'),
+        count_if(User.role == UserRole.MODERATOR.value).label('moderators'),
+        count_if(User.created_at >= start_of_month()).label('this_month')
+    ).one()
+    return {
+        "total": row.total,
+        "active": row.active,
+        "students": row.students,
+        "admins": row.admins,
+        "moderators": row.moderators,
+        "this_month": row.this_month
+    }
@@ -0,0 +1,208 @@
+"""
+Journalisation JSON asynchrone.
+
+Les threads des requêtes ne font aucune entrée/sortie pour journaliser : un
+``QueueHandler`` posé sur le logger racine met chaque enregistrement dans une
+file bornée (``LOG_QUEUE_SIZE``), et un ``QueueListener`` le formate en JSON
+(``python-json-logger``) puis l'écrit dans ``LOG_FILE`` (rotation) ou sur
+stderr depuis son propre thread. File pleine : l'enregistrement est abandonné
+et compté plutôt que de bloquer la requête.
+
+Chaque enregistrement émis pendant une requête porte ``request_id`` (repris
+de l'en-tête ``X-Request-ID`` ou généré, et renvoyé dans la réponse),
+``method``, ``path`` et ``elapsed_ms`` depuis le début de la requête ; une
+ligne ``request`` par réponse donne le statut et la durée totale. Les lignes
+de debug à fort volume passent ``extra=sampled()`` : seule une fraction
+``LOG_DEBUG_SAMPLE_RATE`` est gardée, avec son taux dans ``sample_rate``.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import current_app, g, has_request_context, request
+from pythonjsonlogger import jsonlogger
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# A request id from a proxy is kept only if it is short and plain
+_VALID_REQUEST_ID = re.compile(r'^[\w.:-]{1,128}$')
+JSON_FORMAT = '%(levelname)s %(name)s %(message)s'
+
+
+def sampled(rate=None):
+    """``extra`` for a high-volume debug line: kept with probability ``rate``"""
+    if rate is None:
+        rate = current_app.config['LOG_DEBUG_SAMPLE_RATE']
+    return {'sample_rate': rate}
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds the request fields, and drops the sampled-out records (runs in the caller's thread)"""
+
+    def filter(self, record):
+        rate = getattr(record, 'sample_rate', None)
+        if rate is not None and random.random() >= rate:
+            return False
+        if has_request_context():
+            record.request_id = getattr(g, 'request_id', None)
+            record.method = request.method
+            record.path = request.path
+            started = getattr(g, 'request_started', None)
+            if started is not None:
+                record.elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that never waits: a full queue drops the record"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Everything the listener needs is rendered now: no args or traceback objects cross threads
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _StderrHandler(logging.StreamHandler):
+    """Writes to the current ``sys.stderr``, which test runners and daemons replace"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+
+    @property
+    def stream(self):
+        return sys.stderr
+
+
+class _LoggingState(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handler = None
+        self.listener = None
+        self.targets = ()
+
+
+_state = _LoggingState()
+
+
+def _target_handlers(config):
+    if config['LOG_FILE']:
+        target = RotatingFileHandler(config['LOG_FILE'], maxBytes=config['LOG_FILE_MAX_BYTES'],
+                                     backupCount=config['LOG_FILE_BACKUP_COUNT'])
+    else:
+        target = _StderrHandler()
+    target.setFormatter(jsonlogger.JsonFormatter(JSON_FORMAT, timestamp=True))
+    return (target,)
+
+
+def stop_logging():
+    """Write out the queued records and detach the queue from the root logger"""
+    with _state.lock:
+        if _state.listener is not None:
+            # Flushes what is queued
+            _state.listener.stop()
+            _state.listener = None
+        for target in _state.targets:
+            target.close()
+        _state.targets = ()
+        if _state.handler is not None:
+            logging.getLogger().removeHandler(_state.handler)
+            _state.handler = None
+
+
+def _restart_in_child():
+    # A forked worker inherits the queue but not the listener thread
+    if _state.listener is not None:
+        _state.listener = QueueListener(_state.handler.queue, *_state.targets, respect_handler_level=True)
+        _state.listener.start()
+
+
+def configure_logging(config):
+    """Route the root logger through the queue; replaces a previous configuration"""
+    stop_logging()
+    level = logging.getLevelName(config['LOG_LEVEL'])
+    with _state.lock:
+        log_queue = queue.Queue(maxsize=config['LOG_QUEUE_SIZE'])
+        _state.handler = NonBlockingQueueHandler(log_queue)
+        _state.handler.addFilter(RequestContextFilter())
+        _state.targets = _target_handlers(config)
+        _state.listener = QueueListener(log_queue, *_state.targets, respect_handler_level=True)
+        _state.listener.start()
+        root = logging.getLogger()
+        root.addHandler(_state.handler)
+        root.setLevel(level)
+    return _state.handler
+
+
+def dropped_records():
+    return _state.handler.dropped if _state.handler is not None else 0
+
+
+atexit.register(stop_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_in_child)
+
+
+class StructuredLogging(object):
+    """Flask extension: JSON logs off the request thread, with request ids and timings"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOG_LEVEL', 'INFO')
+        app.config.setdefault('LOG_FILE', 'app.log')
+        app.config.setdefault('LOG_FILE_MAX_BYTES', 1_000_000)
+        app.config.setdefault('LOG_FILE_BACKUP_COUNT', 3)
+        app.config.setdefault('LOG_QUEUE_SIZE', 10000)
+        app.config.setdefault('LOG_DEBUG_SAMPLE_RATE', 0.01)
+        app.config.setdefault('LOG_REQUESTS', True)
+        configure_logging(app.config)
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+
+    @staticmethod
+    def _start_request():
+        g.request_started = time.perf_counter()
+        request_id = request.headers.get(REQUEST_ID_HEADER, '')
+        g.request_id = request_id if _VALID_REQUEST_ID.match(request_id) else uuid.uuid4().hex
+
+    @staticmethod
+    def _end_request(response):
+        request_id = getattr(g, 'request_id', None)
+        if request_id is not None:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        if current_app.config['LOG_REQUESTS'] and getattr(g, 'request_started', None) is not None:
+            logger.info("request", extra={
+                'status': response.status_code,
+                'duration_ms': round((time.perf_counter() - g.request_started) * 1000, 3)
+            })
+        return response
+
+
+structured_logging = StructuredLogging()
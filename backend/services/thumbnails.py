@@ -0,0 +1,224 @@
+"""
+Miniatures des pièces jointes images, générées à la demande.
+
+La première demande d'une taille (``THUMBNAIL_SIZES``) décode l'image dans un
+pool de processus, pour que le redimensionnement ne bloque pas le GIL des
+workers HTTP, et écrit le résultat à côté de l'original
+(``<blob>.thumb-<taille>.<ext>``) ; les demandes suivantes servent ce fichier.
+Deux demandes simultanées de la même miniature partagent le même calcul. Si
+un processus du pool meurt (tué par le système faute de mémoire sur une image
+énorme), le pool cassé est remplacé et la génération retentée une fois.
+
+Le cache disque est borné par ``THUMBNAIL_CACHE_MAX_BYTES`` : une miniature
+servie voit sa date de modification rafraîchie, et les moins récemment
+servies sont effacées quand la taille totale dépasse la limite (LRU). Les
+miniatures d'un blob partent avec lui au passage de ``flask attachments gc``.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+
+THUMBNAIL_MARKER = '.thumb-'
+IMAGE_MIME_TYPES = {'image/jpeg', 'image/png', 'image/gif'}
+# Formats without transparency are re-encoded as JPEG, the others as PNG
+OUTPUT_FORMATS = {'image/jpeg': ('JPEG', 'jpg', 'image/jpeg')}
+DEFAULT_FORMAT = ('PNG', 'png', 'image/png')
+
+
+def is_image(attachment):
+    return attachment.mime_type in IMAGE_MIME_TYPES
+
+
+def thumbnail_mime_type(attachment):
+    return OUTPUT_FORMATS.get(attachment.mime_type, DEFAULT_FORMAT)[2]
+
+
+def thumbnail_path(attachment, size):
+    extension = OUTPUT_FORMATS.get(attachment.mime_type, DEFAULT_FORMAT)[1]
+    return f'{attachment.file_path}{THUMBNAIL_MARKER}{size}.{extension}'
+
+
+def render_thumbnail(source, target, size, image_format):
+    """Resize ``source`` to fit ``size`` x ``size`` into ``target`` (runs in the pool)"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        # JPEG can decode straight at a reduced scale
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        if image_format == 'JPEG':
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA')
+        image.thumbnail((size, size))
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                image.save(temp, image_format, optimize=True)
+            os.replace(temp_path, target)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    return os.path.getsize(target)
+
+
+def _thumbnail_files(root):
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if THUMBNAIL_MARKER in name and not name.endswith('.part'):
+                yield os.path.join(directory, name)
+
+
+def prune_thumbnails(root, max_bytes):
+    """Delete the least recently served thumbnails until under ``max_bytes``; returns the count"""
+    files = []
+    for path in _thumbnail_files(root):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return removed
+
+
+class _ThumbnailState(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pending = {}
+        self.pruner = ThreadPoolExecutor(max_workers=1, thread_name_prefix='thumbnail-prune')
+        self.pruning = None
+        self.last_prune = None
+
+
+class Thumbnailer(object):
+    """Flask extension generating attachment thumbnails in a process pool"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('THUMBNAIL_SIZES', {'small': 160, 'medium': 640})
+        app.config.setdefault('THUMBNAIL_WORKERS', 2)
+        app.config.setdefault('THUMBNAIL_TIMEOUT', 30)
+        app.config.setdefault('THUMBNAIL_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+        app.config.setdefault('THUMBNAIL_PRUNE_INTERVAL', 60)
+        app.extensions['thumbnails'] = _ThumbnailState()
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['thumbnails']
+
+    @staticmethod
+    def _pool(state):
+        # Created on first use, in the worker process (after gunicorn's fork); holds state.lock
+        if state.pool is None:
+            state.pool = ProcessPoolExecutor(max_workers=current_app.config['THUMBNAIL_WORKERS'])
+        return state.pool
+
+    @staticmethod
+    def _discard_pool(state, pool):
+        # Only the first request to notice a broken pool replaces it
+        with state.lock:
+            if state.pool is pool:
+                state.pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _render_in_pool(self, state, target, args):
+        with state.lock:
+            pending = state.pending.get(target)
+            started = pending is None
+            if started:
+                pool = self._pool(state)
+                try:
+                    future = pool.submit(render_thumbnail, *args)
+                except BrokenProcessPool:
+                    pending = None
+                else:
+                    pending = state.pending[target] = (future, pool)
+        if pending is None:
+            self._discard_pool(state, pool)
+            raise BrokenProcessPool("Thumbnail pool is broken")
+        future, pool = pending
+        if started:
+            future.add_done_callback(lambda done: self._forget(state, target))
+        try:
+            future.result(timeout=current_app.config['THUMBNAIL_TIMEOUT'])
+        except BrokenProcessPool:
+            self._discard_pool(state, pool)
+            raise
+
+    def get(self, attachment, size_name):
+        """Path of the thumbnail, generated if needed.
+
+        Raises KeyError for an unknown size and FileNotFoundError when the
+        original is missing.
+        """
+        size = current_app.config['THUMBNAIL_SIZES'][size_name]
+        target = thumbnail_path(attachment, size)
+        try:
+            # Served: most recently used
+            os.utime(target)
+            return target
+        except FileNotFoundError:
+            pass
+        if not os.path.isfile(attachment.file_path):
+            raise FileNotFoundError(attachment.file_path)
+
+        image_format = OUTPUT_FORMATS.get(attachment.mime_type, DEFAULT_FORMAT)[0]
+        args = (attachment.file_path, target, size, image_format)
+        state = self._state()
+        if not current_app.config['THUMBNAIL_WORKERS']:
+            render_thumbnail(*args)
+        else:
+            try:
+                self._render_in_pool(state, target, args)
+            except BrokenProcessPool:
+                # A pool worker died: the next attempt runs in a fresh pool
+                self._render_in_pool(state, target, args)
+        self._maybe_prune(state)
+        return target
+
+    @staticmethod
+    def _forget(state, target):
+        with state.lock:
+            state.pending.pop(target, None)
+
+    def _maybe_prune(self, state):
+        config = current_app.config
+        with state.lock:
+            if state.last_prune is not None \
+                    and time.monotonic() - state.last_prune < config['THUMBNAIL_PRUNE_INTERVAL'] \
+                    or (state.pruning is not None and not state.pruning.done()):
+                return
+            state.last_prune = time.monotonic()
+            state.pruning = state.pruner.submit(
+                prune_thumbnails, config['UPLOAD_FOLDER'], config['THUMBNAIL_CACHE_MAX_BYTES']
+            )
+
+    def wait_for_prune(self):
+        """Block until the background prune (if any) is over; returns its count"""
+        pruning = self._state().pruning
+        return pruning.result() if pruning is not None else 0
+
+
+thumbnailer = Thumbnailer()
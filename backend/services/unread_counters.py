@@ -0,0 +1,241 @@
+"""
+Nombre de notifications non lues tenu à jour en direct.
+
+Le nombre de non-lues d'un utilisateur se lit sur sa ligne ``users``, sans
+``COUNT`` :
+
+    users.unread_notifications              notifications personnelles non lues
+    + broadcast_totals('all' et son rôle)   diffusions envoyées à son audience
+    - users.broadcasts_seen                 diffusions qui ne comptent pas pour lui
+
+``broadcasts_seen`` part du total de son audience à la création du compte
+(les diffusions antérieures ne lui sont pas visibles) et augmente de un à
+chaque accusé de lecture ou de suppression. Une diffusion coûte donc une
+seule écriture, quel que soit le nombre de destinataires.
+
+Les écritures ORM sont suivies par les hooks de flush de la session ; les
+écritures ensemblistes (tout marquer comme lu, tout supprimer, actions en
+masse) appellent ``adjust_unread`` / ``adjust_seen`` dans leur transaction.
+Une écriture hors de ces chemins (SQL brut, suppression d'une diffusion)
+doit être suivie de ``flask notifications repair``.
+"""
+
+from collections import Counter
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, bindparam, event, func, inspect, select, update
+
+from extensions import db
+from models import BroadcastTotal, Notification, NotificationReceipt, User
+
+AUDIENCE_ALL = 'all'
+
+_UNREAD_KEY = 'unread_counter_deltas'
+_ROLES_KEY = 'unread_counter_role_changes'
+
+
+def _was_unread(notification):
+    """Unread state as last flushed (attribute history)"""
+    history = inspect(notification).attrs.is_read.history
+    if history.deleted:
+        return not history.deleted[0]
+    if history.added and not history.unchanged:
+        # Assigned while expired: the old value was never loaded
+        return not db.session.connection().execute(
+            select(Notification.is_read).where(Notification.id == notification.id)
+        ).scalar()
+    return not notification.is_read
+
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_unread_deltas(session, flush_context, instances):
+    # Old values must be read before the flush overwrites or deletes the rows
+    deltas = Counter()
+    role_changes = set()
+    for obj in session.dirty:
+        if isinstance(obj, Notification) and obj.user_id is not None \
+                and inspect(obj).attrs.is_read.history.has_changes():
+            deltas[int(obj.user_id)] += (not obj.is_read) - _was_unread(obj)
+        elif isinstance(obj, User) and inspect(obj).attrs.role.history.has_changes():
+            role_changes.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Notification) and obj.user_id is not None and _was_unread(obj):
+            deltas[int(obj.user_id)] -= 1
+    flush_context.attributes[_UNREAD_KEY] = deltas
+    flush_context.attributes[_ROLES_KEY] = role_changes
+
+
+@event.listens_for(db.session, 'after_flush')
+def _apply_unread_deltas(session, flush_context):
+    unread = flush_context.attributes.pop(_UNREAD_KEY, Counter())
+    role_changes = flush_context.attributes.pop(_ROLES_KEY, set())
+    seen, totals, new_users = Counter(), Counter(), []
+    for obj in session.new:
+        if isinstance(obj, Notification):
+            if obj.user_id is None:
+                totals[obj.audience] += 1
+            elif not obj.is_read:
+                unread[int(obj.user_id)] += 1
+        elif isinstance(obj, NotificationReceipt):
+            seen[int(obj.user_id)] += 1
+        elif isinstance(obj, User):
+            new_users.append(obj.id)
+
+    connection = session.connection()
+    adjust_broadcast_totals(connection, totals)
+    adjust_unread(connection, unread)
+    adjust_seen(connection, seen)
+    if new_users:
+        # Broadcasts sent before the account was created are not visible to it
+        users = User.__table__
+        connection.execute(
+            update(users).where(users.c.id.in_(new_users))
+            .values(broadcasts_seen=_audience_total(users.c.role))
+        )
+    for user_id in role_changes:
+        # The broadcasts visible to the user changed with the role: recount
+        repair_user(connection, user_id)
+
+
+def _add(connection, column, deltas):
+    rows = [{"row_id": user_id, "delta": delta} for user_id, delta in deltas.items() if delta]
+    if rows:
+        users = User.__table__
+        connection.execute(
+            update(users).where(users.c.id == bindparam('row_id'))
+            .values({column: users.c[column] + bindparam('delta')}),
+            rows
+        )
+
+
+def adjust_unread(connection, deltas):
+    """Add ``deltas`` ({user_id: n}) to the personal unread counters"""
+    _add(connection, 'unread_notifications', deltas)
+
+
+def adjust_seen(connection, deltas):
+    """Add ``deltas`` ({user_id: n}) broadcast receipts to the users' counters"""
+    _add(connection, 'broadcasts_seen', deltas)
+
+
+def adjust_broadcast_totals(connection, deltas):
+    """Add ``deltas`` ({audience: n}) to the broadcast totals"""
+    table = BroadcastTotal.__table__
+    for audience, count in deltas.items():
+        if not count:
+            continue
+        result = connection.execute(
+            update(table).where(table.c.audience == audience).values(count=table.c.count + count)
+        )
+        if not result.rowcount:
+            connection.execute(table.insert(), {"audience": audience, "count": count})
+
+
+def _audience_total(role):
+    """Scalar subquery: broadcasts sent to everyone plus to ``role``"""
+    return select(func.coalesce(func.sum(BroadcastTotal.count), 0))\
+        .where(BroadcastTotal.audience.in_([AUDIENCE_ALL, role]))\
+        .scalar_subquery()
+
+
+def unread_expression():
+    """Unread count of a ``users`` row, counters only"""
+    return User.unread_notifications + _audience_total(User.role) - User.broadcasts_seen
+
+
+def read_unread(user_id):
+    return db.session.query(unread_expression()).filter(User.id == user_id).scalar() or 0
+
+
+def unread_high_water(user_id):
+    """``(unread_count, newest notification id)`` read together, to start a stream from"""
+    count, last_id = db.session.query(
+        unread_expression(), select(func.max(Notification.id)).scalar_subquery()
+    ).filter(User.id == user_id).one()
+    return count, last_id or 0
+
+
+def compute_unread(user_id=None):
+    """Exact ``{user_id: (unread_notifications, broadcasts_seen)}`` recounted from the notifications"""
+    users = db.session.query(User.id, User.role)
+    personal = db.session.query(Notification.user_id, func.count(Notification.id))\
+        .filter(Notification.user_id.isnot(None), Notification.is_read.is_(False))\
+        .group_by(Notification.user_id)
+    unread_broadcasts = db.session.query(User.id, func.count(Notification.id))\
+        .join(Notification, and_(
+            Notification.user_id.is_(None),
+            Notification.audience.in_([AUDIENCE_ALL, User.role]),
+            Notification.created_at >= User.created_at
+        ))\
+        .outerjoin(NotificationReceipt, and_(
+            NotificationReceipt.notification_id == Notification.id,
+            NotificationReceipt.user_id == User.id
+        ))\
+        .filter(NotificationReceipt.user_id.is_(None))\
+        .group_by(User.id)
+    if user_id is not None:
+        users = users.filter(User.id == user_id)
+        personal = personal.filter(Notification.user_id == user_id)
+        unread_broadcasts = unread_broadcasts.filter(User.id == user_id)
+    totals = broadcast_totals()
+
+    personal, unread_broadcasts = dict(personal.all()), dict(unread_broadcasts.all())
+    return {
+        uid: (
+            personal.get(uid, 0),
+            totals[AUDIENCE_ALL] + totals[role] - unread_broadcasts.get(uid, 0)
+        )
+        for uid, role in users.all()
+    }
+
+
+def broadcast_totals():
+    """Broadcasts per audience, recounted from the notifications"""
+    return Counter(dict(
+        db.session.query(Notification.audience, func.count(Notification.id))
+        .filter(Notification.user_id.is_(None)).group_by(Notification.audience).all()
+    ))
+
+
+def repair_user(connection, user_id):
+    """Recount one user's counters in the current transaction"""
+    for uid, (unread, seen) in compute_unread(user_id).items():
+        connection.execute(
+            update(User.__table__).where(User.__table__.c.id == uid)
+            .values(unread_notifications=unread, broadcasts_seen=seen)
+        )
+
+
+def repair_unread_counters():
+    """Recount every counter from the notifications; returns (users, drifted)"""
+    connection = db.session.connection()
+    connection.execute(BroadcastTotal.__table__.delete())
+    adjust_broadcast_totals(connection, broadcast_totals())
+
+    expected = compute_unread()
+    current = {uid: (unread, seen) for uid, unread, seen in
+               db.session.query(User.id, User.unread_notifications, User.broadcasts_seen)}
+    drifted = [
+        {"row_id": uid, "unread": unread, "seen": seen}
+        for uid, (unread, seen) in expected.items() if current.get(uid) != (unread, seen)
+    ]
+    if drifted:
+        users = User.__table__
+        connection.execute(
+            update(users).where(users.c.id == bindparam('row_id'))
+            .values(unread_notifications=bindparam('unread'), broadcasts_seen=bindparam('seen')),
+            drifted
+        )
+    db.session.commit()
+    return len(expected), len(drifted)
+
+
+notifications_cli = AppGroup('notifications', help="Notification maintenance commands.")
+
+
+@notifications_cli.command('repair')
+def repair_command():
+    """Recount the unread notification counters of every user."""
+    users, drifted = repair_unread_counters()
+    click.echo(f"Unread counters repaired: {users} users, {drifted} corrected")
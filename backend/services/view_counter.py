@@ -0,0 +1,133 @@
+"""
+Compteur de vues différé (write-behind) pour le détail des problèmes.
+
+Les lectures de ``GET /api/problems/<id>`` n'écrivent plus en base : les vues
+sont accumulées en mémoire (par processus) puis appliquées périodiquement en
+un seul ``UPDATE ... CASE``. En cas d'échec du flush les compteurs sont remis
+dans le tampon, et un dernier flush a lieu à l'arrêt du processus : une vue
+est comptée au moins une fois. Ce flush final ne concerne que les applications
+encore vivantes et non arrêtées (``view_counter.stop()``, appelé par les tests
+avant de supprimer leur base).
+"""
+
+import atexit
+import logging
+import threading
+import weakref
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import case, update
+
+from extensions import db
+from models import Problem
+
+logger = logging.getLogger(__name__)
+
+# Keeps the IN (...) list under SQLite's bound-parameter limit
+FLUSH_CHUNK_SIZE = 400
+
+# Buffers of the apps still alive and not stopped, flushed at interpreter exit
+_live_buffers = weakref.WeakSet()
+
+
+class _ViewBuffer(object):
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.pending = Counter()
+        self.stop = threading.Event()
+
+
+class ViewCounter(object):
+    """Flask extension buffering problem views and flushing them in bulk"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VIEW_COUNT_FLUSH_INTERVAL', 10)
+        state = app.extensions['view_counter'] = _ViewBuffer(app)
+
+        interval = app.config['VIEW_COUNT_FLUSH_INTERVAL']
+        if interval and interval > 0:
+            thread = threading.Thread(
+                target=self._run, args=(app, state, interval),
+                name='view-counter-flush', daemon=True
+            )
+            thread.start()
+        _live_buffers.add(state)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['view_counter']
+
+    def record(self, problem_id, count=1):
+        state = self._state()
+        with state.lock:
+            state.pending[problem_id] += count
+
+    def pending(self, problem_id):
+        """Views recorded in this process but not yet written to the database"""
+        state = self._state()
+        with state.lock:
+            return state.pending.get(problem_id, 0)
+
+    def flush(self):
+        """Write buffered views with one UPDATE per chunk; returns the number flushed"""
+        state = self._state()
+        with state.lock:
+            batch, state.pending = state.pending, Counter()
+        if not batch:
+            return 0
+
+        table = Problem.__table__
+        ids = list(batch)
+        try:
+            with db.engine.begin() as connection:
+                for start in range(0, len(ids), FLUSH_CHUNK_SIZE):
+                    chunk = {problem_id: batch[problem_id] for problem_id in ids[start:start + FLUSH_CHUNK_SIZE]}
+                    connection.execute(
+                        update(table)
+                        .where(table.c.id.in_(list(chunk)))
+                        .values(
+                            views_count=table.c.views_count + case(chunk, value=table.c.id, else_=0),
+                            # A view is not a modification of the problem
+                            updated_at=table.c.updated_at
+                        )
+                    )
+        except Exception:
+            # Put the views back so the next flush retries them
+            with state.lock:
+                state.pending.update(batch)
+            raise
+        return sum(batch.values())
+
+    def stop(self):
+        """Stop the background flush of the current app and write what is buffered"""
+        state = self._state()
+        state.stop.set()
+        _live_buffers.discard(state)
+        return self.flush()
+
+    def _run(self, app, state, interval):
+        while not state.stop.wait(interval):
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception:
+                logger.exception("Failed to flush buffered problem views")
+
+    def _flush_at_exit(self):
+        for state in list(_live_buffers):
+            state.stop.set()
+            try:
+                with state.app.app_context():
+                    self.flush()
+            except Exception:
+                logger.exception("Failed to flush buffered problem views at shutdown")
+
+
+view_counter = ViewCounter()
+atexit.register(view_counter._flush_at_exit)
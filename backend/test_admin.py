@@ -0,0 +1,109 @@
+"""
+Tests en processus des endpoints /api/admin
+"""
+
+
+def test_dashboard_cost_does_not_grow_with_data(client, db, make_user, make_problem, auth_headers, count_queries):
+    admin = make_user('admin')
+    headers = auth_headers(admin)
+
+    def dashboard():
+        with count_queries() as statements:
+            response = client.get('/api/admin/dashboard', headers=headers)
+        assert response.status_code == 200, response.get_json()
+        return response.get_json(), len(statements)
+
+    student = make_user('student')
+    make_problem(student, urgency=3)
+    small, small_count = dashboard()
+
+    for i in range(15):
+        make_problem(make_user('student'), commit=False, urgency=1 + i % 3, state='Problème traité' if i % 2 else 'Soumis')
+    db.session.commit()
+    large, large_count = dashboard()
+
+    assert small_count == large_count
+    stats = large['problem_stats']
+    assert stats['total_problems'] == 16
+    assert stats['high_urgency'] + stats['medium_urgency'] + stats['low_urgency'] == 16
+    assert stats['resolved_problems'] == 7 and stats['pending'] == 9
+    assert large['user_stats']['students'] == 16 and large['user_stats']['admins'] == 1
+    assert large['recent_problems'][0]['user']['surname'] == 'Test'
+
+
+def test_bulk_status_change_is_set_based(client, db, make_user, make_problem, auth_headers, count_queries):
+    from models import Notification, ProblemCounter, ProblemHistory
+    from services.bulk_problems import CHUNK_SIZE
+    from services.counters import compute_counters, problem_counts
+
+    admin = make_user('admin')
+    owners = [make_user('student') for _ in range(3)]
+    problems = [make_problem(owners[i % 3], commit=False) for i in range(CHUNK_SIZE + 20)]
+    db.session.commit()
+    ids = [problem.id for problem in problems]
+    already = problems[0]
+    already.state = 'Problème traité'
+    db.session.commit()
+    headers = auth_headers(admin)
+
+    with count_queries() as statements:
+        response = client.post('/api/admin/problems/bulk-update', headers=headers, json={
+            'problem_ids': ids + [999999], 'action': 'change_status', 'new_status': 'Problème traité'
+        })
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['updated_count'] == len(ids)
+    # select + update + counters + history + notifications, per chunk
+    assert len(statements) <= 2 * 5 + 2
+
+    history = db.session.query(ProblemHistory).all()
+    assert len(history) == len(ids) - 1
+    assert {(h.action, h.old_value, h.new_value, h.user_id) for h in history} == {
+        ('state_updated', 'Soumis', 'Problème traité', admin.id)
+    }
+    notifications = db.session.query(Notification).filter_by(title='Problem Status Updated').all()
+    assert len(notifications) == len(ids) - 1
+    assert {n.user_id for n in notifications} == {owner.id for owner in owners}
+
+    assert problem_counts()['resolved'] == len(ids)
+    # Core statements bypass the flush hooks: the counters are adjusted explicitly
+    stored = {(c.dimension, c.value, c.user_id): c.count for c in db.session.query(ProblemCounter) if c.count}
+    assert stored == {key: count for key, count in compute_counters().items() if count}
+
+
+def test_bulk_delete_cascades_and_removes_files_after_commit(client, db, make_user, make_problem, auth_headers, tmp_path):
+    from models import Attachment, Comment, Notification, Problem, ProblemLike
+    from services import bulk_problems
+
+    admin, owner = make_user('admin'), make_user('student')
+    keep = make_problem(owner)
+    doomed = [make_problem(owner, room=f'R{i}') for i in range(3)]
+    paths = []
+    for problem in doomed:
+        path = tmp_path / f'{problem.id}.png'
+        path.write_bytes(b'png')
+        paths.append(path)
+        db.session.add(Attachment(problem_id=problem.id, filename=path.name, original_filename=path.name,
+                                  file_path=str(path), file_size=3, mime_type='image/png'))
+        db.session.add(Comment(problem_id=problem.id, user_id=admin.id, content='Vu'))
+        db.session.add(ProblemLike(problem_id=problem.id, user_id=admin.id))
+    db.session.commit()
+
+    response = client.post('/api/admin/problems/bulk-update', headers=auth_headers(admin), json={
+        'problem_ids': [problem.id for problem in doomed], 'action': 'delete'
+    })
+    assert response.status_code == 200, response.get_json()
+    bulk_problems._file_cleanup.submit(lambda: None).result()  # wait for the cleanup queue
+
+    assert [p.id for p in db.session.query(Problem)] == [keep.id]
+    assert db.session.query(Comment).count() == db.session.query(ProblemLike).count() == 0
+    assert db.session.query(Attachment).count() == 0
+    assert not any(path.exists() for path in paths)
+    deleted = db.session.query(Notification).filter_by(user_id=owner.id, title='Problem Deleted').all()
+    assert sorted(n.message for n in deleted) == [
+        f'Your problem in R{i} has been deleted by an administrator' for i in range(3)
+    ]
+
+    missing = client.post('/api/admin/problems/bulk-update', headers=auth_headers(admin), json={
+        'problem_ids': [999999], 'action': 'activate'
+    })
+    assert missing.status_code == 404
@@ -0,0 +1,142 @@
+"""
+Tests en processus des agrégats quotidiens (table analytics)
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import Analytics
+from services.analytics import rollup_pending, today
+
+
+def days_ago(days, hour=10):
+    day = datetime.utcnow().replace(hour=hour, minute=0, second=0, microsecond=0)
+    return day - timedelta(days=days)
+
+
+def seed(make_user, make_problem):
+    student = make_user('student', last_login=days_ago(1))
+    make_problem(student, created_at=days_ago(3), category='Chauffage', urgency=3,
+                 state='Problème traité', resolved_at=days_ago(2))
+    make_problem(student, created_at=days_ago(2), category='Réseau', urgency=1)
+    make_problem(student, created_at=days_ago(0, hour=0), category='Chauffage', urgency=2)
+    return student
+
+
+def test_rollup_only_computes_missing_days(app, db, make_user, make_problem):
+    student = seed(make_user, make_problem)
+
+    assert rollup_pending() == 3
+    rows = db.session.query(Analytics).order_by(Analytics.date).all()
+    assert [row.date.date() for row in rows] == [today() - timedelta(days=n) for n in (3, 2, 1)]
+    assert [row.total_problems for row in rows] == [1, 1, 0]
+    assert rows[1].resolved_problems == 1 and rows[1].avg_resolution_time == 24
+    assert rows[2].active_users == 1
+    assert rollup_pending() == 0
+
+    # A late write to a closed day is only picked up by a backfill
+    make_problem(student, created_at=days_ago(2), category='Réseau')
+    assert rollup_pending() == 0
+    since = (today() - timedelta(days=2)).isoformat()
+    result = app.test_cli_runner().invoke(args=['analytics', 'backfill', '--since', since])
+    assert result.exit_code == 0, result.output
+    assert 'backfilled for 2 day(s)' in result.output
+    assert db.session.query(Analytics).filter_by(date=days_ago(2, hour=0)).one().total_problems == 2
+
+
+def test_endpoint_merges_rollups_with_live_today(client, db, make_user, make_problem, auth_headers, count_queries):
+    seed(make_user, make_problem)
+    headers = auth_headers(make_user('admin'))
+    live = client.get('/api/admin/analytics?days=30', headers=headers).get_json()
+
+    rollup_pending()
+    served = client.get('/api/admin/analytics?days=30', headers=headers).get_json()
+    assert served == live
+    assert served['summary'] == {
+        'total_problems': 3, 'resolved_problems': 1, 'avg_resolution_time': 24.0, 'total_categories': 2
+    }
+    assert served['problems_by_category'] == [
+        {'category': 'Chauffage', 'count': 2}, {'category': 'Réseau', 'count': 1}
+    ]
+    assert [item['count'] for item in served['problems_over_time']] == [1, 1, 1]
+
+    def statements_for(days):
+        with count_queries() as statements:
+            assert client.get(f'/api/admin/analytics?days={days}', headers=headers).status_code == 200
+        return len(statements)
+
+    assert statements_for(7) == statements_for(365)
+
+
+def test_resolution_time_distribution(client, make_user, make_problem, auth_headers):
+    student = make_user('student')
+    hours = [0.25 + 0.5 * n for n in range(200)]  # 0.25h .. 99.75h, off the bin edges
+    for n, duration in enumerate(hours):
+        created = days_ago(5) + timedelta(minutes=n)
+        make_problem(student, commit=n == len(hours) - 1, created_at=created,
+                     category='Chauffage' if n % 4 else 'Réseau', urgency=1 + n % 3,
+                     state='Problème traité', resolved_at=created + timedelta(hours=duration))
+    headers = auth_headers(make_user('admin'))
+
+    data = client.get('/api/admin/analytics?days=30&bins=1,24,72', headers=headers).get_json()
+    assert 'resolution_times' not in data
+    overall = data['resolution_time']['overall']
+    assert overall['count'] == 200
+    assert [(b['min'], b['max'], b['count']) for b in overall['histogram']] == [
+        (0, 1, 2), (1, 24, 46), (24, 72, 96), (72, None, 56)
+    ]
+    ordered = sorted(hours)
+    for q in ('p50', 'p90', 'p99'):
+        exact = ordered[int(float(q[1:]) / 100 * (len(ordered) - 1))]
+        assert abs(overall[q] - exact) <= 0.01 * exact + 1e-6, (q, overall[q], exact)
+    assert overall['mean'] == pytest.approx(sum(hours) / 200)
+
+    by_category = {group['category']: group['count'] for group in data['resolution_time']['by_category']}
+    assert by_category == {'Chauffage': 150, 'Réseau': 50}
+    assert [group['urgency'] for group in data['resolution_time']['by_urgency']] == [1, 2, 3]
+
+    first = client.get('/api/admin/analytics?include_raw=true&per_page=150', headers=headers).get_json()
+    second = client.get('/api/admin/analytics?include_raw=true&per_page=150&page=2', headers=headers).get_json()
+    assert first['resolution_times_pagination']['has_next'] is True
+    assert second['resolution_times_pagination']['has_next'] is False
+    raw = first['resolution_times'] + second['resolution_times']
+    assert [round(value, 3) for value in raw] == hours
+
+    assert client.get('/api/admin/analytics?bins=24,1', headers=headers).status_code == 400
+
+
+def test_rolled_up_distribution_matches_live(app, client, db, make_user, make_problem, auth_headers):
+    app.config['ANALYTICS_RESOLUTION_BINS'] = [1, 24, 72]
+    student = make_user('student')
+    for n in range(60):
+        created = days_ago(6) + timedelta(hours=n)
+        make_problem(student, commit=False, created_at=created, category=('Chauffage', 'Réseau')[n % 2],
+                     urgency=1 + n % 3, state='Problème traité',
+                     resolved_at=created + timedelta(hours=0.25 + 1.5 * n))
+    db.session.commit()
+    headers = auth_headers(make_user('admin'))
+
+    def distribution(bins=''):
+        url = f'/api/admin/analytics?days=30{bins}'
+        return client.get(url, headers=headers).get_json()['resolution_time']
+
+    def without_means(data):
+        groups = [data['overall']] + data['by_category'] + data['by_urgency']
+        return [{key: value for key, value in group.items() if key != 'mean'} for group in groups]
+
+    live, live_custom = distribution(), distribution('&bins=2,30')
+    rollup_pending()
+    stored = distribution()
+    assert without_means(stored) == without_means(live)
+    assert stored['overall']['mean'] == pytest.approx(live['overall']['mean'])
+
+    # Other bins come from the stored sketches: off by at most the values next to an edge
+    custom = distribution('&bins=2,30')['overall']['histogram']
+    assert sum(b['count'] for b in custom) == 60
+    assert all(abs(a['count'] - b['count']) <= 1 for a, b in zip(custom, live_custom['overall']['histogram']))
+
+    # Rollups written before distributions were stored fall back to a live pass
+    db.session.query(Analytics).update({Analytics.resolution_distribution: None})
+    db.session.commit()
+    assert without_means(distribution()) == without_means(live)
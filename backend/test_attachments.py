@@ -0,0 +1,155 @@
+"""
+Tests en processus du stockage adressé par contenu des pièces jointes
+"""
+
+import hashlib
+import io
+import os
+
+from models import Attachment
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 200000
+
+
+def submit(client, headers, room, *files):
+    response = client.post('/api/problems/', headers=headers, content_type='multipart/form-data', data={
+        'promotion': 'B3', 'room': room, 'category': 'Chauffage', 'type_of_problem': 'Radiateur',
+        'description': 'Le radiateur reste froid', 'urgency': '3', 'remark': 'RAS',
+        'files': [(io.BytesIO(content), name, content_type) for name, content, content_type in files]
+    })
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['problem']['id']
+
+
+def test_uploads_are_deduplicated_sniffed_and_collected(app, client, db, make_user, auth_headers, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    admin, student = make_user('admin'), make_user('student')
+    headers = auth_headers(student)
+
+    # The client's Content-Type is ignored; a disguised executable is refused
+    first = submit(client, headers, 'A1', ('photo.png', PNG, 'text/plain'),
+                   ('virus.png', b'MZ\x90\x00' * 10, 'image/png'))
+    second = submit(client, headers, 'A2', ('copie.png', PNG, 'image/png'))
+
+    sha256 = hashlib.sha256(PNG).hexdigest()
+    blob = tmp_path / sha256[:2] / sha256[2:4] / sha256
+    rows = db.session.query(Attachment).order_by(Attachment.id).all()
+    assert [(a.problem_id, a.original_filename, a.mime_type, a.sha256, a.file_size) for a in rows] == [
+        (first, 'photo.png', 'image/png', sha256, len(PNG)),
+        (second, 'copie.png', 'image/png', sha256, len(PNG)),
+    ]
+    assert blob.read_bytes() == PNG
+    assert os.listdir(tmp_path / 'tmp') == []
+
+    def delete(problem_id):
+        response = client.post('/api/admin/problems/bulk-update', headers=auth_headers(admin), json={
+            'problem_ids': [problem_id], 'action': 'delete'
+        })
+        assert response.status_code == 200, response.get_json()
+
+    def gc():
+        result = app.test_cli_runner().invoke(args=['attachments', 'gc', '--grace', '0'])
+        assert result.exit_code == 0, result.output
+        return result.output
+
+    # Still referenced by the second problem
+    delete(first)
+    assert 'Attachment blobs removed: 1 ' in gc()  # the refused upload
+    assert blob.exists()
+
+    delete(second)
+    assert f'Attachment blobs removed: 1 ({len(PNG)} bytes freed)' in gc()
+    assert not blob.exists()
+
+
+def test_download_is_authorized_ranged_and_cacheable(app, client, db, make_user, auth_headers, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    owner, other, admin = make_user('student'), make_user('student'), make_user('admin')
+    problem_id = submit(client, auth_headers(owner), 'A1', ('photo.png', PNG, 'image/png'))
+    attachment = client.get(f'/api/problems/{problem_id}', headers=auth_headers(owner))\
+        .get_json()['problem']['attachments'][0]
+    url = attachment['url']
+    assert url == f"/api/problems/{problem_id}/attachments/{attachment['id']}"
+
+    response = client.get(url, headers=auth_headers(owner))
+    assert response.status_code == 200
+    assert response.data == PNG and response.mimetype == 'image/png'
+    sha256 = hashlib.sha256(PNG).hexdigest()
+    assert response.headers['ETag'] == f'"{sha256}"'
+    assert set(response.headers['Cache-Control'].split(', ')) == {'private', 'max-age=31536000', 'immutable'}
+    assert response.headers['Content-Disposition'].startswith('inline')
+
+    partial = client.get(url, headers=dict(auth_headers(admin), Range='bytes=0-7'))
+    assert partial.status_code == 206
+    assert partial.data == PNG[:8]
+    assert partial.headers['Content-Range'] == f'bytes 0-7/{len(PNG)}'
+
+    token = auth_headers(owner)['Authorization'].split()[1]
+    cached = client.get(f'{url}?jwt={token}', headers={'If-None-Match': f'"{sha256}"'})
+    assert cached.status_code == 304 and cached.data == b''
+
+    assert client.get(url, headers=auth_headers(other)).status_code == 403
+    assert client.get(f'/api/problems/{problem_id}/attachments/999', headers=auth_headers(owner)).status_code == 404
+    assert client.get(url).status_code == 401
+
+    # Behind nginx the file is handed to an internal location
+    app.config['ATTACHMENT_SEND_MODE'] = 'x-accel-redirect'
+    proxied = client.get(f'{url}?download=true', headers=auth_headers(owner))
+    assert proxied.status_code == 200 and proxied.data == b''
+    assert proxied.headers['X-Accel-Redirect'] == f'/protected-uploads/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+    assert proxied.headers['Content-Disposition'] == 'attachment; filename=photo.png'
+
+
+def test_thumbnails_are_generated_once_and_evicted_lru(app, client, db, make_user, auth_headers, tmp_path):
+    from PIL import Image
+    from services.thumbnails import prune_thumbnails, thumbnailer
+
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    app.config['THUMBNAIL_WORKERS'] = 1
+    student = make_user('student')
+    headers = auth_headers(student)
+    photo = io.BytesIO()
+    Image.new('RGB', (1200, 800), 'red').save(photo, 'JPEG')
+    problem_id = submit(client, headers, 'A1', ('photo.jpg', photo.getvalue(), 'image/jpeg'),
+                        ('plan.pdf', b'%PDF-1.4 plan', 'application/pdf'))
+
+    photo_data, pdf_data = client.get(f'/api/problems/{problem_id}', headers=headers)\
+        .get_json()['problem']['attachments']
+    assert pdf_data['thumbnails'] == {}
+    assert set(photo_data['thumbnails']) == {'small', 'medium'}
+
+    small = client.get(photo_data['thumbnails']['small'], headers=headers)
+    assert small.status_code == 200 and small.mimetype == 'image/jpeg'
+    assert Image.open(io.BytesIO(small.data)).size == (160, 107)
+    assert 'immutable' in small.headers['Cache-Control']
+    sha256 = hashlib.sha256(photo.getvalue()).hexdigest()
+    directory = tmp_path / sha256[:2] / sha256[2:4]
+    assert [name for name in os.listdir(directory) if '.thumb-' in name] == [f'{sha256}.thumb-160.jpg']
+    thumbnailer.wait_for_prune()
+
+    assert client.get(f"{photo_data['url']}/thumbnails/huge", headers=headers).status_code == 404
+    assert client.get(f"{pdf_data['url']}/thumbnails/small", headers=headers).status_code == 404
+    assert client.get(photo_data['thumbnails']['small'], headers=auth_headers(make_user('student'))).status_code == 403
+
+    # A pool worker killed (out of memory...) breaks the pool: it is replaced
+    pool = app.extensions['thumbnails'].pool
+    for process in list(pool._processes.values()):
+        process.kill()
+        process.join()
+    medium = client.get(photo_data['thumbnails']['medium'], headers=headers)
+    assert medium.status_code == 200 and app.extensions['thumbnails'].pool is not pool
+    os.remove(directory / f'{sha256}.thumb-640.jpg')
+
+    # Over the cap, the least recently served thumbnail goes first
+    app.config['THUMBNAIL_WORKERS'] = 0
+    small_path, medium_path = directory / f'{sha256}.thumb-160.jpg', directory / f'{sha256}.thumb-640.jpg'
+    assert client.get(photo_data['thumbnails']['medium'], headers=headers).status_code == 200
+    os.utime(small_path, (1, 1))
+    assert prune_thumbnails(str(tmp_path), medium_path.stat().st_size) == 1
+    assert not small_path.exists() and medium_path.exists()
+
+    # The garbage collector takes the thumbnails with their blob
+    client.post('/api/admin/problems/bulk-update', headers=auth_headers(make_user('admin')),
+                json={'problem_ids': [problem_id], 'action': 'delete'})
+    app.test_cli_runner().invoke(args=['attachments', 'gc', '--grace', '0'])
+    assert os.listdir(directory) == []
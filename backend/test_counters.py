@@ -0,0 +1,110 @@
+"""
+Tests en processus des compteurs live de problèmes (table problem_counters)
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import Problem, ProblemCounter
+from services.counters import compute_counters, problem_counts, rebuild_counters
+from services.stats import problem_aggregates
+
+
+def stored_counters(db):
+    return {
+        (row.dimension, row.value, row.user_id): row.count
+        for row in db.session.query(ProblemCounter) if row.count
+    }
+
+
+def assert_consistent(db, *user_ids):
+    assert stored_counters(db) == {key: count for key, count in compute_counters().items() if count}
+    for user_id in (None,) + user_ids:
+        counts = problem_counts(user_id)
+        counts.pop('categories')
+        expected = problem_aggregates(user_id)
+        # Counters keep whole seconds
+        assert counts.pop('avg_resolution_hours') == pytest.approx(expected.pop('avg_resolution_hours'), abs=1 / 3600)
+        assert counts == expected
+
+
+def test_counters_follow_every_write_path(client, db, make_user, make_problem, auth_headers):
+    student, other, admin = make_user('student'), make_user('student'), make_user('admin')
+    admin_headers = auth_headers(admin)
+
+    response = client.post('/api/problems/', headers=auth_headers(student), json={
+        'promotion': 'B3', 'room': 'B204', 'category': 'Chauffage', 'type_of_problem': 'Radiateur',
+        'description': 'Le radiateur reste froid', 'urgency': 3, 'remark': 'RAS'
+    })
+    assert response.status_code == 201, response.get_json()
+    created = make_problem(student, category='Réseau', urgency=1)
+    others = [make_problem(other, category='Mobilier') for _ in range(3)]
+    assert_consistent(db, student.id, other.id)
+
+    response = client.put(f'/api/problems/{created.id}', headers=admin_headers, json={'state': 'Problème traité'})
+    assert response.status_code == 200
+    assert_consistent(db, student.id, other.id)
+
+    response = client.post('/api/admin/problems/bulk-update', headers=admin_headers, json={
+        'problem_ids': [p.id for p in others[:2]], 'action': 'change_status', 'new_status': 'Problème traité'
+    })
+    assert response.status_code == 200, response.get_json()
+    response = client.post('/api/admin/problems/bulk-update', headers=admin_headers, json={
+        'problem_ids': [others[2].id], 'action': 'delete'
+    })
+    assert response.status_code == 200, response.get_json()
+    assert_consistent(db, student.id, other.id)
+
+    stats = client.get('/api/problems/stats', headers=admin_headers).get_json()
+    assert (stats['total_problems'], stats['resolved_problems'], stats['pending']) == (4, 3, 1)
+    assert problem_counts()['categories'] == [('Mobilier', 2), ('Chauffage', 1), ('Réseau', 1)]
+
+
+def test_assignment_on_expired_instance_uses_stored_value(db, make_user, make_problem):
+    student = make_user('student')
+    problem = make_problem(student, category='Réseau')
+    created = datetime.utcnow() - timedelta(hours=3)
+    problem.created_at = created
+    db.session.commit()
+
+    # After commit every attribute is expired: the old values were never loaded
+    problem.state = 'Problème traité'
+    problem.category = 'Chauffage'
+    problem.resolved_at = created + timedelta(hours=2)
+    db.session.commit()
+    assert_consistent(db, student.id)
+    assert problem_counts()['avg_resolution_hours'] == pytest.approx(2.0)
+
+    db.session.delete(db.session.get(Problem, problem.id))
+    db.session.commit()
+    assert stored_counters(db) == {}
+
+
+def test_rolled_back_write_leaves_counters_untouched(db, make_user, make_problem):
+    student = make_user('student')
+    make_problem(student)
+    before = stored_counters(db)
+
+    make_problem(student, commit=False, category='Chauffage')
+    db.session.flush()
+    assert problem_counts()['total'] == 2
+    db.session.rollback()
+    assert stored_counters(db) == before
+
+
+def test_rebuild_reconciles_drift(app, db, make_user, make_problem):
+    student = make_user('student')
+    for urgency in (1, 2, 3):
+        make_problem(student, urgency=urgency)
+    expected = stored_counters(db)
+
+    db.session.query(ProblemCounter).filter_by(dimension='total').update({'count': 42})
+    db.session.query(ProblemCounter).filter_by(dimension='urgency', value='3').delete()
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['counters', 'rebuild'])
+    assert result.exit_code == 0, result.output
+    assert '4 corrected' in result.output
+    assert stored_counters(db) == expected
+    assert rebuild_counters() == (len(expected), 0)
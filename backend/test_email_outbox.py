@@ -0,0 +1,139 @@
+"""
+Tests en processus de l'outbox email, contre un serveur SMTP local de débogage
+"""
+
+import socketserver
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import EmailOutbox
+from services.email_outbox import email_outbox, enqueue_email, queue_stats
+
+
+class _SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: accepts everything except ``sink.reject``"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        sink = self.server.sink
+        sink.connections += 1
+        self.reply('220 sink ready')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 sink')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip('<> ')
+                if address in sink.reject:
+                    self.reply('550 Mailbox unavailable')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                sink.messages.extend(recipients)
+                self.reply('250 OK')
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+@pytest.fixture
+def smtp_sink(app):
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SMTPSinkHandler)
+    server.daemon_threads = True
+    server.sink = sink = type('Sink', (), {})()
+    sink.connections, sink.messages, sink.reject = 0, [], set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    state = app.extensions['mail']
+    state.server, state.port = server.server_address
+    state.use_tls = state.use_ssl = False
+    state.username = state.password = None
+    state.default_sender = 'easyreport@example.com'
+    state.suppress = False
+    yield sink
+    server.shutdown()
+    server.server_close()
+
+
+def test_request_only_queues_and_worker_sends_one_connection_per_batch(
+        client, db, make_user, auth_headers, smtp_sink):
+    admins = [make_user('admin') for _ in range(3)]
+    student = make_user('student')
+
+    response = client.post('/api/problems/', headers=auth_headers(student), json={
+        'promotion': 'B3', 'room': 'B204', 'category': 'Chauffage', 'type_of_problem': 'Radiateur',
+        'description': 'Le radiateur reste froid', 'urgency': 3, 'remark': 'RAS'
+    })
+    assert response.status_code == 201, response.get_json()
+    assert smtp_sink.connections == 0
+    assert queue_stats()['pending'] == 3
+
+    assert email_outbox.drain() == (3, 0)
+    assert smtp_sink.connections == 1
+    assert sorted(smtp_sink.messages) == sorted(admin.email for admin in admins)
+    stats = queue_stats()
+    assert (stats['pending'], stats['sent'], stats['oldest_pending_seconds']) == (0, 3, 0)
+
+
+def test_rolled_back_transaction_sends_nothing(db, smtp_sink):
+    enqueue_email('student@example.com', 'Sujet', 'Corps')
+    db.session.rollback()
+    assert email_outbox.drain() == (0, 0)
+    assert db.session.query(EmailOutbox).count() == 0
+
+
+def test_failures_are_retried_with_backoff_then_given_up(app, db, smtp_sink):
+    app.config['EMAIL_OUTBOX_MAX_ATTEMPTS'] = 2
+    smtp_sink.reject.add('bounce@example.com')
+    enqueue_email('bounce@example.com', 'Sujet', 'Corps')
+    enqueue_email('ok@example.com', 'Sujet', 'Corps')
+    db.session.commit()
+
+    assert email_outbox.drain() == (1, 1)
+    assert smtp_sink.messages == ['ok@example.com']
+    bounced = db.session.query(EmailOutbox).filter_by(recipient='bounce@example.com').one()
+    assert (bounced.status, bounced.attempts) == ('pending', 1)
+    delay = (bounced.next_attempt_at - datetime.utcnow()).total_seconds()
+    assert 25 < delay <= 30
+    assert 'Mailbox unavailable' in bounced.last_error
+
+    # Not due yet: nothing happens until the backoff has elapsed
+    assert email_outbox.drain() == (0, 0)
+    bounced.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert email_outbox.drain() == (0, 1)
+    db.session.refresh(bounced)
+    assert (bounced.status, bounced.attempts) == ('failed', 2)
+    assert queue_stats()['failed'] == 1
+
+
+def test_unreachable_server_keeps_emails_queued(app, db, client, make_user, auth_headers, smtp_sink):
+    app.extensions['mail'].port = 1  # nothing listens there
+    enqueue_email('student@example.com', 'Sujet', 'Corps')
+    db.session.commit()
+
+    assert email_outbox.drain() == (0, 1)
+    health = client.get('/api/admin/system/health', headers=auth_headers(make_user('admin'))).get_json()
+    assert health['email_outbox']['pending'] == 1
+    assert health['email_outbox']['oldest_pending_seconds'] >= 0
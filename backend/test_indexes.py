@@ -0,0 +1,105 @@
+"""
+Vérifie que les requêtes chaudes utilisent leurs index (EXPLAIN QUERY PLAN)
+"""
+
+import os
+
+import pytest
+from flask_migrate import upgrade
+from sqlalchemy import desc, inspect
+
+from app import create_app
+from extensions import db as _db
+from models import Problem, ProblemLike, Comment, ProblemHistory, Notification, User, Analytics
+from services.notifications import inbox_query, unread_clause
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+
+
+def query_plan(db, query):
+    sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}').all()
+    return ' | '.join(row[-1] for row in rows)
+
+
+HOT_QUERIES = [
+    # routes/problems.py
+    ('student problem list', 'ix_problems_user_id_created_at',
+     lambda db: db.session.query(Problem).filter(Problem.user_id == 1)
+     .order_by(desc(Problem.created_at)).limit(20)),
+    ('problem list, default sort', 'ix_problems_created_at',
+     lambda db: db.session.query(Problem).order_by(desc(Problem.created_at)).limit(20)),
+    ('problem list by status', 'ix_problems_state_created_at',
+     lambda db: db.session.query(Problem).filter(Problem.state == 'Soumis')
+     .order_by(desc(Problem.created_at)).limit(20)),
+    ('problem list by category', 'ix_problems_category_created_at',
+     lambda db: db.session.query(Problem).filter(Problem.category == 'Informatique')
+     .order_by(desc(Problem.created_at)).limit(20)),
+    ('problem list by urgency', 'ix_problems_urgency_created_at',
+     lambda db: db.session.query(Problem).filter(Problem.urgency == 3)
+     .order_by(desc(Problem.created_at)).limit(20)),
+    ('problem list sorted by priority', 'ix_problems_priority_score',
+     lambda db: db.session.query(Problem).order_by(desc(Problem.priority_score)).limit(20)),
+    ('problem list sorted by likes', 'ix_problems_likes_count',
+     lambda db: db.session.query(Problem).order_by(desc(Problem.likes_count)).limit(20)),
+    # SQLite backs UNIQUE constraints with an anonymous autoindex
+    ('is_liked batch', 'sqlite_autoindex_problem_likes_1',
+     lambda db: db.session.query(ProblemLike.problem_id)
+     .filter(ProblemLike.user_id == 1, ProblemLike.problem_id.in_([1, 2, 3]))),
+    ('problem comments', 'ix_comments_problem_id_created_at',
+     lambda db: db.session.query(Comment).filter_by(problem_id=1).order_by(Comment.created_at)),
+    ('problem history', 'ix_problem_history_problem_id_created_at',
+     lambda db: db.session.query(ProblemHistory).filter_by(problem_id=1)
+     .order_by(desc(ProblemHistory.created_at))),
+    # routes/notifications.py
+    ('notification list', 'ix_notifications_user_id_created_at',
+     lambda db: db.session.query(Notification).filter_by(user_id=1)
+     .order_by(desc(Notification.created_at)).limit(20)),
+    ('unread notification list', 'ix_notifications_user_id_is_read_created_at',
+     lambda db: db.session.query(Notification).filter_by(user_id=1, is_read=False)
+     .order_by(desc(Notification.created_at)).limit(20)),
+    ('unread count', 'ix_notifications_user_id_is_read_created_at',
+     lambda db: db.session.query(Notification.id).filter_by(user_id=1, is_read=False)),
+    ('unread count with broadcasts', 'ix_notifications_user_id_is_read_created_at',
+     lambda db: inbox_query(1).filter(unread_clause())),
+    # services/analytics.py
+    ('analytics window rollups', 'ix_analytics_date',
+     lambda db: db.session.query(Analytics).filter(Analytics.date >= '2026-01-01').order_by(Analytics.date)),
+    ('analytics live resolved', 'ix_problems_resolved_at',
+     lambda db: db.session.query(Problem.id).filter(Problem.resolved_at >= '2026-01-01')),
+    ('analytics live resolution times', 'ix_problems_state_resolved_at',
+     lambda db: db.session.query(Problem.id).filter(
+         Problem.state == 'Problème traité', Problem.resolved_at >= '2026-01-01')),
+    ('analytics live active users', 'ix_users_last_login',
+     lambda db: db.session.query(User.id).filter(User.last_login >= '2026-01-01')),
+]
+
+
+@pytest.mark.parametrize('label, index, build', HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+def test_hot_query_uses_index(db, label, index, build):
+    plan = query_plan(db, build(db))
+    assert index in plan, f'{label}: {plan}'
+    assert 'USE TEMP B-TREE' not in plan, f'{label} sorts in memory: {plan}'
+
+
+def test_migrations_create_indexes(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        'config.TestingConfig.SQLALCHEMY_DATABASE_URI',
+        f"sqlite:///{tmp_path / 'migrated.sqlite3'}"
+    )
+    app = create_app('testing')
+    with app.app_context():
+        upgrade(directory=MIGRATIONS_DIR)
+        inspector = inspect(_db.engine)
+        indexed = {
+            index['name']
+            for table in ('problems', 'problem_likes', 'comments', 'problem_history', 'notifications',
+                          'users', 'analytics')
+            for index in inspector.get_indexes(table)
+        }
+        unique = {c['name'] for c in inspector.get_unique_constraints('problem_likes')}
+        _db.engine.dispose()
+
+    expected = {name for _, name, _ in HOT_QUERIES if name.startswith('ix_')}
+    assert expected <= indexed
+    assert 'uq_problem_likes_user_id_problem_id' in unique
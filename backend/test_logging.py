@@ -0,0 +1,50 @@
+"""
+Tests en processus de la journalisation JSON asynchrone
+"""
+
+import json
+import logging
+import queue
+
+from services.structured_logging import NonBlockingQueueHandler, configure_logging, sampled, stop_logging
+
+
+def test_records_are_json_with_request_fields(app, client, make_user, auth_headers, tmp_path):
+    log_file = tmp_path / 'app.log'
+    configure_logging(dict(app.config, LOG_FILE=str(log_file), LOG_LEVEL='DEBUG'))
+    logger = logging.getLogger('test_logging')
+
+    response = client.get('/api/notifications/unread-count', headers=dict(
+        auth_headers(make_user('student')), **{'X-Request-ID': 'abc-123'}
+    ))
+    assert response.headers['X-Request-ID'] == 'abc-123'
+    generated = client.get('/', headers={'X-Request-ID': 'bad id {"forged": 1}'}).headers['X-Request-ID']
+    assert len(generated) == 32
+    with app.test_request_context('/api/problems/1/like', method='OPTIONS'):
+        logger.debug("kept", extra=sampled(1))
+        logger.debug("dropped", extra=sampled(0))
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("failed")
+    stop_logging()
+
+    records = [json.loads(line) for line in log_file.read_text().splitlines()]
+    requests = [r for r in records if r['message'] == 'request']
+    assert requests[0]['request_id'] == 'abc-123' and requests[0]['status'] == 200
+    assert requests[0]['path'] == '/api/notifications/unread-count' and requests[0]['duration_ms'] > 0
+    assert requests[1]['request_id'] == generated
+
+    [kept] = [r for r in records if r['message'] == 'kept']
+    assert kept['sample_rate'] == 1 and kept['method'] == 'OPTIONS' and 'timestamp' in kept
+    assert not [r for r in records if r['message'] == 'dropped']
+    [failed] = [r for r in records if r['message'] == 'failed']
+    assert failed['levelname'] == 'ERROR' and 'ValueError: boom' in failed['exc_info']
+
+
+def test_a_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    for message in ('first', 'second'):
+        handler.handle(logging.makeLogRecord({'msg': message, 'levelno': logging.INFO}))
+    assert handler.dropped == 1
+    assert handler.queue.get_nowait().message == 'first'
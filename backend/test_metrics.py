@@ -0,0 +1,92 @@
+"""
+Tests en processus des métriques Prometheus
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+
+from app import create_app
+from config import TestingConfig
+from services.email_outbox import enqueue_email
+from services.metrics import render_metrics
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+
+
+def samples(text):
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(text)
+        for sample in family.samples
+    }
+
+
+def scrape(client, headers=None):
+    response = client.get('/metrics', headers=headers or {})
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    return samples(response.get_data(as_text=True))
+
+
+def test_requests_sql_cache_and_outbox_are_exposed(app, client, db, make_user, make_problem, auth_headers):
+    student = make_user('student')
+    make_problem(student)
+    headers = auth_headers(student)
+    enqueue_email('a@example.com', 'Sujet', 'Corps')
+    db.session.commit()
+    before = scrape(client)
+
+    for _ in range(2):
+        assert client.get('/api/problems/', headers=headers).status_code == 200
+    assert client.get('/nowhere').status_code == 404
+    after = scrape(client)
+
+    def delta(name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        return after.get(key, 0) - before.get(key, 0)
+
+    endpoint = dict(endpoint='problems.get_problems')
+    assert delta('http_request_duration_seconds_count', method='GET', **endpoint) == 2
+    assert delta('http_requests_total', method='GET', status='200', **endpoint) == 2
+    assert delta('http_requests_total', endpoint='unmatched', method='GET', status='404') == 1
+    # The cache miss ran the listing queries, the hit only checked the tag versions
+    assert delta('http_request_sql_statements_count', **endpoint) == 2
+    assert delta('http_request_sql_statements_sum', **endpoint) >= 2
+    assert delta('http_request_sql_statements_bucket', le='0.0', **endpoint) == 1
+    assert delta('cache_requests_total', cache='response', result='miss') == 1
+    assert delta('cache_requests_total', cache='response', result='hit') == 1
+    assert after[('email_outbox_emails', (('status', 'pending'),))] == 1
+
+    app.config['METRICS_TOKEN'] = 'secret'
+    assert client.get('/metrics').status_code == 401
+    assert scrape(client, {'Authorization': 'Bearer secret'})
+
+
+def test_workers_are_merged_at_scrape_time(tmp_path):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    worker = ("from services.metrics import REQUESTS; "
+              "REQUESTS.labels('problems.get_problems', 'GET', '200').inc(3)")
+    for _ in range(2):
+        subprocess.run([sys.executable, '-c', worker], cwd=BACKEND, env=env, check=True)
+
+    merged = samples(render_metrics(str(tmp_path)).decode())
+    key = ('http_requests_total', (('endpoint', 'problems.get_problems'), ('method', 'GET'), ('status', '200')))
+    assert merged[key] == 6
+
+
+def test_endpoint_needs_a_token_when_required(monkeypatch):
+    monkeypatch.setattr(TestingConfig, 'METRICS_REQUIRE_TOKEN', True, raising=False)
+    assert 'metrics' not in create_app('testing').view_functions
+    monkeypatch.setattr(TestingConfig, 'METRICS_TOKEN', 'secret', raising=False)
+    assert 'metrics' in create_app('testing').view_functions
+
+
+def test_failed_statements_leave_no_timing_behind(db):
+    with db.engine.connect() as connection:
+        with pytest.raises(Exception):
+            connection.exec_driver_sql('SELECT * FROM missing_table')
+        connection.exec_driver_sql('SELECT 1')
+        assert not [key for key in connection.info if key.endswith('_started')]
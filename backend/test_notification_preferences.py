@@ -0,0 +1,103 @@
+"""
+Tests en processus des préférences de notification
+"""
+
+from models import EmailOutbox, Notification, NotificationPreference, User
+from services.notifications import count_unread, unread_count
+from services.unread_counters import compute_unread
+
+
+def settings(client, headers, **changes):
+    if changes:
+        response = client.put('/api/notifications/settings', headers=headers, json=changes)
+    else:
+        response = client.get('/api/notifications/settings', headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['settings']
+
+
+def test_settings_are_stored_partially_and_cached(client, db, make_user, auth_headers, count_queries):
+    student = make_user('student')
+    headers = auth_headers(student)
+    assert all(settings(client, headers).values())
+
+    updated = settings(client, headers, comments=False, email_notifications=False)
+    assert updated == dict(settings(client, headers), comments=False, email_notifications=False)
+    assert not updated['comments'] and updated['problem_updates']
+    # A single compact row
+    assert db.session.get(NotificationPreference, student.id).disabled == 0b01001
+
+    # Omitted settings keep their value; the cache is invalidated on commit
+    assert settings(client, headers, comments=True) == dict(updated, comments=True)
+    assert settings(client, headers) == dict(updated, comments=True)
+    with count_queries() as queries:
+        assert settings(client, headers) == dict(updated, comments=True)
+    assert not any('notification_preferences' in statement for statement in queries)
+
+    response = client.put('/api/notifications/settings', headers=headers, json={'comments': 'maybe'})
+    assert response.status_code == 400
+
+
+def test_opted_out_users_get_no_rows_or_emails(client, db, make_user, make_problem, auth_headers):
+    admin, quiet_admin = make_user('admin'), make_user('admin')
+    student, other = make_user('student'), make_user('student')
+    headers, admin_headers = auth_headers(student), auth_headers(admin)
+    settings(client, headers, comments=False, email_notifications=False)
+    settings(client, auth_headers(quiet_admin), email_notifications=False)
+    settings(client, auth_headers(other), system_notifications=False)
+    problem = make_problem(student)
+
+    def notifications(user):
+        return [n.type for n in db.session.query(Notification).filter_by(user_id=user.id)]
+
+    def emails(user):
+        return db.session.query(EmailOutbox).filter_by(recipient=user.email).count()
+
+    client.post(f'/api/problems/{problem.id}/comments', headers=admin_headers, json={'content': 'Vu'})
+    client.put(f'/api/problems/{problem.id}', headers=admin_headers, json={'state': 'En cours de traitement'})
+    assert notifications(student) == ['problem_update']
+    assert emails(student) == 0
+
+    settings(client, headers, problem_updates=False)
+    client.post('/api/admin/problems/bulk-update', headers=admin_headers, json={
+        'problem_ids': [problem.id], 'action': 'change_status', 'new_status': 'Problème traité'
+    })
+    assert notifications(student) == ['problem_update']
+
+    # New problem: every admin sees the broadcast, only one gets the email
+    response = client.post('/api/problems/', headers=auth_headers(other), json={
+        'promotion': 'B3', 'room': 'B204', 'category': 'Chauffage', 'type_of_problem': 'Radiateur',
+        'description': 'Le radiateur reste froid', 'urgency': 3, 'remark': 'RAS'
+    })
+    assert response.status_code == 201, response.get_json()
+    assert (emails(admin), emails(quiet_admin)) == (1, 0)
+
+    # Direct system notifications skip the opted-out user; broadcasts are dismissed for them
+    created = client.post('/api/admin/notifications', headers=admin_headers, json={
+        'title': 'Direct', 'message': 'm', 'user_ids': [student.id, other.id]
+    }).get_json()['notifications_created']
+    assert created == 1 and notifications(other) == []
+    created = client.post('/api/admin/notifications', headers=admin_headers, json={
+        'title': 'Maintenance', 'message': 'm', 'broadcast': True
+    }).get_json()['notifications_created']
+    assert created == 3
+
+    def titles(user):
+        body = client.get('/api/notifications/', headers=auth_headers(user)).get_json()
+        return [n['title'] for n in body['notifications']]
+
+    assert 'Maintenance' in titles(student) and 'Maintenance' not in titles(other)
+    stored = {uid: (unread, seen) for uid, unread, seen in
+              db.session.query(User.id, User.unread_notifications, User.broadcasts_seen)}
+    assert stored == compute_unread()
+    for user in (admin, quiet_admin, student, other):
+        assert unread_count(user.id) == count_unread(user.id), user
+
+
+def test_per_process_cache_bounds_staleness(app):
+    from services.notification_preferences import _cache_timeout
+
+    # SimpleCache under tests: other workers would never see the invalidation
+    assert _cache_timeout() == app.config['NOTIFICATION_PREFERENCES_LOCAL_CACHE_TIMEOUT'] == 5
+    app.config['CACHE_TYPE'] = 'FileSystemCache'
+    assert _cache_timeout() == app.config['NOTIFICATION_PREFERENCES_CACHE_TIMEOUT']
@@ -0,0 +1,141 @@
+"""
+Tests en processus du flux SSE des notifications
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from models import Notification
+from services.notification_stream import notification_event
+
+
+class EventReader(object):
+    """Parses the Server-Sent Events of a streamed test response"""
+
+    def __init__(self, response):
+        self.response = response
+        self.chunks = iter(response.response)
+        self.buffer = ''
+
+    def next_block(self):
+        while '\n\n' not in self.buffer:
+            chunk = next(self.chunks)
+            self.buffer += chunk.decode() if isinstance(chunk, bytes) else chunk
+        block, self.buffer = self.buffer.split('\n\n', 1)
+        return block
+
+    def next_event(self):
+        """Next event, skipping retry hints and heartbeats"""
+        for _ in range(200):
+            fields = {}
+            for line in self.next_block().split('\n'):
+                name, _, value = line.partition(':')
+                fields[name] = value.strip()
+            if 'event' in fields:
+                return fields['event'], json.loads(fields['data']), fields.get('id')
+        raise AssertionError('no event received')
+
+    def next_heartbeat(self):
+        return self.next_block() == ': heartbeat'
+
+    def close(self):
+        self.response.close()
+
+
+@pytest.fixture
+def open_stream(app, client, auth_headers):
+    app.config['NOTIFICATION_STREAM_HEARTBEAT'] = 0.05
+    readers = []
+
+    def _open_stream(user, headers=None):
+        token = auth_headers(user)['Authorization'].split()[1]
+        response = client.get(f'/api/notifications/stream?jwt={token}',
+                              headers=headers or {}, buffered=False)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        reader = EventReader(response)
+        readers.append(reader)
+        return reader
+
+    yield _open_stream
+    for reader in readers:
+        reader.close()
+
+
+def send(client, admin_headers, **payload):
+    response = client.post('/api/admin/notifications', headers=admin_headers,
+                           json=dict({'message': 'm'}, **payload))
+    assert response.status_code == 201, response.get_json()
+
+
+def test_stream_pushes_notifications_and_unread_changes(client, db, make_user, auth_headers, open_stream):
+    admin, student = make_user('admin'), make_user('student')
+    db.session.add(Notification(user_id=student.id, title='Ancienne', message='m', type='system'))
+    db.session.commit()
+    admin_headers, student_headers = auth_headers(admin), auth_headers(student)
+
+    stream = open_stream(student)
+    assert stream.next_event() == ('unread', {'unread_count': 1}, None)
+
+    send(client, admin_headers, title='Direct', user_ids=[student.id])
+    kind, data, direct_id = stream.next_event()
+    assert (kind, data['notification']['title'], data['unread_delta']) == ('notification', 'Direct', 1)
+    assert data['notification']['id'] == int(direct_id)
+
+    send(client, admin_headers, title='Pour tous', broadcast=True)
+    send(client, admin_headers, title='Autre', user_ids=[admin.id])
+    kind, data, broadcast_id = stream.next_event()
+    assert (kind, data['notification']['title']) == ('notification', 'Pour tous')
+
+    client.post(f'/api/notifications/{direct_id}/read', headers=student_headers)
+    assert stream.next_event() == ('unread', {'delta': -1}, None)
+    client.post('/api/notifications/read-all', headers=student_headers)
+    assert stream.next_event() == ('unread', {'unread_count': 0}, None)
+    assert stream.next_heartbeat()
+    stream.close()
+
+    # Reconnection replays what came after Last-Event-ID, already counted
+    resumed = open_stream(student, headers={'Last-Event-ID': direct_id})
+    assert resumed.next_event() == ('unread', {'unread_count': 0}, None)
+    kind, data, event_id = resumed.next_event()
+    assert (event_id, data['notification']['is_read'], data['unread_delta']) == (broadcast_id, True, 0)
+
+    assert client.get('/api/notifications/stream').status_code == 401
+
+
+def test_events_cross_processes_through_the_socket_directory(app, client, db, make_user, open_stream, tmp_path):
+    directory = app.config['NOTIFICATION_STREAM_DIR'] = str(tmp_path)
+    stale = os.path.join(directory, 'stale.sock')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as dead:
+        dead.bind(stale)
+
+    student = make_user('student')
+    stream = open_stream(student)
+    assert stream.next_event()[0] == 'unread'
+
+    # Another worker commits a notification: it only shares the directory
+    event = notification_event(Notification(
+        id=10 ** 6, user_id=student.id, title='Autre worker', message='m', type='system',
+        created_at=student.created_at
+    ))
+    backend = os.path.dirname(os.path.abspath(__file__))
+    subprocess.run([
+        sys.executable, '-c',
+        'import json, sys; from services.notification_stream import send_datagrams; '
+        'send_datagrams(sys.argv[1], [json.loads(sys.argv[2])])',
+        directory, json.dumps(event)
+    ], cwd=backend, check=True, capture_output=True)
+
+    kind, data, event_id = stream.next_event()
+    assert (kind, event_id, data['notification']['title']) == ('notification', str(10 ** 6), 'Autre worker')
+    assert not os.path.exists(stale)
+
+    # Commits in this process go through the socket too
+    db.session.add(Notification(user_id=student.id, title='Local', message='m', type='system'))
+    db.session.commit()
+    assert stream.next_event()[1]['notification']['title'] == 'Local'
@@ -0,0 +1,89 @@
+"""
+Tests en processus des notifications diffusées (fan-out à la lecture)
+"""
+
+from datetime import datetime, timedelta
+
+from models import Notification, NotificationReceipt
+
+
+def inbox(client, headers, query=''):
+    body = client.get(f'/api/notifications/{query}', headers=headers).get_json()
+    return [(n['title'], n['is_read']) for n in body['notifications']]
+
+
+def unread(client, headers):
+    return client.get('/api/notifications/unread-count', headers=headers).get_json()['unread_count']
+
+
+def test_broadcast_is_stored_once_and_merged_per_user(client, db, make_user, auth_headers):
+    admin = make_user('admin')
+    students = [make_user('student') for _ in range(20)]
+    db.session.add(Notification(user_id=students[0].id, title='Perso', message='m', type='comment',
+                                created_at=datetime.utcnow() - timedelta(minutes=1)))
+    db.session.commit()
+
+    response = client.post('/api/admin/notifications', headers=auth_headers(admin),
+                           json={'title': 'Maintenance', 'message': 'Coupure ce soir', 'broadcast': True})
+    assert response.status_code == 201, response.get_json()
+    assert response.get_json()['notifications_created'] == 21
+    assert db.session.query(Notification).filter_by(title='Maintenance').count() == 1
+
+    first, second = auth_headers(students[0]), auth_headers(students[1])
+    assert inbox(client, first) == [('Maintenance', False), ('Perso', False)]
+    assert unread(client, first) == 2
+
+    broadcast_id = db.session.query(Notification.id).filter_by(title='Maintenance').scalar()
+    assert client.post(f'/api/notifications/{broadcast_id}/read', headers=first).status_code == 200
+    assert inbox(client, first) == [('Maintenance', True), ('Perso', False)]
+    assert inbox(client, first, '?unread_only=true') == [('Perso', False)]
+    assert inbox(client, second) == [('Maintenance', False)]
+
+    assert client.delete(f'/api/notifications/{broadcast_id}', headers=second).status_code == 200
+    assert inbox(client, second) == []
+    assert client.post(f'/api/notifications/{broadcast_id}/read', headers=second).status_code == 404
+    assert inbox(client, auth_headers(students[2])) == [('Maintenance', False)]
+
+    # Accounts created after the broadcast never received it
+    assert inbox(client, auth_headers(make_user('student'))) == []
+
+
+def test_read_all_and_clear_all_cover_broadcasts(client, db, make_user, auth_headers):
+    admin = make_user('admin')
+    student, other = make_user('student'), make_user('student')
+    headers = auth_headers(admin)
+    for title in ('B1', 'B2', 'B3'):
+        client.post('/api/admin/notifications', headers=headers,
+                    json={'title': title, 'message': 'm', 'broadcast': True})
+    client.post('/api/admin/notifications', headers=headers,
+                json={'title': 'Direct', 'message': 'm', 'user_ids': [student.id]})
+    mine = auth_headers(student)
+    b1 = db.session.query(Notification.id).filter_by(title='B1').scalar()
+    client.post(f'/api/notifications/{b1}/read', headers=mine)
+
+    body = client.post('/api/notifications/read-all', headers=mine).get_json()
+    assert body['updated_count'] == 3
+    assert unread(client, mine) == 0
+    assert unread(client, auth_headers(other)) == 3
+
+    body = client.delete('/api/notifications/clear-all', headers=mine).get_json()
+    assert body['deleted_count'] == 4
+    assert inbox(client, mine) == []
+    assert inbox(client, auth_headers(other)) == [('B3', False), ('B2', False), ('B1', False)]
+    assert db.session.query(Notification).filter(Notification.user_id.is_(None)).count() == 3
+    assert db.session.query(NotificationReceipt).filter_by(user_id=student.id).count() == 3
+
+
+def test_new_problem_notifies_admins_with_one_row(client, db, make_user, auth_headers):
+    admins = [make_user('admin') for _ in range(3)]
+    student = make_user('student')
+    response = client.post('/api/problems/', headers=auth_headers(student), json={
+        'promotion': 'B3', 'room': 'B204', 'category': 'Chauffage', 'type_of_problem': 'Radiateur',
+        'description': 'Le radiateur reste froid', 'urgency': 3, 'remark': 'RAS'
+    })
+    assert response.status_code == 201, response.get_json()
+
+    assert db.session.query(Notification).filter_by(title='New Problem Submitted').count() == 1
+    for admin in admins:
+        assert inbox(client, auth_headers(admin)) == [('New Problem Submitted', False)]
+    assert inbox(client, auth_headers(student)) == []
@@ -0,0 +1,90 @@
+"""
+Tests de la pagination par curseur (keyset)
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import Notification
+
+BASE_TIME = datetime(2026, 1, 1)
+
+
+def _walk(client, url, headers, key, per_page=4):
+    """Follow next_cursor until exhaustion and return every id served"""
+    ids, cursor, pages = [], '', 0
+    while cursor is not None:
+        separator = '&' if '?' in url else '?'
+        response = client.get(f'{url}{separator}per_page={per_page}&cursor={cursor}', headers=headers)
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        ids.extend(item['id'] for item in body[key])
+        cursor = body['pagination']['next_cursor']
+        pages += 1
+        assert pages <= 50, 'next_cursor does not advance'
+    return ids, pages
+
+
+@pytest.fixture
+def seeded(db, make_user, make_problem):
+    admin = make_user('admin')
+    students = [make_user('student', last_login=BASE_TIME if i % 2 else None) for i in range(5)]
+    for i in range(11):
+        # Deliberate ties on every sort key to exercise the id tie-breaker
+        make_problem(
+            students[i % 5], commit=False,
+            urgency=1 + i % 3, likes_count=i % 4, priority_score=(i % 2) * 10,
+            created_at=BASE_TIME + timedelta(hours=i // 2)
+        )
+        db.session.add(Notification(
+            user_id=admin.id, title=f'N{i}', message='m', type='system',
+            is_read=bool(i % 3), created_at=BASE_TIME + timedelta(minutes=i // 3)
+        ))
+    db.session.commit()
+    return admin
+
+
+@pytest.mark.parametrize('url', ['/api/problems/', '/api/problems/all'])
+@pytest.mark.parametrize('sort_by', ['created_at', 'priority', 'urgency', 'likes'])
+def test_problem_cursor_matches_offset_order(client, auth_headers, seeded, url, sort_by):
+    headers = auth_headers(seeded)
+    expected = [p['id'] for p in client.get(f'{url}?sort_by={sort_by}&per_page=100', headers=headers).get_json()['problems']]
+    ids, pages = _walk(client, f'{url}?sort_by={sort_by}', headers, 'problems')
+    assert ids == expected and len(ids) == 11
+    assert pages == 3
+
+
+def test_notification_cursor(client, auth_headers, seeded):
+    headers = auth_headers(seeded)
+    expected = [n['id'] for n in client.get('/api/notifications/?per_page=100', headers=headers).get_json()['notifications']]
+    assert _walk(client, '/api/notifications/', headers, 'notifications')[0] == expected
+    unread = _walk(client, '/api/notifications/?unread_only=true', headers, 'notifications', per_page=2)[0]
+    assert len(unread) == 4
+
+
+@pytest.mark.parametrize('sort_by', ['created_at', 'name', 'email', 'last_login'])
+def test_admin_user_cursor(client, auth_headers, seeded, sort_by):
+    headers = auth_headers(seeded)
+    expected = [u['id'] for u in client.get(f'/api/admin/users?sort_by={sort_by}&per_page=100', headers=headers).get_json()['users']]
+    ids, _ = _walk(client, f'/api/admin/users?sort_by={sort_by}', headers, 'users', per_page=2)
+    assert ids == expected and len(ids) == 6
+
+
+def test_cursor_skips_count_unless_requested(client, auth_headers, seeded, count_queries):
+    headers = auth_headers(seeded)
+    with count_queries() as statements:
+        body = client.get('/api/notifications/?cursor=', headers=headers).get_json()
+    assert 'total' not in body['pagination']
+    assert not any('count(' in s.lower() for s in statements)
+
+    body = client.get('/api/notifications/?cursor=&include_total=true', headers=headers).get_json()
+    assert body['pagination']['total'] == 11
+
+
+def test_invalid_cursor(client, auth_headers, seeded):
+    headers = auth_headers(seeded)
+    assert client.get('/api/problems/all?cursor=garbage', headers=headers).status_code == 400
+    first = client.get('/api/problems/all?cursor=&per_page=2', headers=headers).get_json()
+    cursor = first['pagination']['next_cursor']
+    assert client.get(f'/api/problems/all?cursor={cursor}&sort_by=likes', headers=headers).status_code == 400
@@ -0,0 +1,198 @@
+"""
+Tests en processus des endpoints /api/problems
+"""
+
+from flask import Flask
+
+from models import ProblemLike
+from services.response_cache import check_cache_backend
+
+
+def _seed_problems(db, make_user, make_problem, count):
+    problems = []
+    for i in range(count):
+        student = make_user('student')
+        problems.append(make_problem(student, commit=False, room=f'B{i}'))
+    db.session.commit()
+    return problems
+
+
+def test_list_query_count_is_constant(client, db, make_user, make_problem, auth_headers, count_queries):
+    admin = make_user('admin')
+    problems = _seed_problems(db, make_user, make_problem, 30)
+    for problem in problems[::3]:
+        db.session.add(ProblemLike(user_id=admin.id, problem_id=problem.id))
+    db.session.commit()
+    headers = auth_headers(admin)
+
+    for url in ('/api/problems/', '/api/problems/all'):
+        counts = []
+        for per_page in (5, 30):
+            with count_queries() as statements:
+                response = client.get(f'{url}?per_page={per_page}', headers=headers)
+            assert response.status_code == 200
+            assert len(response.get_json()['problems']) == per_page
+            counts.append(len(statements))
+        assert counts[0] == counts[1], f'{url} issued {counts} statements'
+
+
+def test_list_resolves_likes_and_owner(client, db, make_user, make_problem, auth_headers):
+    admin = make_user('admin')
+    problems = _seed_problems(db, make_user, make_problem, 4)
+    liked = {problems[0].id, problems[2].id}
+    for problem_id in liked:
+        db.session.add(ProblemLike(user_id=admin.id, problem_id=problem_id))
+    db.session.commit()
+
+    response = client.get('/api/problems/all', headers=auth_headers(admin))
+    data = response.get_json()['problems']
+    assert {p['id'] for p in data if p['is_liked']} == liked
+    assert all(p['user']['name'].startswith('Student') for p in data)
+
+
+def test_cache_is_keyed_on_identity(client, make_user, make_problem, auth_headers):
+    alice, bob = make_user('student'), make_user('student')
+    make_problem(alice)
+
+    assert client.get('/api/problems/stats', headers=auth_headers(alice)).get_json()['total_problems'] == 1
+    assert client.get('/api/problems/stats', headers=auth_headers(bob)).get_json()['total_problems'] == 0
+    assert len(client.get('/api/problems/', headers=auth_headers(bob)).get_json()['problems']) == 0
+
+
+def test_cache_hit_skips_database(client, make_user, make_problem, auth_headers, count_queries):
+    admin = make_user('admin')
+    make_problem(make_user('student'))
+    headers = auth_headers(admin)
+
+    first = client.get('/api/problems/all?per_page=10&category=', headers=headers)
+    with count_queries() as statements:
+        second = client.get('/api/problems/all?category=&per_page=10', headers=headers)
+    assert statements == []
+    assert second.get_json() == first.get_json()
+
+
+def test_writes_invalidate_affected_entries(client, make_user, make_problem, auth_headers):
+    admin, student = make_user('admin'), make_user('student')
+    problem = make_problem(student)
+    headers = auth_headers(admin)
+
+    assert client.get('/api/problems/all', headers=headers).get_json()['problems'][0]['is_liked'] is False
+    assert client.post(f'/api/problems/{problem.id}/like', headers=headers).status_code == 200
+    listed = client.get('/api/problems/all', headers=headers).get_json()['problems'][0]
+    assert listed['is_liked'] is True and listed['likes_count'] == 1
+
+    assert client.get('/api/problems/stats', headers=headers).get_json()['pending'] == 1
+    response = client.put(f'/api/problems/{problem.id}', headers=headers, json={'state': 'En cours de traitement'})
+    assert response.status_code == 200
+    stats = client.get('/api/problems/stats', headers=headers).get_json()
+    assert stats['pending'] == 0 and stats['in_progress'] == 1
+
+
+def test_write_during_view_is_not_cached(client, make_user, make_problem, auth_headers, count_queries, monkeypatch):
+    import routes.problems
+    from services.response_cache import invalidate_tags
+
+    admin = make_user('admin')
+    problem = make_problem(make_user('student'))
+    headers = auth_headers(admin)
+    get_liked_problem_ids = routes.problems.get_liked_problem_ids
+
+    def like_lands_mid_view(user_id, problem_ids):
+        # A concurrent like commits after the page was read
+        invalidate_tags(f'problem:{problem.id}')
+        return get_liked_problem_ids(user_id, problem_ids)
+
+    monkeypatch.setattr(routes.problems, 'get_liked_problem_ids', like_lands_mid_view)
+    assert client.get('/api/problems/all', headers=headers).status_code == 200
+    monkeypatch.undo()
+
+    with count_queries() as statements:
+        assert client.get('/api/problems/all', headers=headers).status_code == 200
+    assert statements != []
+    with count_queries() as statements:
+        assert client.get('/api/problems/all', headers=headers).status_code == 200
+    assert statements == []
+
+
+def test_new_problem_invalidates_categories(client, make_user, make_problem, auth_headers):
+    student = make_user('student')
+    make_problem(student)
+    headers = auth_headers(student)
+
+    assert client.get('/api/problems/categories', headers=headers).get_json()['categories'] == [
+        {'name': 'Informatique', 'count': 1}
+    ]
+    response = client.post('/api/problems/', headers=headers, json={
+        'promotion': 'B3', 'room': 'B204', 'category': 'Chauffage', 'type_of_problem': 'Radiateur',
+        'description': 'Le radiateur reste froid', 'urgency': 3, 'remark': 'RAS'
+    })
+    assert response.status_code == 201, response.get_json()
+    categories = client.get('/api/problems/categories', headers=headers).get_json()['categories']
+    assert {c['name']: c['count'] for c in categories} == {'Informatique': 1, 'Chauffage': 1}
+
+
+def test_per_process_cache_backend_disables_response_cache():
+    for cache_type, enabled in (('SimpleCache', False), ('flask_caching.backends.NullCache', False),
+                                ('FileSystemCache', True), ('RedisCache', True)):
+        app = Flask(__name__)
+        app.config.update(CACHE_TYPE=cache_type, RESPONSE_CACHE_ENABLED=True)
+        check_cache_backend(app)
+        assert app.config['RESPONSE_CACHE_ENABLED'] is enabled
+
+
+def test_detail_read_is_buffered_then_flushed(app, client, db, make_user, make_problem, auth_headers, count_queries):
+    from services.view_counter import _live_buffers, view_counter
+
+    student = make_user('student')
+    problems = [make_problem(student, room=f'C{i}') for i in range(3)]
+    updated_at = problems[0].updated_at
+    headers = auth_headers(student)
+
+    with count_queries() as statements:
+        for _ in range(3):
+            response = client.get(f'/api/problems/{problems[0].id}', headers=headers)
+            assert response.status_code == 200
+        client.get(f'/api/problems/{problems[1].id}', headers=headers)
+    assert not any(s.lstrip().upper().startswith(('UPDATE', 'INSERT')) for s in statements)
+    assert response.get_json()['problem']['views_count'] == 3
+
+    with count_queries() as statements:
+        assert view_counter.flush() == 4
+    assert len(statements) == 1
+
+    db.session.expire_all()
+    assert [p.views_count for p in problems] == [3, 1, 0]
+    assert problems[0].updated_at == updated_at
+    assert view_counter.pending(problems[0].id) == 0
+    assert client.get('/api/problems/999', headers=headers).status_code == 404
+
+    # Stopped apps write their views now and are skipped by the exit flush
+    client.get(f'/api/problems/{problems[2].id}', headers=headers)
+    assert view_counter.stop() == 1
+    assert app.extensions['view_counter'] not in _live_buffers
+
+
+def test_stats_single_pass_and_scoped_to_student(client, db, make_user, make_problem, auth_headers, count_queries):
+    from datetime import datetime, timedelta
+
+    alice, bob = make_user('student'), make_user('student')
+    created = datetime.utcnow() - timedelta(days=1)
+    make_problem(alice, urgency=3, category='Chauffage', state='Problème traité',
+                 created_at=created, resolved_at=created + timedelta(hours=5))
+    make_problem(alice, urgency=3, category='Chauffage', state='Problème traité',
+                 created_at=created, resolved_at=created + timedelta(hours=7))
+    make_problem(alice, urgency=1, category='Réseau', state='En cours de traitement')
+    for _ in range(4):
+        make_problem(bob, urgency=2, category='Mobilier')
+
+    headers = auth_headers(alice)
+    with count_queries() as statements:
+        stats = client.get('/api/problems/stats', headers=headers).get_json()
+    assert len(statements) == 1
+    assert (stats['total_problems'], stats['resolved_problems'], stats['in_progress'], stats['pending']) == (3, 2, 1, 0)
+    assert stats['avg_resolution_time_hours'] == 6.0
+    assert stats['urgency_distribution'] == [{'urgency': 1, 'count': 1}, {'urgency': 3, 'count': 2}]
+    assert stats['top_categories'] == [{'category': 'Chauffage', 'count': 2}, {'category': 'Réseau', 'count': 1}]
+
+    admin_stats = client.get('/api/problems/stats', headers=auth_headers(make_user('admin'))).get_json()
+    assert admin_stats['total_problems'] == 7 and admin_stats['pending'] == 4
@@ -0,0 +1,58 @@
+"""
+Tests en processus du diagnostic des requêtes SQL (requêtes lentes, N+1)
+"""
+
+import pytest
+from flask import jsonify
+
+from models import Problem
+from services.query_diagnostics import statement_shape
+
+
+def test_statement_shapes_fold_in_lists():
+    assert statement_shape("SELECT *\n  FROM t WHERE id IN (?, ?,?) AND a = ?") == \
+        statement_shape("SELECT * FROM t WHERE id IN (?) AND a = ?")
+
+
+def test_slow_and_repeated_queries_are_reported(app, client, db, make_user, make_problem, auth_headers):
+    state = app.extensions['query_diagnostics']
+    state.enabled, state.slow_ms, state.repeat_threshold = True, 1000, 2
+
+    def owners():
+        # Lazy loads in a loop: one SELECT users per distinct owner
+        problems = db.session.query(Problem).order_by(Problem.id).all()
+        return jsonify([problem.user.email for problem in problems])
+
+    app.add_url_rule('/test/owners', 'owners', owners)
+    admin = make_user('admin')
+    headers = auth_headers(admin)
+    for _ in range(3):
+        make_problem(make_user('student'))
+    db.session.expunge_all()
+
+    assert client.get('/test/owners').status_code == 200
+    body = client.get('/api/admin/system/queries', headers=headers).get_json()
+    [repeated] = body['reports']
+    assert repeated['kind'] == 'repeated' and repeated['endpoint'] == 'owners'
+    assert repeated['max_executions'] == 3 and repeated['statement'].startswith('SELECT users.')
+    assert repeated['call_site'].startswith('test_query_diagnostics.py:') and 'owners' in repeated['call_site']
+
+    # Every statement is slow: each gets its plan
+    state.slow_ms = 0
+    client.get('/test/owners')
+    state.slow_ms = 1000
+    slow = client.get('/api/admin/system/queries?kind=slow', headers=headers).get_json()['reports']
+    [listing] = [report for report in slow if report['statement'].startswith('SELECT problems.')]
+    assert listing['plan'] and 'SCAN' in ' '.join(listing['plan'])
+    assert listing['endpoint'] == 'owners' and listing['occurrences'] == 1
+
+    # A failing statement leaves no timing on the pooled connection
+    with db.engine.connect() as connection:
+        with pytest.raises(Exception):
+            connection.exec_driver_sql('SELECT * FROM missing_table')
+        assert 'diagnostics_started' not in connection.info
+
+    assert client.get('/api/admin/system/queries?kind=other', headers=headers).status_code == 400
+    assert client.get('/api/admin/system/queries', headers=auth_headers(make_user('moderator'))).status_code == 403
+    assert client.delete('/api/admin/system/queries', headers=headers).status_code == 200
+    assert client.get('/api/admin/system/queries', headers=headers).get_json()['total'] == 0
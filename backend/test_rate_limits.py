@@ -0,0 +1,73 @@
+"""
+Tests en processus de la limitation de débit par identité
+"""
+
+import multiprocessing
+
+from extensions import limiter
+from services.rate_limits import SQLiteStorage
+
+# Long enough that no window boundary (which weighs the previous window in) falls in a test
+WINDOW = 10 ** 6
+
+
+def _hammer(uri, attempts, results):
+    storage = SQLiteStorage(uri)
+    results.put(sum(storage.acquire_sliding_window_entry('LIMITER/k', 100, WINDOW) for _ in range(attempts)))
+
+
+def test_sqlite_storage_is_shared_and_exact_across_processes(tmp_path):
+    uri = f'sqlite:///{tmp_path}/limits.sqlite3'
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    workers = [context.Process(target=_hammer, args=(uri, 50, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sum(results.get() for _ in workers) == 100
+
+    storage = SQLiteStorage(uri)
+    previous, _, current, ttl = storage.get_sliding_window('LIMITER/k', WINDOW)
+    assert previous + current == 100 and WINDOW < ttl <= 2 * WINDOW
+    assert storage.incr('fixed', 60) == 1 and storage.incr('fixed', 60, amount=2) == 3
+    assert storage.get('fixed') == 3
+    storage.clear_sliding_window('LIMITER/k', WINDOW)
+    assert storage.acquire_sliding_window_entry('LIMITER/k', 100, WINDOW)
+
+
+def test_quotas_follow_the_identity_and_role(app, client, make_user, auth_headers, tmp_path):
+    app.config.update(
+        RATELIMIT_ENABLED=True,
+        RATELIMIT_STORAGE_URI=f'sqlite:///{tmp_path}/limits.sqlite3',
+        RATELIMIT_ROLE_LIMITS={'anonymous': '2 per minute', 'student': '3 per minute'}
+    )
+    limiter.init_app(app)
+    try:
+        first, second = make_user('student'), make_user('student')
+
+        def statuses(headers=None, times=4):
+            return [client.get('/api/notifications/unread-count', headers=headers or {}).status_code
+                    for _ in range(times)]
+
+        # Same address for everyone: each student has their own quota
+        assert statuses(auth_headers(first)) == [200, 200, 200, 429]
+        assert statuses(auth_headers(second)) == [200, 200, 200, 429]
+        assert statuses() == [401, 401, 429, 429]
+        # An invalid token counts against the address, not a user
+        assert statuses({'Authorization': 'Bearer forged'}, times=1) == [429]
+
+        # Failed logins are counted per targeted account and address
+        def login(email, address='10.0.0.1'):
+            return client.post('/api/auth/login/', json={'email': email, 'password': 'wrong-password'},
+                               environ_base={'REMOTE_ADDR': address})
+
+        assert [login('a@example.com').status_code for _ in range(11)][-1] == 429
+        assert login('b@example.com').status_code == 401
+        # Another address is not locked out of the account
+        assert login('a@example.com', '10.0.0.2').status_code == 401
+        # The address itself is capped whatever the accounts tried
+        statuses = [login(f'c{i}@example.com').status_code for i in range(20)]
+        assert statuses[-2:] == [401, 429]
+    finally:
+        limiter.enabled = False
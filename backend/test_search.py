@@ -0,0 +1,72 @@
+"""
+Tests de la recherche plein texte (FTS5)
+"""
+
+import pytest
+from sqlalchemy import text
+
+from models import Problem
+
+
+@pytest.fixture
+def search(app, client, make_user, auth_headers):
+    app.config['RESPONSE_CACHE_ENABLED'] = False
+    headers = auth_headers(make_user('admin'))
+
+    def _search(term, **params):
+        response = client.get('/api/problems/all', headers=headers, query_string={'search': term, **params})
+        assert response.status_code == 200
+        return [p['id'] for p in response.get_json()['problems']]
+
+    return _search
+
+
+def test_accent_folding_and_prefix(search, make_user, make_problem):
+    student = make_user('student')
+    screen = make_problem(student, description="L'écran de la salle est cassé", type_of_problem='Écran')
+    projector = make_problem(student, description='Le projecteur clignote', type_of_problem='Vidéo')
+
+    assert search('ecran') == [screen.id]
+    assert search('ÉCRAN casse') == [screen.id]
+    assert search('proj') == [projector.id]
+    assert search('ecran projecteur') == []
+    assert search('"; DROP TABLE problems; --') == []
+
+
+def test_index_follows_updates_and_deletes(db, search, make_user, make_problem):
+    problem = make_problem(make_user('student'), description='Radiateur en panne depuis lundi')
+    assert search('radiateur') == [problem.id]
+
+    problem.description = 'Fenêtre bloquée, impossible de fermer'
+    problem.likes_count = 3
+    db.session.commit()
+    assert search('radiateur') == []
+    assert search('fenetre') == [problem.id]
+
+    db.session.delete(problem)
+    db.session.commit()
+    assert search('fenetre') == []
+
+
+def test_bm25_ranking(db, search, make_user, make_problem):
+    student = make_user('student')
+    passing = make_problem(student, description='La salle est froide et le wifi aussi parfois')
+    focused = make_problem(student, description='Le wifi coupe toutes les cinq minutes', type_of_problem='Wifi')
+
+    assert search('wifi') == [focused.id, passing.id]
+    passing.likes_count = 5
+    db.session.commit()
+    assert search('wifi') == [focused.id, passing.id]
+    # An explicit sort_by still wins over relevance
+    assert search('wifi', sort_by='likes') == [passing.id, focused.id]
+
+
+def test_rebuild_command(app, db, search, make_user, make_problem):
+    problem = make_problem(make_user('student'), description='Chaise cassée au premier rang')
+    db.session.execute(text("INSERT INTO problems_fts(problems_fts) VALUES ('delete-all')"))
+    db.session.commit()
+    assert search('chaise') == []
+
+    result = app.test_cli_runner().invoke(args=['search', 'rebuild'])
+    assert 'rebuilt' in result.output
+    assert search('chaise') == [problem.id]
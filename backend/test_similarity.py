@@ -0,0 +1,73 @@
+"""
+Tests en processus de la détection des quasi-doublons
+"""
+
+from models import Problem
+
+
+def similar(client, headers, **draft):
+    response = client.post('/api/problems/similar', headers=headers, json=draft)
+    assert response.status_code == 200, response.get_json()
+    return [(p['id'], p['similarity']) for p in response.get_json()['similar_problems']]
+
+
+def test_similar_open_problems_of_the_room(client, db, make_user, make_problem, auth_headers):
+    admin, student = make_user('admin'), make_user('student')
+    headers = auth_headers(student)
+    projector = make_problem(student, room='B204', type_of_problem='Projecteur',
+                             description="Le projecteur de la salle ne s'allume plus du tout")
+    make_problem(student, room='B204', type_of_problem='Chauffage',
+                 description='Le radiateur reste froid toute la matinée')
+    elsewhere = make_problem(student, room='A101', type_of_problem='Projecteur',
+                             description="Le projecteur de la salle ne s'allume plus du tout")
+
+    draft = {'room': 'b204 ', 'type_of_problem': 'projecteur',
+             'description': "Le projecteur de la salle ne s'allume plus depuis hier"}
+    [(problem_id, score)] = similar(client, headers, **draft)
+    assert problem_id == projector.id and 0.5 <= score < 1
+    assert similar(client, headers, room='B204', description='Wifi très lent') == []
+
+    # Incremental: state changes and new problems are picked up after commit
+    client.post('/api/admin/problems/bulk-update', headers=auth_headers(admin), json={
+        'problem_ids': [projector.id], 'action': 'change_status', 'new_status': 'Problème traité'
+    })
+    assert similar(client, headers, **draft) == []
+    again = make_problem(student, room='B204', type_of_problem='Projecteur',
+                         description="Projecteur de la salle : il ne s'allume plus")
+    assert [problem_id for problem_id, _ in similar(client, headers, **draft)] == [again.id]
+
+    # Deleted problems leave the index when met
+    client.post('/api/admin/problems/bulk-update', headers=auth_headers(admin), json={
+        'problem_ids': [again.id], 'action': 'delete'
+    })
+    assert similar(client, headers, **draft) == []
+    assert similar(client, headers, room='A101', description=elsewhere.description)[0][0] == elsewhere.id
+
+
+def test_submission_links_a_near_duplicate(app, client, db, make_user, make_problem, auth_headers):
+    first, second, third = make_user('student'), make_user('student'), make_user('student')
+    original = make_problem(first, room='B204', type_of_problem='Radiateur',
+                            description='Le radiateur reste froid depuis lundi matin')
+
+    def submit(student, description):
+        return client.post('/api/problems/', headers=auth_headers(student), json={
+            'promotion': 'B3', 'room': 'B204', 'category': 'Chauffage', 'type_of_problem': 'Radiateur',
+            'description': description, 'urgency': 3, 'remark': 'RAS'
+        })
+
+    # Auto-linking is opt-in
+    assert submit(third, 'Radiateur froid depuis lundi matin').get_json()['problem']['duplicate_of_id'] is None
+    app.config['SIMILARITY_AUTO_LINK_THRESHOLD'] = 0.8
+    response = submit(second, 'Le radiateur reste froid depuis lundi')
+    assert response.status_code == 201, response.get_json()
+    created = response.get_json()['problem']
+    assert created['duplicate_of_id'] == original.id
+    assert db.session.get(Problem, created['id']).state == 'Soumis'
+
+    # Deleting the original unlinks its duplicates
+    admin = make_user('admin')
+    client.post('/api/admin/problems/bulk-update', headers=auth_headers(admin), json={
+        'problem_ids': [original.id], 'action': 'delete'
+    })
+    db.session.expire_all()
+    assert db.session.get(Problem, created['id']).duplicate_of_id is None
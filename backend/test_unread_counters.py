@@ -0,0 +1,93 @@
+"""
+Tests en processus des compteurs de notifications non lues
+"""
+
+from models import Notification, User
+from services.notifications import count_unread, unread_count
+from services.unread_counters import compute_unread
+
+
+def assert_consistent(db, *users):
+    stored = {uid: (unread, seen) for uid, unread, seen in
+              db.session.query(User.id, User.unread_notifications, User.broadcasts_seen)}
+    assert stored == compute_unread()
+    for user in users:
+        assert unread_count(user.id) == count_unread(user.id), user
+
+
+def test_counters_follow_every_notification_path(client, db, make_user, make_problem, auth_headers, count_queries):
+    admin = make_user('admin')
+    students = [make_user('student') for _ in range(3)]
+    first, second, third = students
+    admin_headers, headers = auth_headers(admin), auth_headers(first)
+    everyone = [admin] + students
+
+    def broadcast(title):
+        client.post('/api/admin/notifications', headers=admin_headers,
+                    json={'title': title, 'message': 'm', 'broadcast': True})
+        return db.session.query(Notification.id).filter_by(title=title).scalar()
+
+    def direct(title, user):
+        client.post('/api/admin/notifications', headers=admin_headers,
+                    json={'title': title, 'message': 'm', 'user_ids': [user.id]})
+        return db.session.query(Notification.id).filter_by(title=title).scalar()
+
+    # Creation: broadcast, personal, per-admin broadcast on problem submission, bulk Core insert
+    general = broadcast('Général')
+    personal = direct('Perso', first)
+    direct('Perso 2', first)
+    client.post('/api/problems/', headers=auth_headers(second), json={
+        'promotion': 'B3', 'room': 'B204', 'category': 'Chauffage', 'type_of_problem': 'Radiateur',
+        'description': 'Le radiateur reste froid', 'urgency': 3, 'remark': 'RAS'
+    })
+    problems = [make_problem(first), make_problem(second)]
+    client.post('/api/admin/problems/bulk-update', headers=admin_headers, json={
+        'problem_ids': [p.id for p in problems], 'action': 'change_status', 'new_status': 'Problème traité'
+    })
+    assert_consistent(db, *everyone)
+    assert unread_count(first.id) == 4
+
+    # Reading and deleting one notification, personal or broadcast
+    client.post(f'/api/notifications/{personal}/read', headers=headers)
+    client.post(f'/api/notifications/{personal}/read', headers=headers)
+    client.post(f'/api/notifications/{general}/read', headers=headers)
+    client.delete(f'/api/notifications/{general}', headers=auth_headers(second))
+    assert_consistent(db, *everyone)
+    assert unread_count(first.id) == 2
+
+    # Accounts created later do not count older broadcasts
+    late = make_user('student')
+    broadcast('Suivant')
+    assert unread_count(late.id) == 1
+    everyone.append(late)
+
+    client.post('/api/notifications/read-all', headers=headers)
+    client.delete('/api/notifications/clear-all', headers=auth_headers(third))
+    assert_consistent(db, *everyone)
+    assert unread_count(first.id) == unread_count(third.id) == 0
+
+    # A role change changes the visible broadcasts
+    response = client.put(f'/api/admin/users/{second.id}', headers=admin_headers, json={'role': 'admin'})
+    assert response.status_code == 200, response.get_json()
+    assert_consistent(db, *everyone)
+
+    # Reading the count is a single statement, whatever the inbox size
+    with count_queries() as statements:
+        response = client.get('/api/notifications/unread-count', headers=headers)
+    assert response.get_json() == {'unread_count': 0}
+    assert len(statements) == 1 and 'count(' not in statements[0].lower()
+
+
+def test_repair_command_fixes_drifted_counters(app, db, make_user):
+    users = [make_user('student') for _ in range(3)]
+    db.session.add(Notification(user_id=users[0].id, title='t', message='m', type='system'))
+    db.session.commit()
+    # Raw SQL bypasses the hooks
+    db.session.execute(User.__table__.update().where(User.id == users[1].id).values(unread_notifications=7))
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['notifications', 'repair'])
+    assert result.exit_code == 0, result.output
+    assert 'Unread counters repaired: 3 users, 1 corrected' in result.output
+    assert_consistent(db, *users)
+    assert unread_count(users[0].id) == 1